@@ -0,0 +1,469 @@
+# arena.py
+# The Arena is a struct-of-arrays form of the AST: every node is an index into parallel typed arrays holding its kind and
+# up to three integer fields, instead of a Python object of its own. Child lists (block statements, call arguments and
+# list elements) are runs in a shared extra array; literal values and names live in two pools.
+# The ArenaInterpreter runs a program straight from its arena and behaves exactly like the tree-walking Interpreter.
+#
+# Fields of each node kind (slot -1 means a global, else -1 means no else branch):
+#   NUMBER, STRING, BOOLEAN, CONSTANT_LIST   a = const
+#   IDENTIFIER      a = name, b = slot, c = depth of the slot's function (see resolver.py)
+#   ASSIGN_NAME     a = value, b = name, c = slot
+#   ASSIGN_INDEX    a = value, b = list, c = index
+#   INVALID_ASSIGN  a = value, b = target
+#   BINARY          a = left, b = right, c = operator name
+#   UNARY           a = operand, c = operator name
+#   FUNCTION        a = const holding the ArenaFunction, b = slot, c = 1 when it captures its enclosing frame
+#   RETURN, PRINT   a = value
+#   CALL            a = callee, b = start of the arguments in extra, c = argument count
+#   MEMBER_CALL     a = object, b = start in extra (member name, then the arguments), c = argument count
+#   BLOCK, LIST     b = start in extra, c = count
+#   MAP             b = start in extra (keys and values interleaved), c = entry count
+#   WHILE           a = condition, b = body, c = number of nodes in the loop, charged per iteration
+#   LIST_ACCESS     a = list, b = index
+#   IF              a = condition, b = then branch, c = else branch
+
+from array import array
+from ast_nodes import *
+from interpreter import Interpreter
+from resolver import resolve_function, frame_size, closure, enclosing_frame
+from runtime import UNARY_OPERATORS, UNSET, unknown_binary, map_error
+from runtime import ReturnSignal, BreakSignal, ContinueSignal
+
+(NUMBER, STRING, BOOLEAN, CONSTANT_LIST, IDENTIFIER, ASSIGN_NAME, ASSIGN_INDEX, INVALID_ASSIGN, BINARY, UNARY,
+ FUNCTION, RETURN, BREAK, CONTINUE, CALL, MEMBER_CALL, BLOCK, LIST, WHILE, PRINT, LIST_ACCESS, IF, MAP) = range(23)
+
+_LITERAL_KINDS = {Number: NUMBER, StringLiteral: STRING, BooleanLiteral: BOOLEAN}
+_LITERAL_NODES = {NUMBER: Number, STRING: StringLiteral, BOOLEAN: BooleanLiteral}
+
+
+class ArenaFunction(Function):
+    """A function whose body lives in an arena."""
+    __slots__ = ('arena', 'root', 'weight')
+    def __init__(self, name, parameters, local_names, arena, root, weight, memo=False, captures=False):
+        super().__init__(name, parameters, None, memo)
+        self.locals = local_names
+        self.captures = captures
+        self.arena = arena
+        self.root = root
+        self.weight = weight  # Number of nodes in the body, charged per call
+    def __repr__(self):
+        return f"Function({self.name}, {self.parameters}, {self.arena.to_ast(self.root)})"
+
+
+class Arena:
+    """Stores an AST as parallel arrays of node kinds and integer fields."""
+    def __init__(self):
+        self.kinds = array('B')
+        self.a = array('i')
+        self.b = array('i')
+        self.c = array('i')
+        self.extra = array('i')  # Runs of child indices, and member names
+        self.consts = []  # Literal values and ArenaFunctions
+        self.sites = {}   # Inline caches: CALL node -> (ArenaFunction, frame size) of the last function it called
+        self.names = []   # Interned variable, member and operator names
+        self.name_indexes = {}
+        self.root = -1    # Index of the node the program starts at
+
+    @classmethod
+    def from_ast(cls, program):
+        """Builds an arena holding program, whose root becomes the arena's root."""
+        arena = cls()
+        arena.root = arena.add(program)
+        return arena
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def nbytes(self):
+        """Returns the size of the node arrays in bytes, not counting the pools."""
+        return sum(column.itemsize * len(column) for column in (self.kinds, self.a, self.b, self.c, self.extra))
+
+    def node(self, kind, a=0, b=0, c=0):
+        self.kinds.append(kind)
+        self.a.append(a)
+        self.b.append(b)
+        self.c.append(c)
+        return len(self.kinds) - 1
+
+    def const(self, value):
+        self.consts.append(value)
+        return len(self.consts) - 1
+
+    def name(self, name):
+        index = self.name_indexes.get(name)
+        if index is None:
+            index = self.name_indexes[name] = len(self.names)
+            self.names.append(name)
+        return index
+
+    def run(self, children, prefix=()):
+        """Stores a run of child indices in extra and returns its start."""
+        start = len(self.extra)
+        self.extra.extend(prefix)
+        self.extra.extend(children)
+        return start
+
+    def add(self, expr):
+        """Adds an AST node and its children, returning the index of the node."""
+        kind = _LITERAL_KINDS.get(type(expr))
+        if kind is not None:
+            return self.node(kind, self.const(expr.value))
+        if isinstance(expr, ConstantList):
+            return self.node(CONSTANT_LIST, self.const(expr.values))
+        if isinstance(expr, Identifier):
+            return self.node(IDENTIFIER, self.name(expr.name), _slot(expr.slot), expr.depth)
+        if isinstance(expr, Assignment):
+            value = self.add(expr.value)
+            target = expr.target
+            if isinstance(target, Identifier):
+                return self.node(ASSIGN_NAME, value, self.name(target.name), _slot(target.slot))
+            if isinstance(target, ListAccess):
+                return self.node(ASSIGN_INDEX, value, self.add(target.list_expr), self.add(target.index_expr))
+            return self.node(INVALID_ASSIGN, value, self.add(target))
+        if isinstance(expr, Binary):
+            left = self.add(expr.left)
+            return self.node(BINARY, left, self.add(expr.right), self.name(expr.operator))
+        if isinstance(expr, Unary):
+            return self.node(UNARY, self.add(expr.operand), 0, self.name(expr.operator))
+        if isinstance(expr, Function):
+            resolve_function(expr)
+            start = len(self.kinds)
+            root = self.add(expr.body)
+            func = ArenaFunction(expr.name, expr.parameters, expr.locals, self, root, len(self.kinds) - start,
+                                 expr.memo, expr.captures)
+            return self.node(FUNCTION, self.const(func), _slot(expr.slot), int(expr.captures))
+        if isinstance(expr, Return):
+            return self.node(RETURN, self.add(expr.value))
+        if isinstance(expr, Break):
+            return self.node(BREAK)
+        if isinstance(expr, Continue):
+            return self.node(CONTINUE)
+        if isinstance(expr, Call):
+            callee = self.add(expr.callee)
+            arguments = [self.add(argument) for argument in expr.arguments]
+            return self.node(CALL, callee, self.run(arguments), len(arguments))
+        if isinstance(expr, MemberCall):
+            object_node = self.add(expr.object_expr)
+            arguments = [self.add(argument) for argument in expr.arguments]
+            start = self.run(arguments, prefix=(self.name(expr.member_name),))
+            return self.node(MEMBER_CALL, object_node, start, len(arguments))
+        if isinstance(expr, (Block, ListLiteral)):
+            children = expr.statements if isinstance(expr, Block) else expr.elements
+            indexes = [self.add(child) for child in children]
+            return self.node(BLOCK if isinstance(expr, Block) else LIST, 0, self.run(indexes), len(indexes))
+        if isinstance(expr, MapLiteral):
+            entries = []
+            for key, value in zip(expr.keys, expr.values):
+                entries.append(self.add(key))
+                entries.append(self.add(value))
+            return self.node(MAP, 0, self.run(entries), len(expr.keys))
+        if isinstance(expr, While):
+            start = len(self.kinds)
+            condition = self.add(expr.condition)
+            body = self.add(expr.body)
+            return self.node(WHILE, condition, body, len(self.kinds) + 1 - start)
+        if isinstance(expr, Print):
+            return self.node(PRINT, self.add(expr.expr))
+        if isinstance(expr, ListAccess):
+            list_node = self.add(expr.list_expr)
+            return self.node(LIST_ACCESS, list_node, self.add(expr.index_expr))
+        if isinstance(expr, If):
+            condition = self.add(expr.condition)
+            then_branch = self.add(expr.then_branch)
+            else_branch = self.add(expr.else_branch) if expr.else_branch is not None else -1
+            return self.node(IF, condition, then_branch, else_branch)
+        raise Exception("Unknown expression type")
+
+    def to_ast(self, index):
+        """Rebuilds the AST node stored at index."""
+        kind, a, b, c = self.kinds[index], self.a[index], self.b[index], self.c[index]
+        extra = self.extra
+        if kind in _LITERAL_NODES:
+            return _LITERAL_NODES[kind](self.consts[a])
+        if kind == CONSTANT_LIST:
+            return ConstantList(self.consts[a])
+        if kind == IDENTIFIER:
+            return _identifier(self.names[a], b, c)
+        if kind == ASSIGN_NAME:
+            return Assignment(_identifier(self.names[b], c), self.to_ast(a))
+        if kind == ASSIGN_INDEX:
+            return Assignment(ListAccess(self.to_ast(b), self.to_ast(c)), self.to_ast(a))
+        if kind == INVALID_ASSIGN:
+            return Assignment(self.to_ast(b), self.to_ast(a))
+        if kind == BINARY:
+            return Binary(self.to_ast(a), self.names[c], self.to_ast(b))
+        if kind == UNARY:
+            return Unary(self.names[c], self.to_ast(a))
+        if kind == FUNCTION:
+            func = self.consts[a]
+            node = Function(func.name, func.parameters, self.to_ast(func.root), func.memo)
+            node.slot = b if b >= 0 else None
+            node.captures = func.captures
+            return node
+        if kind == RETURN:
+            return Return(self.to_ast(a))
+        if kind == BREAK:
+            return Break()
+        if kind == CONTINUE:
+            return Continue()
+        if kind == CALL:
+            return Call(self.to_ast(a), [self.to_ast(i) for i in extra[b:b + c]])
+        if kind == MEMBER_CALL:
+            return MemberCall(self.to_ast(a), self.names[extra[b]], [self.to_ast(i) for i in extra[b + 1:b + 1 + c]])
+        if kind == BLOCK:
+            return Block([self.to_ast(i) for i in extra[b:b + c]])
+        if kind == LIST:
+            return ListLiteral([self.to_ast(i) for i in extra[b:b + c]])
+        if kind == MAP:
+            entries = [self.to_ast(i) for i in extra[b:b + 2 * c]]
+            return MapLiteral(entries[0::2], entries[1::2])
+        if kind == WHILE:
+            return While(self.to_ast(a), self.to_ast(b))
+        if kind == PRINT:
+            return Print(self.to_ast(a))
+        if kind == LIST_ACCESS:
+            return ListAccess(self.to_ast(a), self.to_ast(b))
+        if kind == IF:
+            return If(self.to_ast(a), self.to_ast(b), self.to_ast(c) if c >= 0 else None)
+        raise Exception(f"Unknown node kind: {kind}")
+
+def _slot(slot):
+    return -1 if slot is None else slot
+
+def _identifier(name, slot, depth=0):
+    node = Identifier(name)
+    node.slot = slot if slot >= 0 else None
+    node.depth = depth
+    return node
+
+
+class ArenaInterpreter(Interpreter):
+    """Evaluates an AST by storing it in an arena and running it from there."""
+    def __init__(self, budget=None):
+        super().__init__(budget)
+        self.function_arenas = {}  # Function node from outside an arena -> its ArenaFunction
+
+    def evaluate(self, expr):
+        return self.run(Arena.from_ast(expr))
+
+    def run(self, arena):
+        """Runs the program at the root of an arena."""
+        return self.execute(arena, arena.root)
+
+    def prepare(self, program):
+        return Arena.from_ast(super().prepare(program))
+
+    def run_prepared(self, prepared):
+        return self.run(prepared)
+
+    def call_function(self, func, args):
+        if not isinstance(func, ArenaFunction):
+            lowered = self.function_arenas.get(func)
+            if lowered is None:
+                arena = Arena()
+                lowered = self.function_arenas[func] = arena.consts[arena.a[arena.add(func)]]
+            func = lowered
+        self.fuel -= func.weight
+        if self.fuel < 0:
+            self.checkpoint()
+        # Check parameter count
+        if len(args) != len(func.parameters):
+            raise Exception("Function argument count mismatch")
+        frame = [UNSET] * frame_size(func)
+        frame[:len(args)] = args
+        old_frame = self.frame
+        frame[-2] = func
+        frame[-1] = old_frame
+        self.frame = frame
+        try:
+            return self.execute(func.arena, func.root)
+        except ReturnSignal as signal:
+            return signal.value
+        finally:
+            self.frame = old_frame
+
+    def execute(self, arena, index):
+        kind = arena.kinds[index]
+        if kind == IDENTIFIER:
+            slot = arena.b[index]
+            if slot >= 0:
+                depth = arena.c[index]
+                value = (self.frame if not depth else enclosing_frame(self.frame, depth))[slot]
+                if value is not UNSET:
+                    return value
+            name = arena.names[arena.a[index]]
+            value = self.variables.get(name, UNSET)
+            if value is not UNSET:
+                return value
+            return self.lookup_builtin(name, self.frame)
+
+        elif kind == NUMBER or kind == STRING or kind == BOOLEAN:
+            return arena.consts[arena.a[index]]
+
+        elif kind == BINARY:
+            left_val = self.execute(arena, arena.a[index])
+            right_val = self.execute(arena, arena.b[index])
+            return self.binary_operators.get(arena.names[arena.c[index]], unknown_binary)(left_val, right_val)
+
+        elif kind == ASSIGN_NAME:
+            value = self.execute(arena, arena.a[index])
+            slot = arena.c[index]
+            if slot >= 0:
+                self.frame[slot] = value
+            else:
+                self.variables[arena.names[arena.b[index]]] = value
+            return value
+
+        elif kind == BLOCK:
+            # return, break and continue unwind as exceptions, so the normal path needs no checks.
+            result = None
+            start = arena.b[index]
+            for statement in arena.extra[start:start + arena.c[index]]:
+                result = self.execute(arena, statement)
+            return result
+
+        elif kind == IF:
+            if self.execute(arena, arena.a[index]):
+                return self.execute(arena, arena.b[index])
+            elif arena.c[index] >= 0:
+                return self.execute(arena, arena.c[index])
+            return None
+
+        elif kind == WHILE:
+            condition, body, weight = arena.a[index], arena.b[index], arena.c[index]
+            while self.execute(arena, condition):
+                self.fuel -= weight
+                if self.fuel < 0:
+                    self.checkpoint()
+                try:
+                    self.execute(arena, body)
+                except BreakSignal:
+                    break
+                except ContinueSignal:
+                    continue
+            return None
+
+        elif kind == CALL:
+            callee = self.execute(arena, arena.a[index])
+            start = arena.b[index]
+            args = [self.execute(arena, arg) for arg in arena.extra[start:start + arena.c[index]]]
+            site = arena.sites.get(index)
+            if site is None or callee is not site[0]:
+                if not isinstance(callee, Function):
+                    return self.call_native(callee, args)
+                if callee.memo or len(args) != len(callee.parameters) or not isinstance(callee, ArenaFunction):
+                    return self.call_memo(callee, args) if callee.memo else self.call_function(callee, args)
+                site = arena.sites[index] = (callee, frame_size(callee))
+            func, size = site
+            self.fuel -= func.weight
+            if self.fuel < 0:
+                self.checkpoint()
+            frame = [UNSET] * size
+            frame[:len(args)] = args
+            old_frame = self.frame
+            frame[-2] = func
+            frame[-1] = old_frame
+            self.frame = frame
+            try:
+                return self.execute(func.arena, func.root)
+            except ReturnSignal as signal:
+                return signal.value
+            finally:
+                self.frame = old_frame
+
+        elif kind == RETURN:
+            raise ReturnSignal(self.execute(arena, arena.a[index]))
+
+        elif kind == LIST_ACCESS:
+            list_val = self.execute(arena, arena.a[index])
+            index_val = self.execute(arena, arena.b[index])
+            try:
+                if type(list_val) is dict:
+                    return list_val[index_val]
+                return list_val[int(index_val)]
+            except Exception as e:
+                if type(list_val) is dict:
+                    raise map_error(index_val, e)
+                raise Exception(f"Error accessing list at index {index_val}: {e}")
+
+        elif kind == ASSIGN_INDEX:
+            value = self.execute(arena, arena.a[index])
+            list_val = self.execute(arena, arena.b[index])
+            index_val = self.execute(arena, arena.c[index])
+            try:
+                if type(list_val) is dict:
+                    list_val[index_val] = value
+                else:
+                    list_val[int(index_val)] = value
+            except Exception as e:
+                if type(list_val) is dict:
+                    raise map_error(index_val, e)
+                raise Exception(f"Error assigning list element at index {index_val}: {e}")
+            return value
+
+        elif kind == UNARY:
+            operand = self.execute(arena, arena.a[index])
+            operator = arena.names[arena.c[index]]
+            if operator not in UNARY_OPERATORS:
+                raise Exception(f"Unknown unary operator: {operator}")
+            return UNARY_OPERATORS[operator](operand)
+
+        elif kind == MEMBER_CALL:
+            object_val = self.execute(arena, arena.a[index])
+            start = arena.b[index]
+            args = [self.execute(arena, arg) for arg in arena.extra[start + 1:start + 1 + arena.c[index]]]
+            return self.call_member(object_val, arena.names[arena.extra[start]], args)
+
+        elif kind == LIST:
+            start = arena.b[index]
+            self.allocated += arena.c[index]
+            return [self.execute(arena, element) for element in arena.extra[start:start + arena.c[index]]]
+
+        elif kind == MAP:
+            start, count = arena.b[index], arena.c[index]
+            self.allocated += count
+            result = {}
+            extra = arena.extra
+            for position in range(start, start + 2 * count, 2):
+                key = self.execute(arena, extra[position])
+                value = self.execute(arena, extra[position + 1])
+                try:
+                    result[key] = value
+                except TypeError as e:
+                    raise map_error(key, e)
+            return result
+
+        elif kind == CONSTANT_LIST:
+            values = arena.consts[arena.a[index]]
+            self.allocated += len(values)
+            return list(values)
+
+        elif kind == PRINT:
+            value = self.execute(arena, arena.a[index])
+            print(">>", value, file=self.stdout)
+            return value
+
+        elif kind == FUNCTION:
+            # A function definition evaluates to itself, or to a closure over the current frame, and is stored in the
+            # current scope.
+            func = arena.consts[arena.a[index]]
+            if arena.c[index]:
+                func = closure(func, self.frame)
+            slot = arena.b[index]
+            if slot >= 0:
+                self.frame[slot] = func
+            else:
+                self.variables[func.name] = func
+            return func
+
+        elif kind == BREAK:
+            raise BreakSignal()
+
+        elif kind == CONTINUE:
+            raise ContinueSignal()
+
+        elif kind == INVALID_ASSIGN:
+            self.execute(arena, arena.a[index])
+            raise Exception("Invalid assignment target")
+
+        raise Exception(f"Unknown node kind: {kind}")
@@ -1,23 +1,28 @@
 # ast_nodes.py
+# Every node class declares __slots__, so a node is a fixed-size record without a per-instance __dict__.
+# The slots of a class list its fields; iter_child_nodes and the optimizer walk them to find child nodes.
 
 class Expr:
     """Base class for all AST nodes, inheritance is used to define node types."""
-    pass
+    __slots__ = ()
 
 class Number(Expr):
     """Represents a numeric literal."""
+    __slots__ = ('value',)
     def __init__(self, value):
         self.value = value
     def __repr__(self):
         return f"Number({self.value})"
 
 class BooleanLiteral(Expr):
+    __slots__ = ('value',)
     def __init__(self, value: bool):
         self.value = value
     def __repr__(self):
         return f"BooleanLiteral({self.value})"
 
 class Unary(Expr):
+    __slots__ = ('operator', 'operand')
     def __init__(self, operator, operand):
         self.operator = operator  # e.g., "!" or "not"
         self.operand = operand
@@ -25,6 +30,7 @@ class Unary(Expr):
         return f"UnaryOp({self.operator}, {self.operand})"
 
 class Binary(Expr):
+    __slots__ = ('left', 'operator', 'right')
     def __init__(self, left, operator, right):
         self.left = left
         self.operator = operator  # e.g., "+", "-", "==", "and", "or", "<", etc.
@@ -33,18 +39,23 @@ class Binary(Expr):
         return f"Binary({self.left}, {self.operator}, {self.right})"
     
 class StringLiteral(Expr):
+    __slots__ = ('value',)
     def __init__(self, value):
         self.value = value
     def __repr__(self):
         return f'StringLiteral({repr(self.value)})'
 
 class Identifier(Expr):
+    __slots__ = ('name', 'slot', 'depth')
     def __init__(self, name):
         self.name = name
+        self.slot = None  # Frame slot assigned by the resolver; None means a global variable.
+        self.depth = 0    # How many functions out the slot is: 0 for the function's own locals.
     def __repr__(self):
         return f"Identifier({self.name})"
 
 class Assignment(Expr):
+    __slots__ = ('target', 'value')
     def __init__(self, target, value):
         self.target = target  # This can be an Identifier, ListAccess, etc.
         self.value = value
@@ -52,12 +63,14 @@ class Assignment(Expr):
         return f"Assignment({self.target}, {self.value})"
     
 class Print(Expr):
+    __slots__ = ('expr',)
     def __init__(self, expr):
         self.expr = expr
     def __repr__(self):
         return f"Print({self.expr})"
     
 class While(Expr):
+    __slots__ = ('condition', 'body')
     def __init__(self, condition, body):
         self.condition = condition  # An expression that evaluates to True/False.
         self.body = body            # The body is typically a statement or a block.
@@ -65,19 +78,14 @@ class While(Expr):
         return f"While({self.condition}, {self.body})"
     
 class Block(Expr):
+    __slots__ = ('statements',)
     def __init__(self, statements):
         self.statements = statements  # List of statements/expressions
     def __repr__(self):
         return f"Block({self.statements})"
     
 class If(Expr):
-    def __init__(self, condition, then_branch):
-        self.condition = condition
-        self.then_branch = then_branch
-    def __repr__(self):
-        return f"If({self.condition}, {self.then_branch})"
-    
-class If(Expr):
+    __slots__ = ('condition', 'then_branch', 'else_branch')
     def __init__(self, condition, then_branch, else_branch=None):
         self.condition = condition
         self.then_branch = then_branch
@@ -89,13 +97,31 @@ class If(Expr):
             return f"If({self.condition}, {self.then_branch})"
         
 class ListLiteral(Expr):
+    __slots__ = ('elements',)
     def __init__(self, elements):
         self.elements = elements  # A list of expressions
 
     def __repr__(self):
         return f"ListLiteral({self.elements})"
     
+class ConstantList(Expr):
+    """A list literal made only of constants, precomputed by the optimizer."""
+    __slots__ = ('values',)
+    def __init__(self, values):
+        self.values = tuple(values)  # Plain values, copied into a new list on every evaluation
+    def __repr__(self):
+        return f"ConstantList({list(self.values)})"
+
+class MapLiteral(Expr):
+    __slots__ = ('keys', 'values')
+    def __init__(self, keys, values):
+        self.keys = keys      # A list of key expressions
+        self.values = values  # A list of value expressions, one per key
+    def __repr__(self):
+        return f"MapLiteral({self.keys}, {self.values})"
+
 class ListAccess(Expr):
+    __slots__ = ('list_expr', 'index_expr')
     def __init__(self, list_expr, index_expr):
         self.list_expr = list_expr
         self.index_expr = index_expr
@@ -103,6 +129,7 @@ class ListAccess(Expr):
         return f"ListAccess({self.list_expr}, {self.index_expr})"
 
 class MemberCall(Expr):
+    __slots__ = ('object_expr', 'member_name', 'arguments')
     def __init__(self, object_expr, member_name, arguments):
         self.object_expr = object_expr
         self.member_name = member_name  # e.g. "push_back"
@@ -111,22 +138,67 @@ class MemberCall(Expr):
         return f"MemberCall({self.object_expr}, {self.member_name}, {self.arguments})"
     
 class Function(Expr):
-    def __init__(self, name, parameters, body):
+    __slots__ = ('name', 'parameters', 'body', 'slot', 'locals', 'memo', 'captures', 'enclosing')
+    def __init__(self, name, parameters, body, memo=False):
         self.name = name              # a string
         self.parameters = parameters  # list of parameter names (strings)
         self.body = body              # a Block node (the function body)
+        self.memo = memo              # True for a memo fun, whose results are cached by argument values
+        self.slot = None    # Frame slot of the function's name in the enclosing function; None means global.
+        self.locals = None  # Names of the parameters and local variables, in slot order, once resolved.
+        self.captures = False  # True when the body reads variables of an enclosing function.
+        self.enclosing = None  # Frame the function was defined in, on the closures made from a capturing function.
     def __repr__(self):
         return f"Function({self.name}, {self.parameters}, {self.body})"
 
 class Return(Expr):
+    __slots__ = ('value',)
     def __init__(self, value):
         self.value = value
     def __repr__(self):
         return f"Return({self.value})"
 
+class Break(Expr):
+    __slots__ = ()
+    def __repr__(self):
+        return "Break()"
+
+class Continue(Expr):
+    __slots__ = ()
+    def __repr__(self):
+        return "Continue()"
+
 class Call(Expr):
+    __slots__ = ('callee', 'arguments', 'site')
     def __init__(self, callee, arguments):
         self.callee = callee
         self.arguments = arguments
+        self.site = None  # Inline cache of the tree interpreter: the last Function called here, see Interpreter.evaluate
     def __repr__(self):
-        return f"Call({self.callee}, {self.arguments})"
\ No newline at end of file
+        return f"Call({self.callee}, {self.arguments})"
+
+def count_nodes(node):
+    """Returns the number of nodes in the tree rooted at node."""
+    count = 0
+    for _ in walk(node):
+        count += 1
+    return count
+
+def walk(node):
+    """Yields every node in the tree rooted at node, in no particular order."""
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(iter_child_nodes(node))
+
+def iter_child_nodes(node):
+    """Yields the direct child nodes of an AST node."""
+    for field in node.__slots__:
+        value = getattr(node, field)
+        if isinstance(value, Expr):
+            yield value
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, Expr):
+                    yield item
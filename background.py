@@ -0,0 +1,69 @@
+# background.py
+# The BackgroundRunner runs programs for the editor on a worker thread, so a long loop never blocks the Tk main loop.
+# Output printed by the program is collected as it is produced; the UI thread picks it up in batches with drain(),
+# which never blocks. stop() cancels the running program cooperatively: every engine checks for cancellation on each
+# loop iteration and function call.
+
+import threading
+from collections import deque
+
+
+class _OutputBuffer:
+    """A file-like object that collects printed text from the worker thread."""
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def write(self, text):
+        self.chunks.append(text)  # deque.append is atomic, so no lock is needed.
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+class BackgroundRunner:
+    """Runs session updates on a worker thread and buffers what they print."""
+    def __init__(self, session):
+        self.session = session
+        self.chunks = deque()
+        self.thread = None
+        self.outcome = None  # ("result", value) or ("error", message) once a run has finished
+        session.interpreter.stdout = _OutputBuffer(self.chunks)
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, source, rerun=False):
+        """Starts running source on the worker thread; returns False if a run is already in progress."""
+        if self.running:
+            return False
+        self.outcome = None
+        self.session.interpreter.cancelled = False
+        self.thread = threading.Thread(target=self._work, args=(source, rerun), daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self):
+        """Cancels the running program, which stops at its next loop iteration or function call."""
+        if self.running:
+            self.session.interpreter.cancel()
+
+    def join(self, timeout=None):
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def drain(self):
+        """Returns the text printed since the last call, and the outcome of the run if it has finished."""
+        # Read the outcome first, so that no output printed before it was set can be left behind.
+        outcome = self.outcome if not self.running else None
+        parts = []
+        while self.chunks:
+            parts.append(self.chunks.popleft())
+        return "".join(parts), outcome
+
+    def _work(self, source, rerun):
+        try:
+            self.outcome = ("result", self.session.update(source, rerun))
+        except Exception as e:
+            self.outcome = ("error", str(e))
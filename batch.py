@@ -0,0 +1,104 @@
+# batch.py
+# Runs many independent script files across a pool of worker processes.
+# Every script runs in a fresh interpreter in a worker, with its printed output captured. The results are written as
+# JSON Lines, one object per file in the order the files were given, followed by a summary line with the totals.
+# Files are handed to the workers in chunks, so the cost of sending work between processes stays small next to the
+# cost of running the scripts themselves.
+#
+#   python batch.py "scripts/**/*.txt" --workers 8 --engine vm --output results.jsonl
+
+import io
+import sys
+import glob
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from engines import ENGINES, DEFAULT_ENGINE, create_interpreter
+from cache import load_program
+from main import run_arena, add_budget_arguments, budget_from_args
+
+CHUNK_SIZE = 16  # Files sent to a worker at a time
+
+
+def expand_paths(patterns):
+    """Expands glob patterns into a list of files, keeping the given order and dropping duplicates."""
+    files = []
+    seen = set()
+    for pattern in patterns:
+        # A path that matches nothing is kept, so that it is reported as a failed file.
+        for path in sorted(glob.glob(pattern, recursive=True)) or [pattern]:
+            if path not in seen:
+                seen.add(path)
+                files.append(path)
+    return files
+
+def run_file(file_path, engine=DEFAULT_ENGINE, optimize_ast=True, use_cache=True, budget=None):
+    """Runs one script in a fresh interpreter and returns a JSON-ready record of what happened."""
+    interpreter = create_interpreter(engine, budget)
+    interpreter.stdout = output = io.StringIO()
+    started = time.perf_counter()
+    error = None
+    try:
+        run_arena(interpreter, load_program(file_path, optimize_ast, use_cache))
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    return {"file": file_path, "ok": error is None, "output": output.getvalue(), "error": error,
+            "seconds": round(time.perf_counter() - started, 6)}
+
+def _run_file(arguments):
+    return run_file(*arguments)
+
+def run_batch(files, workers=None, engine=DEFAULT_ENGINE, optimize_ast=True, use_cache=True, budget=None):
+    """Yields the result of running each file, in order. workers=1 runs them in this process."""
+    jobs = ((file_path, engine, optimize_ast, use_cache, budget) for file_path in files)
+    if workers == 1:
+        yield from map(_run_file, jobs)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(_run_file, jobs, chunksize=CHUNK_SIZE)
+
+def write_results(results, out):
+    """Writes each result as a line of JSON and returns the summary, which is written last."""
+    started = time.perf_counter()
+    summary = {"files": 0, "failed": 0, "script_seconds": 0.0}
+    for result in results:
+        out.write(json.dumps(result) + "\n")
+        summary["files"] += 1
+        summary["failed"] += not result["ok"]
+        summary["script_seconds"] += result["seconds"]
+    summary["script_seconds"] = round(summary["script_seconds"], 6)
+    summary["wall_seconds"] = round(time.perf_counter() - started, 6)
+    out.write(json.dumps({"summary": summary}) + "\n")
+    return summary
+
+def parse_args(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Run many programs in parallel and report the results as JSON Lines.")
+    arg_parser.add_argument("files", nargs="+", help="programs to run; glob patterns such as 'scripts/**/*.txt' are expanded")
+    arg_parser.add_argument("--workers", type=int, default=None,
+                            help="number of worker processes (default: one per CPU)")
+    arg_parser.add_argument("--engine", choices=ENGINES, default=DEFAULT_ENGINE,
+                            help="execution engine (default: %(default)s)")
+    arg_parser.add_argument("--no-optimize", dest="optimize", action="store_false",
+                            help="skip constant folding and dead-branch elimination")
+    arg_parser.add_argument("--no-cache", dest="cache", action="store_false",
+                            help="neither read nor write the parsed-program cache")
+    arg_parser.add_argument("--output", help="file to write the results to (default: standard output)")
+    add_budget_arguments(arg_parser)
+    return arg_parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    files = expand_paths(args.files)
+    results = run_batch(files, args.workers, args.engine, args.optimize, args.cache, budget_from_args(args))
+    if args.output:
+        with open(args.output, 'w') as out:
+            summary = write_results(results, out)
+    else:
+        summary = write_results(results, sys.stdout)
+    print(f"Ran {summary['files']} files ({summary['failed']} failed) in {summary['wall_seconds']:.2f}s "
+          f"({summary['script_seconds']:.2f}s in scripts)", file=sys.stderr)
+    return 1 if summary["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
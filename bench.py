@@ -0,0 +1,220 @@
+# bench.py
+# The benchmark suite: times tokenizing, parsing and evaluating a corpus of representative programs, and compares two
+# sets of results to find regressions.
+# Every stage of every program is run a few times to warm up and then timed over repeated runs; the timings are written
+# as JSON. compare reports the change in the median time of each stage, and flags a regression when the new timings are
+# both slower by more than a threshold and significantly slower by a one-sided Mann-Whitney U test, which makes no
+# assumption about how the timings are distributed.
+#
+#   python bench.py run --engine tree --engine vm --output before.json
+#   ... change the interpreter ...
+#   python bench.py run --engine tree --engine vm --output after.json
+#   python bench.py compare before.json after.json
+#
+# compare exits with status 1 when it finds a regression, so it can gate a change in CI.
+
+import io
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+from math import comb
+from lexer import Tokenizer
+from parser import Parser
+from optimizer import optimize
+from engines import ENGINES, DEFAULT_ENGINE
+from bench_lexer import generate_source
+
+# Small programs that each stress one part of the interpreter; the generated source is added by corpus().
+CORPUS = {
+    "loops": '''
+        i = 0 total = 0
+        while i < 30000 { total = total + i * 2 - 1 i = i + 1 }
+        total''',
+    "calls": '''
+        fun fib(n) { if n < 2 then return n return fib(n - 1) + fib(n - 2) }
+        fib(17)''',
+    "lists": '''
+        xs = [] i = 0
+        while i < 20000 { xs.push_back(i) if len(xs) > 100 then xs.remove(0) i = i + 1 }
+        len(xs)''',
+    "strings": '''
+        s = "" i = 0
+        while i < 20000 { s = s + "line " + i + "\\n" i = i + 1 }
+        len(s)''',
+}
+
+
+def corpus(size_mb):
+    """Returns the benchmark programs by name, including a generated source of size_mb megabytes."""
+    return {**CORPUS, "generated": generate_source(int(size_mb * 1024 * 1024))}
+
+def time_runs(run, warmup, repeat, setup=None):
+    """Calls run() warmup times untimed and then repeat times timed, returning the timings in seconds.
+    setup(), when given, is called untimed before every run and its result passed to run."""
+    timings = []
+    for index in range(warmup + repeat):
+        argument = setup() if setup is not None else None
+        start = time.perf_counter()
+        run(argument)
+        elapsed = time.perf_counter() - start
+        if index >= warmup:
+            timings.append(elapsed)
+    return timings
+
+def summarize(timings):
+    return {"timings": timings, "median": statistics.median(timings), "min": min(timings),
+            "stdev": statistics.stdev(timings) if len(timings) > 1 else 0.0}
+
+def benchmark(name, source, engines, warmup, repeat, optimize_ast=True):
+    """Times each stage of one program, returning {"name/stage[/engine]": summary}."""
+    results = {}
+    tokens = Tokenizer(source).tokenize_compact()
+    results[f"{name}/tokenize"] = summarize(time_runs(
+        lambda _: Tokenizer(source).tokenize_compact(), warmup, repeat))
+    results[f"{name}/parse"] = summarize(time_runs(
+        lambda _: Parser(tokens).parse_program(), warmup, repeat))
+
+    def parsed_program():
+        program = Parser(tokens).parse_program()
+        return optimize(program) if optimize_ast else program
+    for engine in engines:
+        def evaluate(program):
+            interpreter = ENGINES[engine]()
+            interpreter.stdout = io.StringIO()  # Keep printed output out of the report.
+            interpreter.evaluate(program)
+        # Every run evaluates a freshly parsed tree in a fresh interpreter, so no run reuses another's caches.
+        results[f"{name}/evaluate/{engine}"] = summarize(time_runs(evaluate, warmup, repeat, parsed_program))
+    return results
+
+def run_suite(engines=(DEFAULT_ENGINE,), warmup=1, repeat=5, size_mb=1.0, only=None, optimize_ast=True,
+              report=None):
+    """Runs the benchmarks named in only, or all of them, and returns the results ready to be written as JSON.
+    report(key, summary), when given, is called as each result becomes available."""
+    results = {}
+    for name, source in corpus(size_mb).items():
+        if only and name not in only:
+            continue
+        for key, summary in benchmark(name, source, engines, warmup, repeat, optimize_ast).items():
+            results[key] = summary
+            if report is not None:
+                report(key, summary)
+    return {"python": platform.python_version(), "implementation": platform.python_implementation(),
+            "machine": platform.machine(), "engines": list(engines), "warmup": warmup, "repeat": repeat,
+            "size_mb": size_mb, "optimize": optimize_ast, "results": results}
+
+
+# Comparison
+
+def mann_whitney_p(baseline, current):
+    """Returns the one-sided p-value of the Mann-Whitney U test that timings in current tend to be larger than those
+    in baseline, from the exact distribution of U. Tied timings count half."""
+    u = 0.0
+    for new in current:
+        for old in baseline:
+            u += 1.0 if new > old else 0.5 if new == old else 0.0
+    counts = _u_counts(len(current), len(baseline))
+    at_least = sum(count for value, count in enumerate(counts) if value >= u)
+    return at_least / sum(counts)
+
+def _u_counts(m, n):
+    """Returns how many of the orderings of m and n timings give each value of U, indexed by U."""
+    # counts[i][j] is the distribution for i and j timings; a list of how many orderings give each U.
+    counts = [[[1] for _ in range(n + 1)] for _ in range(m + 1)]
+    for i in range(1, m + 1):
+        for j in range(1, n + 1):
+            # The largest timing comes from current (adding j to U) or from baseline (adding nothing).
+            with_current, with_baseline = counts[i - 1][j], counts[i][j - 1]
+            combined = [0] * (i * j + 1)
+            for value, count in enumerate(with_current):
+                combined[value + j] += count
+            for value, count in enumerate(with_baseline):
+                combined[value] += count
+            counts[i][j] = combined
+    return counts[m][n]
+
+def compare(baseline, current, threshold=0.05, alpha=0.05):
+    """Compares two results of run_suite, returning one row per benchmark stage present in both:
+    (key, baseline median, current median, relative change, p-value, verdict)."""
+    rows = []
+    for key, old in baseline["results"].items():
+        new = current["results"].get(key)
+        if new is None:
+            continue
+        change = new["median"] / old["median"] - 1 if old["median"] else 0.0
+        slower_p = mann_whitney_p(old["timings"], new["timings"])
+        faster_p = mann_whitney_p(new["timings"], old["timings"])
+        if change > threshold and slower_p < alpha:
+            verdict = "REGRESSION"
+        elif change < -threshold and faster_p < alpha:
+            verdict = "faster"
+        else:
+            verdict = ""
+        rows.append((key, old["median"], new["median"], change, min(slower_p, faster_p), verdict))
+    return rows
+
+def format_comparison(rows):
+    lines = [f"{'benchmark':<28} {'baseline':>10} {'current':>10} {'change':>8} {'p':>7}"]
+    for key, old, new, change, p, verdict in rows:
+        lines.append(f"{key:<28} {old:>9.4f}s {new:>9.4f}s {change:>+7.1%} {p:>7.4f}  {verdict}".rstrip())
+    return "\n".join(lines)
+
+
+def parse_args(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Benchmark the interpreter and compare benchmark results.")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="run the benchmarks and write their timings as JSON")
+    run.add_argument("--engine", action="append", choices=ENGINES,
+                     help="engine to time evaluation on; may be repeated (default: %s)" % DEFAULT_ENGINE)
+    run.add_argument("--only", action="append", choices=list(CORPUS) + ["generated"],
+                     help="run only this benchmark; may be repeated")
+    run.add_argument("--warmup", type=int, default=1, help="untimed runs before timing each stage (default: 1)")
+    run.add_argument("--repeat", type=int, default=5, help="timed runs of each stage (default: 5)")
+    run.add_argument("--size-mb", type=float, default=1.0, help="size of the generated source (default: 1)")
+    run.add_argument("--no-optimize", dest="optimize", action="store_false",
+                     help="evaluate programs without constant folding")
+    run.add_argument("--output", help="file to write the results to (default: standard output)")
+
+    compare_command = commands.add_parser("compare", help="compare two result files and flag regressions")
+    compare_command.add_argument("baseline", help="results of the reference run")
+    compare_command.add_argument("current", help="results of the run to check")
+    compare_command.add_argument("--threshold", type=float, default=0.05,
+                                 help="smallest relative change in the median to flag (default: 0.05)")
+    compare_command.add_argument("--alpha", type=float, default=0.05,
+                                 help="significance level of the Mann-Whitney U test (default: 0.05)")
+    return arg_parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "run":
+        def report(key, summary):
+            print(f"{key:<28} {summary['median']:>9.4f}s (min {summary['min']:.4f}s)", file=sys.stderr)
+        results = run_suite(args.engine or [DEFAULT_ENGINE], args.warmup, args.repeat, args.size_mb, args.only,
+                            args.optimize, report)
+        text = json.dumps(results, indent=2)
+        if args.output:
+            with open(args.output, "w") as file:
+                file.write(text + "\n")
+        else:
+            print(text)
+        return 0
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    with open(args.current) as file:
+        current = json.load(file)
+    rows = compare(baseline, current, args.threshold, args.alpha)
+    print(format_comparison(rows))
+    if 1 / comb(baseline["repeat"] + current["repeat"], current["repeat"]) >= args.alpha:
+        print(f"Too few timed runs for any change to be significant at {args.alpha}; use a larger --repeat")
+    regressions = [row for row in rows if row[-1] == "REGRESSION"]
+    if regressions:
+        print(f"{len(regressions)} regression(s) found")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
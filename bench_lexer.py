@@ -0,0 +1,74 @@
+# bench_lexer.py
+# Measures tokenizer throughput in MB/s for the regex-based Tokenizer.tokenize and Tokenizer.tokenize_compact against
+# the character-by-character Tokenizer.tokenize_by_character, on a generated source of the requested size.
+# Usage: python bench_lexer.py [--size-mb 2] [--repeat 3]
+
+import argparse
+import time
+from lexer import Tokenizer
+
+SNIPPET = '''
+# running totals for batch {n}
+fun accumulate_{n}(values, limit) {{
+    total_{n} = 0
+    index = 0
+    while index < limit {{
+        if values[index] >= {n}.5 then total_{n} = total_{n} + values[index] * 2 else total_{n} = total_{n} - 1
+        index = index + 1
+    }}
+    return total_{n}
+}}
+label_{n} = "batch {n}: a fairly long string literal with spaces, digits 0123456789 and punctuation!"
+results_{n} = [accumulate_{n}([1, 2, 3.25, {n}], 4), !true == false, "x" + {n}]
+print label_{n} + results_{n}[0]
+'''
+
+def generate_source(size_bytes):
+    """Builds a program of at least size_bytes characters from a representative snippet."""
+    parts = []
+    length = 0
+    n = 0
+    while length < size_bytes:
+        part = SNIPPET.format(n=n)
+        parts.append(part)
+        length += len(part)
+        n += 1
+    return "".join(parts)
+
+def measure(tokenize, source, repeat):
+    """Returns the best wall-clock time of repeat runs and the tokens of the last run."""
+    best = float("inf")
+    tokens = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        tokens = tokenize(Tokenizer(source))
+        best = min(best, time.perf_counter() - start)
+    return best, tokens
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmark the tokenizer.")
+    arg_parser.add_argument("--size-mb", type=float, default=2.0, help="size of the generated source")
+    arg_parser.add_argument("--repeat", type=int, default=3, help="runs per implementation; the best is reported")
+    args = arg_parser.parse_args()
+
+    source = generate_source(int(args.size_mb * 1024 * 1024))
+    megabytes = len(source.encode()) / (1024 * 1024)
+    print(f"Source: {megabytes:.2f} MB")
+
+    results = {}
+    for name, tokenize in (("by character", Tokenizer.tokenize_by_character), ("regex", Tokenizer.tokenize),
+                           ("token store", Tokenizer.tokenize_compact)):
+        seconds, tokens = measure(tokenize, source, args.repeat)
+        results[name] = (seconds, tokens)
+        print(f"{name:>12}: {seconds:8.3f} s  {megabytes / seconds:8.2f} MB/s  {len(tokens)} tokens")
+
+    (old_time, old_tokens), (new_time, new_tokens) = results["by character"], results["regex"]
+    identical = [(t.type, t.value) for t in old_tokens] == [(t.type, t.value) for t in new_tokens]
+    print(f"Speedup: {old_time / new_time:.1f}x, identical token streams: {identical}")
+    store = results["token store"][1]
+    identical = [(t.type, t.value) for t in store] == [(t.type, t.value) for t in new_tokens]
+    print(f"Token store: {sum(column.itemsize * len(column) for column in (store.types, store.starts, store.ends))}"
+          f" bytes of columns, identical token stream: {identical}")
+
+if __name__ == "__main__":
+    main()
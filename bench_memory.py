@@ -0,0 +1,60 @@
+# bench_memory.py
+# Reports how many bytes the parsed form of a generated program takes per AST node: as dict-backed node objects (the
+# layout before node classes declared __slots__), as slotted nodes, and as an Arena of typed arrays.
+# Sizes are measured with tracemalloc, so they include the strings and lists the nodes hold.
+# Usage: python bench_memory.py [--size-mb 1]
+
+import argparse
+import tracemalloc
+from ast_nodes import count_nodes
+from arena import Arena
+from bench_lexer import generate_source
+from lexer import Tokenizer
+from parser import Parser
+
+class DictNode:
+    """Stands in for a node class without __slots__: the same fields, kept in a per-instance __dict__."""
+
+def to_dict_nodes(node):
+    """Copies a tree into dict-backed nodes, with uninterned copies of its names as the old tokenizer produced."""
+    copy = DictNode()
+    for field in node.__slots__:
+        value = getattr(node, field)
+        if isinstance(value, list):
+            value = [to_dict_nodes(item) if hasattr(item, "__slots__") else item for item in value]
+        elif hasattr(value, "__slots__"):
+            value = to_dict_nodes(value)
+        elif isinstance(value, str) and field in ("name", "operator", "member_name"):
+            value = "".join(list(value))
+        setattr(copy, field, value)
+    return copy
+
+def measure(build):
+    """Returns the bytes still allocated once build() has returned, and its result."""
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, result
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmark the memory used by the parsed program.")
+    arg_parser.add_argument("--size-mb", type=float, default=1.0, help="size of the generated source")
+    args = arg_parser.parse_args()
+
+    source = generate_source(int(args.size_mb * 1024 * 1024))
+    tokens = Tokenizer(source).tokenize_compact()
+    program = Parser(tokens).parse_program()
+    nodes = count_nodes(program)
+    print(f"Source: {len(source) / (1024 * 1024):.2f} MB, {nodes} nodes")
+
+    results = [
+        ("dict nodes", measure(lambda: to_dict_nodes(program))[0]),
+        ("slotted nodes", measure(lambda: Parser(tokens).parse_program())[0]),
+        ("arena", measure(lambda: Arena.from_ast(program))[0]),
+    ]
+    for name, size in results:
+        print(f"{name:>14}: {size / (1024 * 1024):8.2f} MB  {size / nodes:8.1f} bytes/node")
+
+if __name__ == "__main__":
+    main()
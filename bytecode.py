@@ -0,0 +1,319 @@
+# bytecode.py
+# The BytecodeCompiler lowers the AST produced by the Parser into a flat instruction array for the VirtualMachine in vm.py.
+# Instructions are stored as alternating opcode/argument integers. Jump targets for While and If are resolved at compile time,
+# and every function body is compiled once into its own Code object. Calls whose value is returned straight from a function
+# body are compiled as tail calls, which reuse the caller's frame. return, break and continue compile to plain jumps
+# and returns, so early exits cost nothing on the normal path.
+
+from parser import *  # Adjust your import based on your project structure
+from resolver import resolve_function
+from runtime import BINARY_OPERATORS, UNARY_OPERATORS, unknown_binary
+from natives import BUILTINS
+
+# Opcodes. Every instruction takes exactly one argument (0 when unused).
+LOAD_CONST        = 0   # push consts[arg]
+LOAD_NAME         = 1   # push the variable names[arg]
+STORE_NAME        = 2   # bind names[arg] to the top of the stack, leaving it there
+BINARY_OP         = 3   # pop right and left, push OPERATORS[arg](left, right)
+UNARY_OP          = 4   # pop operand, push UNARY[arg](operand)
+POP_TOP           = 5   # discard the top of the stack
+JUMP              = 6   # continue at instruction offset arg
+POP_JUMP_IF_FALSE = 7   # pop the condition and jump to arg when it is falsy
+CALL              = 8   # pop arg arguments and the callee, push the call result
+CALL_MEMBER       = 9   # arg indexes consts for (member_name, argc); pop arguments and object, push the result
+BUILD_LIST        = 10  # pop arg elements, push them as a list
+LOAD_INDEX        = 11  # pop index and list, push list[index]
+STORE_INDEX       = 12  # pop index, list and value, store the element, push value
+PRINT             = 13  # print the top of the stack, leaving it there
+LOAD_FAST         = 14  # push local slot arg, falling back to the global of the same name while it is unset
+STORE_FAST        = 15  # store the top of the stack in local slot arg, leaving it there
+RAISE             = 16  # raise an Exception with the message consts[arg]
+RETURN_VALUE      = 17  # return the top of the stack to the caller
+TAIL_CALL         = 18  # like CALL, but the callee replaces the current frame
+BUILD_CONST_LIST  = 19  # push a new list holding the values of the tuple consts[arg]
+BUILD_MAP         = 20  # pop arg keys and values, interleaved, push them as a map
+LOAD_BUILTIN      = 21  # like LOAD_NAME, for a name that is usually not a global but a builtin
+LOAD_DEREF        = 22  # arg indexes consts for (depth, slot, name); push that slot of an enclosing function's frame
+MAKE_CLOSURE      = 23  # push the function consts[arg] bound to the current frame
+
+OPCODE_NAMES = {value: name for name, value in list(globals().items())
+                if name.isupper() and isinstance(value, int)}
+
+# Operator functions are referenced by their position in these tuples.
+OPERATORS = tuple(BINARY_OPERATORS.values()) + (unknown_binary,)
+UNARY = tuple(UNARY_OPERATORS.values())
+_BINARY_INDEX = {op: index for index, op in enumerate(BINARY_OPERATORS)}
+_UNARY_INDEX = {op: index for index, op in enumerate(UNARY_OPERATORS)}
+
+
+class Code:
+    """A compiled unit: a flat instruction array plus its constant, global name and local name tables."""
+    def __init__(self, name, instructions, consts, names, local_names=()):
+        self.name = name
+        self.instructions = instructions  # [opcode, arg, opcode, arg, ...]
+        self.consts = consts
+        self.names = names                # global names
+        self.local_names = local_names    # names of the frame slots
+        self.sites = {}  # Inline caches: offset after a CALL or TAIL_CALL -> (Function, Code) it called last
+    def __repr__(self):
+        return f"Code({self.name}, {len(self.instructions) // 2} instructions)"
+
+    def disassemble(self):
+        """Returns a human readable listing of the instructions."""
+        lines = []
+        for pc in range(0, len(self.instructions), 2):
+            op, arg = self.instructions[pc], self.instructions[pc + 1]
+            if op in (LOAD_CONST, RAISE, CALL_MEMBER, BUILD_CONST_LIST, LOAD_DEREF, MAKE_CLOSURE):
+                detail = f" ({self.consts[arg]!r})"
+            elif op == LOAD_NAME or op == STORE_NAME or op == LOAD_BUILTIN:
+                detail = f" ({self.names[arg]})"
+            elif op == LOAD_FAST or op == STORE_FAST:
+                detail = f" ({self.local_names[arg]})"
+            else:
+                detail = ""
+            lines.append(f"{pc:5} {OPCODE_NAMES[op]:<18} {arg}{detail}")
+        return "\n".join(lines)
+
+
+class BytecodeCompiler:
+    """Compiles AST nodes into Code objects."""
+    def __init__(self):
+        self.function_codes = {}  # Function body -> Code for it, shared by the closures of a function
+
+    def compile_program(self, expr, name="<program>", local_names=(), tail_calls=False):
+        unit = _CodeBuilder(self, name, local_names)
+        if tail_calls:
+            unit.compile_tail(expr)
+        else:
+            unit.compile(expr)
+        unit.emit(RETURN_VALUE)
+        return unit.build()
+
+    def function_code(self, func):
+        code = self.function_codes.get(func.body)
+        if code is None:
+            local_names = resolve_function(func) + ("<function>", "<caller>")  # The links, see resolver.py
+            code = self.function_codes[func.body] = self.compile_program(func.body, func.name, local_names,
+                                                                        tail_calls=True)
+        return code
+
+
+class _CodeBuilder:
+    """Accumulates the instructions, constants and names of a single Code object."""
+    def __init__(self, compiler, name, local_names):
+        self.compiler = compiler
+        self.name = name
+        self.local_names = local_names
+        self.instructions = []
+        self.consts = []
+        self.names = []
+        self.const_index = {}
+        self.name_index = {}
+        self.loops = []  # (start offset, break jump positions) of the enclosing while loops
+
+    def build(self):
+        return Code(self.name, self.instructions, tuple(self.consts), tuple(self.names), self.local_names)
+
+    def emit(self, op, arg=0):
+        self.instructions.append(op)
+        self.instructions.append(arg)
+        return len(self.instructions) - 1  # position of the argument, for patching jumps
+
+    def offset(self):
+        return len(self.instructions)
+
+    def patch(self, position, target):
+        self.instructions[position] = target
+
+    def add_const(self, value):
+        key = _const_key(value)
+        index = self.const_index.get(key)
+        if index is None:
+            index = self.const_index[key] = len(self.consts)
+            self.consts.append(value)
+        return index
+
+    def add_name(self, name):
+        index = self.name_index.get(name)
+        if index is None:
+            index = self.name_index[name] = len(self.names)
+            self.names.append(name)
+        return index
+
+    def compile(self, expr):
+        method = getattr(self, "compile_" + type(expr).__name__, None)
+        if method is None:
+            raise Exception("Unknown expression type")
+        method(expr)
+
+    def compile_tail(self, expr):
+        """Compiles an expression whose value is returned from the function, turning calls into tail calls."""
+        if isinstance(expr, Call):
+            self.compile_call(expr, TAIL_CALL)
+        elif isinstance(expr, Return):
+            self.compile_tail(expr.value)
+        elif isinstance(expr, Block) and expr.statements:
+            self.compile_statements(expr.statements[:-1])
+            if len(expr.statements) > 1:
+                self.emit(POP_TOP)
+            self.compile_tail(expr.statements[-1])
+        elif isinstance(expr, If):
+            self.compile_if(expr, self.compile_tail)
+        else:
+            self.compile(expr)
+
+    def compile_Number(self, expr):
+        self.emit(LOAD_CONST, self.add_const(expr.value))
+
+    compile_StringLiteral = compile_Number
+    compile_BooleanLiteral = compile_Number
+
+    def compile_Identifier(self, expr):
+        if expr.slot is not None and expr.depth:
+            self.emit(LOAD_DEREF, self.add_const((expr.depth, expr.slot, expr.name)))
+        elif expr.slot is not None:
+            self.emit(LOAD_FAST, expr.slot)
+        elif expr.name in BUILTINS:
+            self.emit(LOAD_BUILTIN, self.add_name(expr.name))
+        else:
+            self.emit(LOAD_NAME, self.add_name(expr.name))
+
+    def store(self, name, slot):
+        if slot is not None:
+            self.emit(STORE_FAST, slot)
+        else:
+            self.emit(STORE_NAME, self.add_name(name))
+
+    def compile_Assignment(self, expr):
+        self.compile(expr.value)
+        target = expr.target
+        if isinstance(target, Identifier):
+            self.store(target.name, target.slot)
+        elif isinstance(target, ListAccess):
+            self.compile(target.list_expr)
+            self.compile(target.index_expr)
+            self.emit(STORE_INDEX)
+        else:
+            self.emit(RAISE, self.add_const("Invalid assignment target"))
+
+    def compile_Binary(self, expr):
+        self.compile(expr.left)
+        self.compile(expr.right)
+        self.emit(BINARY_OP, _BINARY_INDEX.get(expr.operator, len(OPERATORS) - 1))
+
+    def compile_Unary(self, expr):
+        self.compile(expr.operand)
+        index = _UNARY_INDEX.get(expr.operator)
+        if index is None:
+            self.emit(RAISE, self.add_const(f"Unknown unary operator: {expr.operator}"))
+        else:
+            self.emit(UNARY_OP, index)
+
+    def compile_Function(self, expr):
+        # A function definition evaluates to itself, or to a closure over the current frame, and is stored in the
+        # current scope.
+        self.compiler.function_code(expr)
+        self.emit(MAKE_CLOSURE if expr.captures else LOAD_CONST, self.add_const(expr))
+        self.store(expr.name, expr.slot)
+
+    def compile_Return(self, expr):
+        if isinstance(expr.value, Call):
+            self.compile_call(expr.value, TAIL_CALL)
+        else:
+            self.compile(expr.value)
+            self.emit(RETURN_VALUE)
+
+    def compile_Break(self, expr):
+        self.loops[-1][1].append(self.emit(JUMP))
+
+    def compile_Continue(self, expr):
+        self.emit(JUMP, self.loops[-1][0])
+
+    def compile_Call(self, expr):
+        self.compile_call(expr, CALL)
+
+    def compile_call(self, expr, op):
+        self.compile(expr.callee)
+        for arg in expr.arguments:
+            self.compile(arg)
+        self.emit(op, len(expr.arguments))
+
+    def compile_MemberCall(self, expr):
+        self.compile(expr.object_expr)
+        for arg in expr.arguments:
+            self.compile(arg)
+        self.emit(CALL_MEMBER, self.add_const((expr.member_name, len(expr.arguments))))
+
+    def compile_Block(self, expr):
+        if not expr.statements:
+            self.emit(LOAD_CONST, self.add_const(None))
+            return
+        self.compile_statements(expr.statements)
+
+    def compile_statements(self, statements):
+        for index, statement in enumerate(statements):
+            if index:
+                self.emit(POP_TOP)
+            self.compile(statement)
+
+    def compile_While(self, expr):
+        loop_start = self.offset()
+        self.compile(expr.condition)
+        exit_jumps = [self.emit(POP_JUMP_IF_FALSE)]
+        self.loops.append((loop_start, exit_jumps))
+        self.compile(expr.body)
+        self.loops.pop()
+        self.emit(POP_TOP)
+        self.emit(JUMP, loop_start)
+        for position in exit_jumps:
+            self.patch(position, self.offset())
+        self.emit(LOAD_CONST, self.add_const(None))
+
+    def compile_Print(self, expr):
+        self.compile(expr.expr)
+        self.emit(PRINT)
+
+    def compile_ListAccess(self, expr):
+        self.compile(expr.list_expr)
+        self.compile(expr.index_expr)
+        self.emit(LOAD_INDEX)
+
+    def compile_ListLiteral(self, expr):
+        for element in expr.elements:
+            self.compile(element)
+        self.emit(BUILD_LIST, len(expr.elements))
+
+    def compile_ConstantList(self, expr):
+        self.emit(BUILD_CONST_LIST, self.add_const(expr.values))
+
+    def compile_MapLiteral(self, expr):
+        for key, value in zip(expr.keys, expr.values):
+            self.compile(key)
+            self.compile(value)
+        self.emit(BUILD_MAP, len(expr.keys))
+
+    def compile_If(self, expr):
+        self.compile_if(expr, self.compile)
+
+    def compile_if(self, expr, compile_branch):
+        self.compile(expr.condition)
+        else_jump = self.emit(POP_JUMP_IF_FALSE)
+        compile_branch(expr.then_branch)
+        end_jump = self.emit(JUMP)
+        self.patch(else_jump, self.offset())
+        if expr.else_branch is not None:
+            compile_branch(expr.else_branch)
+        else:
+            self.emit(LOAD_CONST, self.add_const(None))
+        self.patch(end_jump, self.offset())
+
+
+def _const_key(value):
+    """Constants are shared by type and value, so that 1, 1.0 and true stay distinct."""
+    if isinstance(value, tuple):
+        return (tuple, tuple(_const_key(item) for item in value))
+    try:
+        hash(value)
+    except TypeError:
+        return id(value)
+    return (type(value), value)
@@ -0,0 +1,118 @@
+# cache.py
+# An on-disk cache of parsed programs, in the spirit of __pycache__.
+# The parsed (and optionally optimized) program of a script is stored as its Arena in a __langcache__ directory next to
+# the script. Every entry records the cache format version and a hash of the source it was built from, so an entry for
+# an edited script, or one written by another version of the interpreter, is ignored and rebuilt.
+# A warm run loads the arena and skips tokenizing and parsing entirely.
+
+import os
+import sys
+import marshal
+import hashlib
+from array import array
+from arena import Arena, ArenaFunction
+from lexer import Tokenizer
+from parser import Parser
+from optimizer import optimize
+
+CACHE_DIR = "__langcache__"
+FORMAT_VERSION = 5
+MAGIC = b"LANGARENA"
+# Entries are only valid for the marshal format and array layout they were written with.
+PLATFORM_TAG = (sys.version_info[:2], sys.byteorder, array('i').itemsize)
+
+
+def cache_path(file_path, optimize_ast=True, cache_dir=None):
+    """Returns the path of the cache entry for a script."""
+    directory = cache_dir or os.path.join(os.path.dirname(os.path.abspath(file_path)), CACHE_DIR)
+    variant = "opt" if optimize_ast else "raw"
+    return os.path.join(directory, f"{os.path.basename(file_path)}.{variant}.arena")
+
+def source_hash(source):
+    return hashlib.sha256(source.encode("utf-8", "surrogatepass")).hexdigest()
+
+def dumps(arena, digest):
+    """Serializes an arena together with the hash of its source."""
+    consts = list(arena.consts)
+    functions = []
+    for index, value in enumerate(consts):
+        if isinstance(value, ArenaFunction):
+            functions.append((index, value.name, tuple(value.parameters), value.locals, value.root, value.weight,
+                              value.memo, value.captures))
+            consts[index] = None
+    columns = tuple(column.tobytes() for column in (arena.kinds, arena.a, arena.b, arena.c, arena.extra))
+    return MAGIC + marshal.dumps((FORMAT_VERSION, PLATFORM_TAG, digest, arena.root, columns,
+                                  tuple(consts), tuple(arena.names), tuple(functions)))
+
+def loads(data, digest):
+    """Rebuilds an arena from dumps() output, or returns None if it is stale, foreign or damaged."""
+    if not data.startswith(MAGIC):
+        return None
+    try:
+        version, platform_tag, stored_digest, root, columns, consts, names, functions = marshal.loads(data[len(MAGIC):])
+    except (EOFError, ValueError, TypeError):
+        return None
+    if version != FORMAT_VERSION or tuple(platform_tag) != PLATFORM_TAG or stored_digest != digest:
+        return None
+    arena = Arena()
+    for column, raw in zip((arena.kinds, arena.a, arena.b, arena.c, arena.extra), columns):
+        column.frombytes(raw)
+    arena.consts = list(consts)
+    arena.names = [sys.intern(name) for name in names]
+    arena.name_indexes = {name: index for index, name in enumerate(arena.names)}
+    for index, name, parameters, local_names, function_root, weight, memo, captures in functions:
+        arena.consts[index] = ArenaFunction(name, list(parameters), local_names, arena, function_root, weight, memo,
+                                            captures)
+    arena.root = root
+    return arena
+
+def parse_source(source, optimize_ast=True):
+    """Tokenizes, parses and optionally optimizes source into an Arena."""
+    program = Parser(Tokenizer(source).tokenize_compact()).parse_program()
+    if optimize_ast:
+        program = optimize(program)
+    return Arena.from_ast(program)
+
+def load_program(file_path, optimize_ast=True, use_cache=True, cache_dir=None):
+    """Returns the Arena for a script, from its cache entry when it is current, else by parsing it."""
+    with open(file_path, 'r') as file:
+        source = file.read()
+    if not use_cache:
+        return parse_source(source, optimize_ast)
+    digest = source_hash(source)
+    path = cache_path(file_path, optimize_ast, cache_dir)
+    try:
+        with open(path, 'rb') as file:
+            arena = loads(file.read(), digest)
+        if arena is not None:
+            return arena
+    except OSError:
+        pass
+    arena = parse_source(source, optimize_ast)
+    write_entry(path, dumps(arena, digest))
+    return arena
+
+def write_entry(path, data):
+    """Writes a cache entry atomically. Failing to write one is not an error."""
+    temporary = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(temporary, 'wb') as file:
+            file.write(data)
+        os.replace(temporary, path)
+    except OSError:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+
+def clear_cache(file_path, cache_dir=None):
+    """Removes the cache entries of a script and returns how many were removed."""
+    removed = 0
+    for optimize_ast in (True, False):
+        try:
+            os.remove(cache_path(file_path, optimize_ast, cache_dir))
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
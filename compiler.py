@@ -0,0 +1,376 @@
+# compiler.py
+# The ClosureCompiler turns the AST produced by the Parser into a tree of Python closures, one per node.
+# Every closure takes the running interpreter and the current local frame and returns the value of its node. Operators,
+# child closures and variable slots are bound when the closure is built, so evaluation no longer walks the isinstance
+# ladder in Interpreter.evaluate.
+# The ClosureInterpreter runs compiled programs and behaves exactly like the tree-walking Interpreter.
+
+from parser import *  # Adjust your import based on your project structure
+from interpreter import Interpreter
+from resolver import resolve_function, frame_size, closure, enclosing_frame
+from runtime import BINARY_OPERATORS, UNARY_OPERATORS, UNSET, unknown_binary
+from runtime import ReturnSignal, BreakSignal, ContinueSignal, map_error
+from natives import BUILTINS
+
+
+class ClosureCompiler:
+    """Compiles AST nodes into Python closures."""
+    def __init__(self, binary_operators=BINARY_OPERATORS):
+        self.function_bodies = {}  # Function body -> compiled body closure, shared by the closures of a function
+        self.binary_operators = binary_operators
+
+    def compile(self, expr):
+        method = getattr(self, "compile_" + type(expr).__name__, None)
+        if method is None:
+            raise Exception("Unknown expression type")
+        return method(expr)
+
+    def function_body(self, func):
+        body = self.function_bodies.get(func.body)
+        if body is None:
+            resolve_function(func)
+            body = self.function_bodies[func.body] = self.compile_tail(func.body)
+        return body
+
+    def compile_tail(self, expr):
+        """Compiles a function body so that a return in tail position simply produces its value without unwinding."""
+        if isinstance(expr, Return):
+            return self.compile(expr.value)
+        if isinstance(expr, Block) and expr.statements:
+            return self.compile_statements(expr.statements, self.compile_tail(expr.statements[-1]))
+        if isinstance(expr, If):
+            return self.compile_if(expr, self.compile_tail)
+        return self.compile(expr)
+
+    def compile_Number(self, expr):
+        value = expr.value
+        return lambda rt, frame: value
+
+    compile_StringLiteral = compile_Number
+    compile_BooleanLiteral = compile_Number
+
+    def compile_Identifier(self, expr):
+        name = expr.name
+        slot = expr.slot
+        if slot is not None and expr.depth:
+            depth = expr.depth
+            def enclosing(rt, frame):
+                value = enclosing_frame(frame, depth)[slot]
+                if value is not UNSET:
+                    return value
+                try:
+                    return rt.variables[name]
+                except KeyError:
+                    return rt.lookup_builtin(name, frame)
+            return enclosing
+        if slot is not None:
+            def local(rt, frame):
+                value = frame[slot]
+                if value is not UNSET:
+                    return value
+                try:
+                    return rt.variables[name]
+                except KeyError:
+                    return rt.lookup_builtin(name, frame)
+            return local
+        if name in BUILTINS:
+            # Usually not a global at all, so look it up without raising a KeyError on every use.
+            def builtin_identifier(rt, frame):
+                value = rt.variables.get(name, UNSET)
+                if value is UNSET:
+                    return rt.lookup_builtin(name, frame)
+                return value
+            return builtin_identifier
+        def identifier(rt, frame):
+            try:
+                return rt.variables[name]
+            except KeyError:
+                return rt.lookup_builtin(name, frame)
+        return identifier
+
+    def compile_Assignment(self, expr):
+        value_fn = self.compile(expr.value)
+        target = expr.target
+        if isinstance(target, Identifier):
+            name = target.name
+            slot = target.slot
+            if slot is not None:
+                def assign_local(rt, frame):
+                    value = value_fn(rt, frame)
+                    frame[slot] = value
+                    return value
+                return assign_local
+            def assign(rt, frame):
+                value = value_fn(rt, frame)
+                rt.variables[name] = value
+                return value
+            return assign
+        elif isinstance(target, ListAccess):
+            list_fn = self.compile(target.list_expr)
+            index_fn = self.compile(target.index_expr)
+            def assign_element(rt, frame):
+                value = value_fn(rt, frame)
+                list_val = list_fn(rt, frame)
+                index_val = index_fn(rt, frame)
+                try:
+                    if type(list_val) is dict:
+                        list_val[index_val] = value
+                    else:
+                        list_val[int(index_val)] = value
+                except Exception as e:
+                    if type(list_val) is dict:
+                        raise map_error(index_val, e)
+                    raise Exception(f"Error assigning list element at index {index_val}: {e}")
+                return value
+            return assign_element
+        else:
+            def invalid(rt, frame):
+                value_fn(rt, frame)
+                raise Exception("Invalid assignment target")
+            return invalid
+
+    def compile_Binary(self, expr):
+        left_fn = self.compile(expr.left)
+        right_fn = self.compile(expr.right)
+        op = self.binary_operators.get(expr.operator, unknown_binary)
+        # Specialise the common "x op constant" shape so the constant is not re-evaluated.
+        if isinstance(expr.right, (Number, StringLiteral, BooleanLiteral)):
+            constant = expr.right.value
+            return lambda rt, frame: op(left_fn(rt, frame), constant)
+        return lambda rt, frame: op(left_fn(rt, frame), right_fn(rt, frame))
+
+    def compile_Unary(self, expr):
+        operand_fn = self.compile(expr.operand)
+        op = UNARY_OPERATORS.get(expr.operator)
+        if op is None:
+            operator = expr.operator
+            def unknown(rt, frame):
+                operand_fn(rt, frame)
+                raise Exception(f"Unknown unary operator: {operator}")
+            return unknown
+        return lambda rt, frame: op(operand_fn(rt, frame))
+
+    def compile_Function(self, expr):
+        # A function definition evaluates to itself, or to a closure over the current frame, and is stored in the
+        # current scope.
+        self.function_body(expr)
+        name = expr.name
+        slot = expr.slot
+        if expr.captures:
+            def define_closure(rt, frame):
+                func = frame[slot] = closure(expr, frame)
+                return func
+            return define_closure
+        if slot is not None:
+            def define_local(rt, frame):
+                frame[slot] = expr
+                return expr
+            return define_local
+        def define(rt, frame):
+            rt.variables[name] = expr
+            return expr
+        return define
+
+    def compile_Return(self, expr):
+        value_fn = self.compile(expr.value)
+        def return_value(rt, frame):
+            raise ReturnSignal(value_fn(rt, frame))
+        return return_value
+
+    def compile_Break(self, expr):
+        def break_loop(rt, frame):
+            raise BreakSignal()
+        return break_loop
+
+    def compile_Continue(self, expr):
+        def continue_loop(rt, frame):
+            raise ContinueSignal()
+        return continue_loop
+
+    def compile_Call(self, expr):
+        callee_fn = self.compile(expr.callee)
+        arg_fns = [self.compile(arg) for arg in expr.arguments]
+        site = None  # Inline cache: (function, compiled body, weight, frame size) of the last Function called here
+        def call(rt, frame):
+            nonlocal site
+            callee = callee_fn(rt, frame)
+            args = [arg_fn(rt, frame) for arg_fn in arg_fns]
+            cached = site
+            if cached is None or callee is not cached[0]:
+                if not isinstance(callee, Function):
+                    return rt.call_native(callee, args)
+                if callee.memo or len(args) != len(callee.parameters):
+                    return rt.call_memo(callee, args) if callee.memo else rt.call_function(callee, args)
+                body = self.function_body(callee)
+                cached = site = (callee, body, rt.weight(callee.body), frame_size(callee))
+            func, body, weight, size = cached
+            rt.fuel -= weight
+            if rt.fuel < 0:
+                rt.checkpoint()
+            new_frame = [UNSET] * size
+            new_frame[:len(args)] = args
+            new_frame[-2] = func
+            new_frame[-1] = frame
+            try:
+                return body(rt, new_frame)
+            except ReturnSignal as signal:
+                return signal.value
+        return call
+
+    def compile_MemberCall(self, expr):
+        object_fn = self.compile(expr.object_expr)
+        arg_fns = [self.compile(arg) for arg in expr.arguments]
+        member_name = expr.member_name
+        def member_call(rt, frame):
+            object_val = object_fn(rt, frame)
+            args = [arg_fn(rt, frame) for arg_fn in arg_fns]
+            return rt.call_member(object_val, member_name, args)
+        return member_call
+
+    def compile_Block(self, expr):
+        if not expr.statements:
+            return lambda rt, frame: None
+        return self.compile_statements(expr.statements, self.compile(expr.statements[-1]))
+
+    def compile_statements(self, statements, last_fn):
+        """Compiles a statement list whose last statement has already been compiled to last_fn."""
+        statement_fns = [self.compile(statement) for statement in statements[:-1]]
+        if not statement_fns:
+            return last_fn
+        def block(rt, frame):
+            for statement_fn in statement_fns:
+                statement_fn(rt, frame)
+            return last_fn(rt, frame)
+        return block
+
+    def compile_While(self, expr):
+        condition_fn = self.compile(expr.condition)
+        body_fn = self.compile(expr.body)
+        weight = count_nodes(expr)
+        def loop(rt, frame):
+            while condition_fn(rt, frame):
+                rt.fuel -= weight
+                if rt.fuel < 0:
+                    rt.checkpoint()
+                try:
+                    body_fn(rt, frame)
+                except BreakSignal:
+                    break
+                except ContinueSignal:
+                    continue
+            return None
+        return loop
+
+    def compile_Print(self, expr):
+        value_fn = self.compile(expr.expr)
+        def print_value(rt, frame):
+            value = value_fn(rt, frame)
+            print(">>", value, file=rt.stdout)
+            return value
+        return print_value
+
+    def compile_ListAccess(self, expr):
+        list_fn = self.compile(expr.list_expr)
+        index_fn = self.compile(expr.index_expr)
+        def access(rt, frame):
+            list_val = list_fn(rt, frame)
+            index_val = index_fn(rt, frame)
+            try:
+                if type(list_val) is dict:
+                    return list_val[index_val]
+                return list_val[int(index_val)]
+            except Exception as e:
+                if type(list_val) is dict:
+                    raise map_error(index_val, e)
+                raise Exception(f"Error accessing list at index {index_val}: {e}")
+        return access
+
+    def compile_ListLiteral(self, expr):
+        element_fns = [self.compile(element) for element in expr.elements]
+        def build_list(rt, frame):
+            rt.allocated += len(element_fns)
+            return [element_fn(rt, frame) for element_fn in element_fns]
+        return build_list
+
+    def compile_ConstantList(self, expr):
+        values = expr.values
+        def copy_list(rt, frame):
+            rt.allocated += len(values)
+            return list(values)
+        return copy_list
+
+    def compile_MapLiteral(self, expr):
+        entry_fns = [(self.compile(key), self.compile(value)) for key, value in zip(expr.keys, expr.values)]
+        def build_map(rt, frame):
+            rt.allocated += len(entry_fns)
+            result = {}
+            for key_fn, value_fn in entry_fns:
+                key = key_fn(rt, frame)
+                value = value_fn(rt, frame)
+                try:
+                    result[key] = value
+                except TypeError as e:
+                    raise map_error(key, e)
+            return result
+        return build_map
+
+    def compile_If(self, expr):
+        return self.compile_if(expr, self.compile)
+
+    def compile_if(self, expr, compile_branch):
+        condition_fn = self.compile(expr.condition)
+        then_fn = compile_branch(expr.then_branch)
+        if expr.else_branch is None:
+            def if_then(rt, frame):
+                if condition_fn(rt, frame):
+                    return then_fn(rt, frame)
+                return None
+            return if_then
+        else_fn = compile_branch(expr.else_branch)
+        def if_else(rt, frame):
+            if condition_fn(rt, frame):
+                return then_fn(rt, frame)
+            return else_fn(rt, frame)
+        return if_else
+
+
+class ClosureInterpreter(Interpreter):
+    """Evaluates an AST by compiling it to closures first."""
+    def __init__(self, budget=None):
+        super().__init__(budget)
+        self.compiler = ClosureCompiler(self.binary_operators)
+
+    def evaluate(self, expr):
+        return self.compiler.compile(expr)(self, self.frame)
+
+    def prepare(self, program):
+        program = super().prepare(program)
+        for node in walk(program):
+            if isinstance(node, Function):
+                self.compiler.function_body(node)
+        return self.compiler, self.compiler.compile(program), program
+
+    def run_prepared(self, prepared):
+        compiler, program_fn, program = prepared
+        if compiler.binary_operators is not self.binary_operators:
+            # The closures call the operators they were compiled with; this run counts allocations with its own.
+            return self.evaluate(program)
+        self.compiler = compiler
+        return program_fn(self, self.frame)
+
+    def call_function(self, func, args):
+        self.fuel -= self.weight(func.body)
+        if self.fuel < 0:
+            self.checkpoint()
+        # Check parameter count
+        if len(args) != len(func.parameters):
+            raise Exception("Function argument count mismatch")
+        body = self.compiler.function_body(func)
+        frame = [UNSET] * frame_size(func)
+        frame[:len(args)] = args
+        frame[-2] = func
+        frame[-1] = self.frame
+        try:
+            return body(self, frame)
+        except ReturnSignal as signal:
+            return signal.value
@@ -0,0 +1,24 @@
+# engines.py
+# Registry of the available execution engines. Every engine is an Interpreter subclass
+# with the same public interface (evaluate, variables), so callers can pick one by name.
+
+from interpreter import Interpreter
+from compiler import ClosureInterpreter
+from vm import VirtualMachine
+from arena import ArenaInterpreter
+
+ENGINES = {
+    "tree": Interpreter,          # walks the AST directly
+    "closure": ClosureInterpreter,  # compiles the AST to Python closures
+    "vm": VirtualMachine,         # compiles the AST to bytecode for a stack machine
+    "arena": ArenaInterpreter,    # runs the AST from a compact struct-of-arrays arena
+}
+
+DEFAULT_ENGINE = "tree"
+
+def create_interpreter(engine=DEFAULT_ENGINE, budget=None):
+    """Creates an interpreter for the named engine, optionally limited by a runtime.Budget."""
+    try:
+        return ENGINES[engine](budget)
+    except KeyError:
+        raise ValueError(f"Unknown engine '{engine}', expected one of: {', '.join(ENGINES)}") from None
@@ -0,0 +1,262 @@
+# incremental.py
+# A Session keeps an editor buffer parsed into top-level statements and runs it incrementally.
+# On every update only the region of the buffer around the edit is tokenized and parsed again: parsing stops as soon as
+# it reaches, past the edit, a statement that starts where an old statement started, since the rest of the buffer then
+# parses exactly as before. Statements whose text did not change keep their AST and their record from the last run.
+#
+# Running replays the buffer in order. A statement runs again if its text changed or if it read a global that an
+# earlier statement re-bound in this update; any other statement is skipped and the globals it bound last time are
+# restored, so later statements see exactly the values a full run would give them. Which globals a statement reads and
+# binds is recorded while it runs, including the ones read inside the functions it calls.
+# Lists are mutable and can be shared, so their contents cannot be restored like a binding. Statements that may touch a
+# list are treated as one chain: as soon as one of them has to run, all of them run again, from the first one on.
+
+from bisect import bisect_left
+from ast_nodes import *
+from lexer import Tokenizer, TokenType
+from parser import Parser
+from optimizer import optimize
+from ropes import Rope
+
+_IMMUTABLE_TYPES = (bool, int, float, str, Rope, type(None), Function)
+
+
+class TrackedVariables(dict):
+    """The global variable table of a Session, recording the names read and bound by the running statement."""
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.start_statement()
+
+    def start_statement(self):
+        self.reads = set()
+        self.binds = {}
+        self.touched_list = False
+
+    def __getitem__(self, name):
+        self.reads.add(name)
+        value = super().__getitem__(name)
+        if not isinstance(value, _IMMUTABLE_TYPES):
+            self.touched_list = True
+        return value
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+
+    def __contains__(self, name):
+        self.reads.add(name)
+        return super().__contains__(name)
+
+    def __setitem__(self, name, value):
+        self.binds[name] = value
+        if not isinstance(value, _IMMUTABLE_TYPES):
+            self.touched_list = True
+        super().__setitem__(name, value)
+
+
+class Statement:
+    """A top-level statement of the buffer, with what it read and bound when it last ran."""
+    def __init__(self, node, start, end, text):
+        self.node = node
+        self.start = start  # Offsets of the statement's first and last characters in the buffer.
+        self.end = end
+        self.text = text
+        self.names = set()       # Global names the statement mentions outside of function bodies
+        self.bound_names = set() # Global names the statement may bind
+        self.may_touch_list = _scan(node, self.names, self.bound_names)
+        self.pending = True      # Not run since it was parsed, or its last run failed.
+        self.reads = set()
+        self.binds = {}
+        self.value = None
+
+
+class Session:
+    """Runs successive versions of a buffer, re-parsing and re-running only what each edit affects."""
+    def __init__(self, interpreter, optimize_ast=True):
+        self.interpreter = interpreter
+        self.optimize_ast = optimize_ast
+        self.initial_variables = dict(interpreter.variables)
+        self.variables = interpreter.variables = TrackedVariables(self.initial_variables)
+        self.source = ""
+        self.statements = []
+        self.last_run = []  # The statements that ran in the last update
+
+    def update(self, source, rerun=False):
+        """Brings the session up to date with source and returns the value of its last statement."""
+        statements, removed = self.reparse(source)
+        self.source, self.statements = source, statements
+        if rerun:
+            for statement in statements:
+                statement.pending = True
+        return self.run(self.plan(removed))
+
+    def reparse(self, source):
+        """Returns the statements of source, reusing unchanged ones, and the old statements that were removed."""
+        old_source, old = self.source, self.statements
+        prefix = _common_prefix(old_source, source)
+        suffix = _common_suffix(old_source, source, prefix)
+        delta = len(source) - len(old_source)
+        changed_end = len(source) - suffix  # Everything from here on is unchanged old text.
+        old_starts = [statement.start for statement in old]
+
+        # An edit can extend the statement before it, and changing the first token of that statement can in turn
+        # extend the statement before that one.
+        first = max(bisect_left(old_starts, prefix) - 2, 0)
+        offset = old[first].start if first > 0 else 0
+
+        spans = []
+        lexer_errors = []
+        def tokens():
+            try:
+                for token, start, end in Tokenizer(source).iter_spans(offset):
+                    spans.append((start, end))
+                    yield token
+            except SyntaxError as e:
+                lexer_errors.append(e)
+                raise
+
+        parsed = []
+        resume = len(old)
+        try:
+            parser = Parser(tokens())
+            while parser.type != TokenType.EOF:
+                first_token = parser.current
+                node = parser.parse_statement()
+                start, end = spans[first_token][0], spans[parser.current - 1][1]
+                parsed.append((node, start, end))
+                next_start = spans[parser.current][0]
+                if next_start >= changed_end and parser.type != TokenType.EOF:
+                    index = bisect_left(old_starts, next_start - delta)
+                    if index < len(old) and old_starts[index] == next_start - delta:
+                        resume = index
+                        break
+        except SyntaxError as e:
+            if spans and not lexer_errors:
+                # The parser failed at its lookahead token, the last one scanned.
+                position = spans[-1][0]
+                line = source.count("\n", 0, position) + 1
+                column = position - source.rfind("\n", 0, position)
+                raise SyntaxError(f"{e} at line {line}, column {column}") from None
+            raise
+
+        # Keep the records of old statements that were parsed again with the same text, in the same order.
+        replaced = old[first:resume]
+        head = 0
+        while head < min(len(parsed), len(replaced)) and replaced[head].text == _text(source, parsed[head]):
+            head += 1
+        tail = 0
+        while (tail < min(len(parsed), len(replaced)) - head
+               and replaced[-1 - tail].text == _text(source, parsed[-1 - tail])):
+            tail += 1
+        region = []
+        for index, (node, start, end) in enumerate(parsed):
+            if index < head or index >= len(parsed) - tail:
+                statement = replaced[index if index < head else index - len(parsed) + len(replaced)]
+            else:
+                if self.optimize_ast:
+                    node = optimize(node)
+                statement = Statement(node, start, end, source[start:end])
+            statement.start, statement.end = start, end
+            region.append(statement)
+        for statement in old[resume:]:
+            statement.start += delta
+            statement.end += delta
+        return old[:first] + region + old[resume:], replaced[head:len(replaced) - tail]
+
+    def plan(self, removed):
+        """Decides which statements have to run, returning one flag per statement."""
+        initial_list_names = {name for name, value in self.initial_variables.items()
+                              if not isinstance(value, _IMMUTABLE_TYPES)}
+        for statement in self.statements:
+            initial_list_names.update(name for name, value in statement.binds.items()
+                                      if not isinstance(value, _IMMUTABLE_TYPES))
+        # Once any statement that may touch a list has to run, every one of them runs, and the plan is made again.
+        rebuild_lists = any(statement.may_touch_list for statement in removed)
+        while True:
+            list_names = set(initial_list_names)
+            dirty = set()
+            for statement in removed:
+                dirty |= statement.bound_names | statement.binds.keys()
+            plan = []
+            list_statement_runs = False
+            for statement in self.statements:
+                run = statement.pending or not statement.reads.isdisjoint(dirty)
+                if statement.may_touch_list or not statement.names.isdisjoint(list_names):
+                    list_names |= statement.bound_names
+                    list_statement_runs = list_statement_runs or run
+                    run = run or rebuild_lists
+                if run:
+                    dirty |= statement.bound_names | statement.binds.keys()
+                plan.append(run)
+            if rebuild_lists or not list_statement_runs:
+                return plan
+            rebuild_lists = True
+
+    def run(self, plan):
+        """Runs the planned statements in order, restoring the bindings of the skipped ones."""
+        variables = self.variables
+        variables.clear()
+        dict.update(variables, self.initial_variables)
+        result = None
+        self.last_run = []
+        self.interpreter.reset_usage()  # Budgets apply to each update separately.
+        for index, (statement, run) in enumerate(zip(self.statements, plan)):
+            if not run:
+                dict.update(variables, statement.binds)
+                result = statement.value
+                continue
+            variables.start_statement()
+            self.last_run.append(statement)
+            try:
+                result = self.interpreter.evaluate(statement.node)
+            except Exception:
+                # This statement and every later one that was due to run have to run next time.
+                statement.pending = True
+                for later, later_run in zip(self.statements[index:], plan[index:]):
+                    later.pending = later.pending or later_run
+                raise
+            finally:
+                statement.reads, statement.binds = variables.reads, variables.binds
+                statement.may_touch_list = statement.may_touch_list or variables.touched_list
+            statement.pending = False
+            statement.value = result
+        return result
+
+def _text(source, parsed):
+    _, start, end = parsed
+    return source[start:end]
+
+def _common_prefix(a, b):
+    """Returns the length of the longest common prefix, comparing slices so the work is done in C."""
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+def _common_suffix(a, b, prefix):
+    """Returns the length of the longest common suffix that does not overlap the common prefix."""
+    low, high = 0, min(len(a), len(b)) - prefix
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[len(a) - middle:] == b[len(b) - middle:]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+def _scan(node, names, bound_names):
+    """Collects the global names used and bound by a top-level statement, and returns whether it may touch a list."""
+    if isinstance(node, Function):
+        bound_names.add(node.name)
+        return False  # The body only runs when the function is called.
+    may_touch_list = isinstance(node, (ListLiteral, ConstantList, MapLiteral, ListAccess, MemberCall, Call))
+    if isinstance(node, Identifier):
+        names.add(node.name)
+    elif isinstance(node, Assignment) and isinstance(node.target, Identifier):
+        bound_names.add(node.target.name)
+    for child in iter_child_nodes(node):
+        may_touch_list = _scan(child, names, bound_names) or may_touch_list
+    return may_touch_list
@@ -2,13 +2,108 @@
 # The Interpreter class is responsible for evaluating the AST nodes produced by the parser. It contains a series of evaluate methods for each AST node type.
 # The evaluate method for each node type is responsible for evaluating the node and returning the result. 
 # The Interpreter class also contains a call_function method that is used to call user-defined functions.
+# Globals live in self.variables; the parameters and locals of the running function live in self.frame, at the slots
+# assigned by the resolver, followed by the links to the running function and the caller's frame (see resolver.py).
+# Every engine charges the static size of a loop body on each iteration, and of a function body on each call, against
+# self.fuel. When the fuel runs out, checkpoint() adds it to the step count, stops the program if another thread called
+# cancel() or a Budget limit has been passed, and refuels. Print statements write to self.stdout, or to sys.stdout when
+# it is None.
 
+import time
 from parser import *  # Adjust your import based on your project structure
+from resolver import resolve, frame_size, closure, enclosing_frame, caller_local
+from runtime import UNSET, ReturnSignal, BreakSignal, ContinueSignal, ExecutionCancelled, map_error
+from runtime import BINARY_OPERATORS, CHECK_INTERVAL, unknown_binary, BudgetExceeded, sized_operators
+from runtime import MEMO_SIZE, MemoCache, memo_key
+from natives import BUILTINS, METHODS, Native, type_name
+from ropes import Rope, concat
 
 class Interpreter:
     """Evaluates an Abstract Syntax Tree (AST) produced by the Parser."""
-    def __init__(self):
+    def __init__(self, budget=None, profiler=None):
         self.variables = {}  # Store global variables
+        self.frame = None    # Local slots of the function being executed
+        self.cancelled = False  # Set from another thread to stop the running program
+        self.stdout = None      # File that Print writes to; None means sys.stdout
+        self.budget = budget    # Optional limits on steps, time and allocation
+        self.weights = {}       # Loop or function body -> number of nodes, charged per iteration or call
+        self.builtins = BUILTINS  # Natives callable by name, see natives.py
+        self.methods = METHODS    # Natives callable as members, by the type of the object
+        self.memo_caches = {}     # memo fun -> MemoCache of its results, kept for the life of the interpreter
+        self.memo_size = MEMO_SIZE  # Results each memo function keeps
+        # With an allocation limit, + and * count the strings and lists they build.
+        if budget is not None and budget.max_allocation is not None:
+            self.max_allocation = budget.max_allocation
+            self.binary_operators = sized_operators(self.allocate)
+        else:
+            self.max_allocation = float("inf")
+            self.binary_operators = BINARY_OPERATORS
+        self.reset_usage()
+        if profiler is not None:
+            profiler.attach(self)  # See profiler.py; only the tree engine can be profiled.
+
+    def cancel(self):
+        """Asks the running program to stop at its next loop iteration or function call."""
+        self.cancelled = True
+        self.fuel = -1  # Run out of fuel, so the next charge reaches checkpoint().
+
+    def reset_usage(self):
+        """Starts counting steps, allocated elements and elapsed time afresh."""
+        self.steps = 0
+        self.allocated = 0
+        self.started = time.monotonic()
+        self.interval = self.budget.check_interval if self.budget is not None else CHECK_INTERVAL
+        self.fuel = self.interval
+
+    def usage(self):
+        """Returns the steps, seconds and allocated list/string elements used so far."""
+        return {"steps": self.steps + self.interval - self.fuel,
+                "seconds": time.monotonic() - self.started,
+                "allocation": self.allocated}
+
+    def checkpoint(self):
+        """Called when the fuel runs out: stops a cancelled or over-budget program, else refuels."""
+        self.steps += self.interval - self.fuel
+        self.fuel = self.interval
+        if self.cancelled:
+            raise ExecutionCancelled()
+        budget = self.budget
+        if budget is not None:
+            usage = self.usage()
+            limit = budget.exceeded(usage)
+            if limit is not None:
+                raise BudgetExceeded(limit, usage)
+            if budget.max_steps is not None:
+                # Refuel no further than the step limit, so it is caught within one loop iteration or call.
+                self.fuel = self.interval = max(min(budget.check_interval, budget.max_steps - self.steps), 0)
+
+    def allocate(self, count):
+        """Charges count list or string elements, checking the allocation limit straight away."""
+        self.allocated += count
+        if self.allocated > self.max_allocation:
+            raise BudgetExceeded("allocation", self.usage())
+
+    def weight(self, node):
+        """Returns the number of nodes in a loop or function body, charged each time it runs."""
+        weight = self.weights.get(node)
+        if weight is None:
+            weight = self.weights[node] = count_nodes(node)
+        return weight
+
+    def prepare(self, program):
+        """Does all the compiling a program needs up front, returning what run_prepared() takes.
+        Nothing is compiled lazily afterwards, so other interpreters of this engine can share the result."""
+        resolve(program)
+        for node in walk(program):
+            if isinstance(node, While):
+                self.weight(node)
+            elif isinstance(node, Function):
+                self.weight(node.body)
+        return program
+
+    def run_prepared(self, prepared):
+        """Runs a program returned by prepare() from this or another interpreter of the same engine."""
+        return self.evaluate(prepared)
 
     def evaluate(self, expr):
         if isinstance(expr, Number):
@@ -21,23 +116,37 @@ class Interpreter:
             return expr.value
 
         elif isinstance(expr, Identifier):  # Lookup variable
-            if expr.name in self.variables:
-                return self.variables[expr.name]
-            raise Exception(f"Undefined variable: {expr.name}")
+            if expr.slot is not None:
+                frame = self.frame if not expr.depth else enclosing_frame(self.frame, expr.depth)
+                value = frame[expr.slot]
+                if value is not UNSET:
+                    return value
+            value = self.variables.get(expr.name, UNSET)
+            if value is not UNSET:
+                return value
+            return self.lookup_builtin(expr.name, self.frame)
 
         elif isinstance(expr, Assignment):
             value = self.evaluate(expr.value)
             # Check if the assignment target is an Identifier.
             if isinstance(expr.target, Identifier):
-                self.variables[expr.target.name] = value
+                if expr.target.slot is not None:
+                    self.frame[expr.target.slot] = value
+                else:
+                    self.variables[expr.target.name] = value
                 return value
             # Else if the target is a ListAccess, update the element at that index.
             elif isinstance(expr.target, ListAccess):
                 list_val = self.evaluate(expr.target.list_expr)
                 index_val = self.evaluate(expr.target.index_expr)
                 try:
-                    list_val[int(index_val)] = value
+                    if type(list_val) is dict:
+                        list_val[index_val] = value
+                    else:
+                        list_val[int(index_val)] = value
                 except Exception as e:
+                    if type(list_val) is dict:
+                        raise map_error(index_val, e)
                     raise Exception(f"Error assigning list element at index {index_val}: {e}")
                 return value
             else:
@@ -47,10 +156,15 @@ class Interpreter:
             left_val = self.evaluate(expr.left)
             right_val = self.evaluate(expr.right)
 
-            if expr.operator == "+":
+            if self.binary_operators is not BINARY_OPERATORS:
+                # Operators that count what they allocate
+                return self.binary_operators.get(expr.operator, unknown_binary)(left_val, right_val)
+            elif expr.operator == "+":
                 # If one operand is a string, convert both to strings for concatenation.
                 if isinstance(left_val, str) or isinstance(right_val, str):
-                    return str(left_val) + str(right_val)
+                    if type(left_val) is Rope:
+                        return left_val + right_val  # Appends a piece instead of joining the rope.
+                    return concat(str(left_val), str(right_val))
                 return left_val + right_val
 
             elif expr.operator == "-":
@@ -77,43 +191,57 @@ class Interpreter:
                 return left_val or right_val
 
         elif isinstance(expr, Function):
-            # A function definition evaluates to itself and is stored in the global environment.
-            self.variables[expr.name] = expr
-            return expr
+            # A function definition evaluates to itself, or to a closure over the current frame, and is stored in the
+            # current scope.
+            func = closure(expr, self.frame) if expr.captures else expr
+            if expr.slot is not None:
+                self.frame[expr.slot] = func
+            else:
+                self.variables[expr.name] = func
+            return func
 
         elif isinstance(expr, Return):
-            return self.evaluate(expr.value)
+            raise ReturnSignal(self.evaluate(expr.value))
+
+        elif isinstance(expr, Break):
+            raise BreakSignal()
+
+        elif isinstance(expr, Continue):
+            raise ContinueSignal()
 
         elif isinstance(expr, Call):
             callee = self.evaluate(expr.callee)
             args = [self.evaluate(arg) for arg in expr.arguments]
-            if isinstance(callee, Function):
-                return self.call_function(callee, args)
-            else:
-                raise Exception("Attempted to call a non-function")
+            site = expr.site
+            if site is None or callee is not site[0]:
+                if not isinstance(callee, Function):
+                    return self.call_native(callee, args)
+                if callee.memo or len(args) != len(callee.parameters):
+                    return self.call_memo(callee, args) if callee.memo else self.call_function(callee, args)
+                # Remember the function with its weight and frame size, so that calling it again from here, as a loop
+                # or a recursion does, skips looking them up. A different callee simply replaces it.
+                site = expr.site = (callee, self.weight(callee.body), frame_size(callee))
+            func, weight, size = site
+            self.fuel -= weight
+            if self.fuel < 0:
+                self.checkpoint()
+            frame = [UNSET] * size
+            frame[:len(args)] = args
+            old_frame = self.frame
+            frame[-2] = func
+            frame[-1] = old_frame
+            self.frame = frame
+            try:
+                return self.evaluate(func.body)
+            except ReturnSignal as signal:
+                return signal.value
+            finally:
+                self.frame = old_frame
 
         elif isinstance(expr, MemberCall):
             object_val = self.evaluate(expr.object_expr)
             args = [self.evaluate(arg) for arg in expr.arguments]
-            if isinstance(object_val, list):
-                if expr.member_name == "push_back":
-                    if len(args) != 1:
-                        raise Exception("push_back requires exactly one argument")
-                    object_val.append(args[0])
-                    return object_val
-                elif expr.member_name == "remove":
-                    if len(args) != 1:
-                        raise Exception("remove requires exactly one argument (the index to remove)")
-                    try:
-                        index = int(args[0])
-                        removed = object_val.pop(index)
-                        return removed
-                    except Exception as e:
-                        raise Exception(f"Error removing element at index {args[0]}: {e}")
-                else:
-                    raise Exception(f"Unknown member function '{expr.member_name}' on list")
-            else:
-                raise Exception(f"Member call on unsupported object type: {object_val}")
+            return self.call_member(object_val, expr.member_name, args)
 
         elif isinstance(expr, Unary):
             operand = self.evaluate(expr.operand)
@@ -125,36 +253,62 @@ class Interpreter:
                 raise Exception(f"Unknown unary operator: {expr.operator}")
             
         elif isinstance(expr, Block):
+            # return, break and continue unwind as exceptions, so the normal path needs no checks.
             result = None
             for statement in expr.statements:
                 result = self.evaluate(statement)
-                # If a Return node is encountered, propagate it immediately.
-                if isinstance(result, Return):
-                    return result
             return result
                             
         elif isinstance(expr, While):
+            weight = self.weight(expr)
             while self.evaluate(expr.condition):
-                result = self.evaluate(expr.body)
-                if isinstance(result, Return):
-                    return result
+                self.fuel -= weight
+                if self.fuel < 0:
+                    self.checkpoint()
+                try:
+                    self.evaluate(expr.body)
+                except BreakSignal:
+                    break
+                except ContinueSignal:
+                    continue
             return None
             
         elif isinstance(expr, Print):
             value = self.evaluate(expr.expr)
-            print(">>", value)
+            print(">>", value, file=self.stdout)
             return value
         
         elif isinstance(expr, ListAccess):
             list_val = self.evaluate(expr.list_expr)
             index_val = self.evaluate(expr.index_expr)
             try:
+                if type(list_val) is dict:
+                    return list_val[index_val]
                 return list_val[int(index_val)]
             except Exception as e:
+                if type(list_val) is dict:
+                    raise map_error(index_val, e)
                 raise Exception(f"Error accessing list at index {index_val}: {e}")
                 
         elif isinstance(expr, ListLiteral):
+            self.allocated += len(expr.elements)
             return [self.evaluate(element) for element in expr.elements]
+
+        elif isinstance(expr, ConstantList):
+            self.allocated += len(expr.values)
+            return list(expr.values)
+
+        elif isinstance(expr, MapLiteral):
+            self.allocated += len(expr.keys)
+            result = {}
+            for key_expr, value_expr in zip(expr.keys, expr.values):
+                key = self.evaluate(key_expr)
+                value = self.evaluate(value_expr)
+                try:
+                    result[key] = value
+                except TypeError as e:
+                    raise map_error(key, e)
+            return result
             
         elif isinstance(expr, If):
             if self.evaluate(expr.condition):
@@ -167,23 +321,72 @@ class Interpreter:
         else:
             raise Exception("Unknown expression type")
 
+    def lookup_builtin(self, name, frame=None):
+        """Resolves a name that is not a variable: as a builtin, else as a local of a function calling frame's."""
+        native = self.builtins.get(name)
+        if native is None:
+            native = caller_local(name, frame)
+            if native is UNSET:
+                raise Exception(f"Undefined variable: {name}")
+        return native
+
+    def call_native(self, callee, args):
+        if not isinstance(callee, Native):
+            raise Exception("Attempted to call a non-function")
+        return callee.invoke(self, args)
+
+    def call_member(self, object_val, member_name, args):
+        try:
+            native = self.methods[type(object_val)][member_name]
+        except KeyError:
+            if type(object_val) not in self.methods:
+                raise Exception(f"Member call on unsupported object type: {object_val}") from None
+            raise Exception(f"Unknown member function '{member_name}' on {type_name(object_val)}") from None
+        return native.invoke_method(self, object_val, args)
+
+    def memo_cache(self, func):
+        """Returns the cache of a memo fun's results, creating it on its first call."""
+        cache = self.memo_caches.get(func)
+        if cache is None:
+            cache = self.memo_caches[func] = MemoCache(self.memo_size)
+        return cache
+
+    def call_memo(self, func, args):
+        """Calls a memo fun, returning its cached result when it has been called with equal arguments before.
+        The call runs on the Python stack through call_function, like any call on this engine, so memo recursion is
+        bounded by Python's recursion limit: a cold memo fib(n) needs a depth of n, and fails for n in the low hundreds
+        under the default limit. The vm engine keeps memo calls on its own call stack instead."""
+        cache = self.memo_cache(func)
+        key = memo_key(args)
+        result = cache.get(key)
+        if result is UNSET:
+            result = self.call_function(func, args)
+            cache.put(key, result)
+        return result
+
+    def memo_stats(self):
+        """Returns the hits, misses and number of cached results of each memo function, by name."""
+        return {func.name: cache.stats() for func, cache in self.memo_caches.items()}
+
     def call_function(self, func, args):
+        self.fuel -= self.weight(func.body)
+        if self.fuel < 0:
+            self.checkpoint()
         # Check parameter count
         if len(args) != len(func.parameters):
             raise Exception("Function argument count mismatch")
-        # Create a new environment for function execution.
-        # For simplicity, copy the current global environment.
-        local_env = self.variables.copy()
-        for param, arg in zip(func.parameters, args):
-            local_env[param] = arg
-        # Save the old environment.
-        old_env = self.variables
-        self.variables = local_env
+        # Create a new frame holding only the function's own parameters and locals, and the links.
+        frame = [UNSET] * frame_size(func)
+        frame[:len(args)] = args
+        # Save the caller's frame.
+        old_frame = self.frame
+        frame[-2] = func
+        frame[-1] = old_frame
+        self.frame = frame
         try:
-            result = self.evaluate(func.body)
-            # If a return statement was encountered, extract its value.
-            if isinstance(result, Return):
-                result = result.value
-            return result
+            return self.evaluate(func.body)
+        except ReturnSignal as signal:
+            # A return statement was encountered, extract its value.
+            return signal.value
         finally:
-            self.variables = old_env
+            self.frame = old_frame
@@ -1,7 +1,14 @@
 # lexer.py: Contains the Token and Tokenizer classes, which are used to tokenize the input string, 
 
+import re
+import sys
+import mmap
+from bisect import bisect_left
+from array import array
 from enum import Enum
 
+CHUNK_SIZE = 1 << 16  # Characters of source read at a time when streaming from a file.
+
 class TokenType(Enum):
     """Enumeration of token types"""
     NUMBER         = "NUMBER"
@@ -39,6 +46,14 @@ class TokenType(Enum):
     DOT            = "DOT"           # for '.'
     FUN            = "FUN"           # for function declaration
     RETURN         = "RETURN"        # for return keyword
+    BREAK          = "BREAK"         # for break keyword
+    CONTINUE       = "CONTINUE"      # for continue keyword
+    COLON          = "COLON"         # for ':' in map literals
+    MEMO           = "MEMO"          # for memo fun, a function whose results are cached
+
+# Compact type codes: TOKEN_TYPES[code] is the TokenType stored in a TokenStore.
+TOKEN_TYPES = tuple(TokenType)
+TYPE_CODES = {token_type: code for code, token_type in enumerate(TOKEN_TYPES)}
 
 class Token:
     """Represents a token with a type and an optional value."""
@@ -59,6 +74,7 @@ class Tokenizer:
         '[': TokenType.LEFT_BRACKET,
         ']': TokenType.RIGHT_BRACKET,
         ',': TokenType.COMMA,
+        ':': TokenType.COLON,
         '+': TokenType.PLUS,
         '-': TokenType.MINUS,
         '*': TokenType.STAR,
@@ -80,9 +96,42 @@ class Tokenizer:
         "then": TokenType.THEN,
         "else": TokenType.ELSE,
         "fun": TokenType.FUN,
+        "memo": TokenType.MEMO,
         "return": TokenType.RETURN,
+        "break": TokenType.BREAK,
+        "continue": TokenType.CONTINUE,
+    }
+
+    # Multi-character operators, together with the single-character tokens.
+    OPERATOR_TOKENS = {
+        **SINGLE_CHAR_TOKENS,
+        '==': TokenType.EQUALS,
+        '=': TokenType.ASSIGN,
+        '!=': TokenType.NOT_EQUALS,
+        '!': TokenType.NOT,
+        '<=': TokenType.LESS_EQ,
+        '<': TokenType.LESS,
+        '>=': TokenType.GREATER_EQ,
+        '>': TokenType.GREATER,
     }
 
+    # One master pattern recognises every lexeme, including the whitespace and comments before it, in a single
+    # C-level match. The character classes are the regex equivalents of the str methods used by tokenize_by_character
+    # (\s is isspace, \w is isalnum or '_'). Anything the fast path does not handle exactly is an error, which is
+    # reported by tokenize_by_character.
+    TOKEN_PATTERN = re.compile(r"""
+        (?:\s+|\#[^\n]*)*
+        (?:
+            (?P<NAME>[A-Za-z]\w*)
+          | (?P<NUMBER>\.?\d[\d.]*)
+          | (?P<OPERATOR>[=!<>]=?|[.{}\[\],:+\-*/()])
+          | (?P<STRING>"[^"]*")
+          | (?P<UNICODE_NAME>[^\W\d_]\w*)
+          | (?P<END>\Z)
+          | (?P<ERROR>.)
+        )
+    """, re.VERBOSE | re.DOTALL)
+
     def __init__(self, source):
         self.source = source
         self.tokens = []
@@ -110,6 +159,113 @@ class Tokenizer:
         self.tokens.append(Token(token_type, value))
 
     def tokenize(self):
+        self.tokens.extend(self.iter_tokens())
+        return self.tokens
+
+    def iter_tokens(self, chunks=None):
+        """Yields tokens lazily from the source, or from an iterable of text chunks that each end at a line break."""
+        if chunks is None:
+            chunks = (self.source,)
+        # A lexeme always produces the same token, so one Token object is shared by every occurrence of it.
+        seen = {}
+        pending = ""  # Start of a string literal that continues in the next chunk.
+        for chunk in chunks:
+            if pending:
+                if '"' not in chunk:
+                    pending += chunk
+                    continue
+                chunk = pending + chunk
+                pending = ""
+            for match in self.TOKEN_PATTERN.finditer(chunk):
+                kind = match.lastgroup
+                text = match.group(kind)
+                token = seen.get(text)
+                if token is None:
+                    if kind == "END":
+                        break
+                    token = self.make_token(kind, text)
+                    if token is None:
+                        start = match.start(kind)
+                        if text == '"':
+                            pending = chunk[start:]
+                            break
+                        # Unexpected characters: rescan with the reference tokenizer to raise its error.
+                        Tokenizer(chunk).tokenize_by_character()
+                        raise SyntaxError(f"Unexpected character: '{text[0]}'")
+                    seen[text] = token
+                yield token
+        if pending:
+            raise SyntaxError("Unterminated string literal")
+        yield Token(TokenType.EOF, None)
+
+    def iter_spans(self, start=0):
+        """Yields (token, start, end) for each token from offset start onwards, ending with an EOF token."""
+        source = self.source
+        seen = {}
+        for match in self.TOKEN_PATTERN.finditer(source, start):
+            kind = match.lastgroup
+            text = match.group(kind)
+            token = seen.get(text)
+            if token is None:
+                if kind == "END":
+                    break
+                token = self.make_token(kind, text)
+                if token is None:
+                    # Rescan with the reference tokenizer to raise its error.
+                    Tokenizer(source[start:]).tokenize_by_character()
+                    raise SyntaxError(f"Unexpected character: '{text[0]}'")
+                seen[text] = token
+            yield token, match.start(kind), match.end(kind)
+        yield Token(TokenType.EOF, None), len(source), len(source)
+
+    def make_token(self, kind, text):
+        """Builds the token for a lexeme matched by TOKEN_PATTERN, or returns None if it is not a valid token."""
+        if kind == "NAME" or (kind == "UNICODE_NAME" and text[0].isalpha()):
+            return Token(self.KEYWORDS.get(text.lower(), TokenType.IDENTIFIER), sys.intern(text))
+        elif kind == "OPERATOR":
+            return Token(self.OPERATOR_TOKENS[text], sys.intern(text))
+        elif kind == "NUMBER":
+            return Token(TokenType.NUMBER, float(text) if '.' in text else int(text))
+        elif kind == "STRING":
+            return Token(TokenType.STRING, text[1:-1])
+        return None
+
+    def tokenize_compact(self):
+        """Tokenizes the source into a TokenStore instead of a list of Token objects."""
+        source = self.source
+        offset_type = 'I' if len(source) < 2 ** 32 else 'Q'
+        types, starts, ends = array('B'), array(offset_type), array(offset_type)
+        add_type, add_start, add_end = types.append, starts.append, ends.append
+        codes = {}  # lexeme -> type code
+        for match in self.TOKEN_PATTERN.finditer(source):
+            kind = match.lastgroup
+            text = match.group(kind)
+            code = codes.get(text)
+            if code is None:
+                if kind == "END":
+                    break
+                token = self.make_token(kind, text)  # Also checks that numbers convert.
+                if token is None:
+                    # Rescan with the reference tokenizer to raise its error.
+                    Tokenizer(source).tokenize_by_character()
+                    raise SyntaxError(f"Unexpected character: '{text[0]}'")
+                code = codes[text] = TYPE_CODES[token.type]
+            start, end = match.span(kind)
+            add_type(code)
+            add_start(start)
+            add_end(end)
+        add_type(TYPE_CODES[TokenType.EOF])
+        add_start(len(source))
+        add_end(len(source))
+        return TokenStore(source, types, starts, ends)
+
+    @classmethod
+    def stream(cls, source, chunk_size=CHUNK_SIZE):
+        """Yields the tokens of an open text file or an mmap without loading the whole program into memory."""
+        return cls("").iter_tokens(read_source_chunks(source, chunk_size))
+
+    def tokenize_by_character(self):
+        """Reference tokenizer that scans one character at a time; tokenize produces identical tokens."""
         while self.current < len(self.source):
             ch = self.advance()
 
@@ -206,3 +362,68 @@ class Tokenizer:
                 break
             string_value += ch
         self.add_token(TokenType.STRING, string_value)
+
+class TokenStore:
+    """A compact token list: parallel typed arrays of type codes and source offsets.
+
+    Token values are decoded from the source only when they are asked for, and every token
+    knows where it came from, at no per-token object cost.
+    """
+    def __init__(self, source, types, starts, ends):
+        self.source = source
+        self.types = types    # array of codes into TOKEN_TYPES
+        self.starts = starts  # offset of the first character of each lexeme
+        self.ends = ends      # offset just past the last character of each lexeme
+        self.newlines = None  # offsets of the newlines in the source, found when a position is first asked for
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, index):
+        return Token(TOKEN_TYPES[self.types[index]], self.value(index))
+
+    def __iter__(self):
+        return (self[index] for index in range(len(self)))
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def type(self, index):
+        return TOKEN_TYPES[self.types[index]]
+
+    def value(self, index):
+        """Decodes the value of a token from its lexeme."""
+        token_type = TOKEN_TYPES[self.types[index]]
+        text = self.source[self.starts[index]:self.ends[index]]
+        if token_type == TokenType.NUMBER:
+            return float(text) if '.' in text else int(text)
+        if token_type == TokenType.STRING:
+            return text[1:-1]
+        if token_type == TokenType.EOF:
+            return None
+        return sys.intern(text)  # Names and operators are shared by every node that uses them.
+
+    def position(self, index):
+        """Returns the 1-based (line, column) at which a token starts."""
+        offset = self.starts[index]
+        if self.newlines is None:
+            self.newlines = array('q', (match.start() for match in re.finditer("\n", self.source)))
+        before = bisect_left(self.newlines, offset)  # Newlines before the token
+        column = offset - (self.newlines[before - 1] if before else -1)
+        return before + 1, column
+
+def read_source_chunks(source, chunk_size=CHUNK_SIZE):
+    """Yields the text of an open text file or a UTF-8 encoded mmap in chunks made of whole lines."""
+    if isinstance(source, mmap.mmap):
+        position, size = 0, len(source)
+        while position < size:
+            end = source.find(b"\n", position + chunk_size)
+            end = size if end == -1 else end + 1
+            yield source[position:end].decode("utf-8")
+            position = end
+    else:
+        while True:
+            lines = source.readlines(chunk_size)
+            if not lines:
+                return
+            yield "".join(lines)
@@ -1,9 +1,16 @@
 import os
-import sys
+import mmap
+import argparse
 import platform
 from lexer import Tokenizer
 from parser import Parser
+from optimizer import optimize
+from engines import ENGINES, DEFAULT_ENGINE, create_interpreter
 from interpreter import Interpreter
+from profiler import Profiler
+from arena import ArenaInterpreter
+from cache import load_program, clear_cache
+from runtime import Budget
 
 
 def read_file(file_path):
@@ -11,22 +18,58 @@ def read_file(file_path):
     with open(file_path, 'r') as file:
         return file.read()
 
-def main(file_path):
+def run_streaming(file_path, interpreter, optimize_ast=True):
+    """Parses and evaluates a program one top-level statement at a time, reading the file through an mmap."""
+    with open(file_path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return  # An empty file cannot be mapped, and has nothing to run.
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as source:
+            parser = Parser(Tokenizer.stream(source))
+            for statement in parser.iter_statements():
+                if optimize_ast:
+                    statement = optimize(statement)
+                interpreter.evaluate(statement)
+
+def run_arena(interpreter, arena):
+    """Evaluates the program stored in an arena, rebuilding its AST for engines that run from a tree."""
+    if isinstance(interpreter, ArenaInterpreter):
+        return interpreter.run(arena)
+    return interpreter.evaluate(arena.to_ast(arena.root))
+
+def main(file_path, engine=DEFAULT_ENGINE, optimize_ast=True, stream=False, use_cache=True, dump=False, budget=None):
+    # Create an interpreter instance for the selected engine.
+    interpreter = create_interpreter(engine, budget)
+
+    if stream:
+        # Tokens, statements and evaluation overlap, so the whole program is never held in memory.
+        try:
+            run_streaming(file_path, interpreter, optimize_ast)
+        except Exception as e:
+            print(f"Error: {e}")
+        return
+
+    if not dump:
+        # Load the parsed program from the cache when the source is unchanged, else parse and cache it.
+        try:
+            run_arena(interpreter, load_program(file_path, optimize_ast, use_cache))
+        except Exception as e:
+            print(f"Error: {e}")
+        return
+
     # Read the entire program as one string.
     program_source = read_file(file_path)
     
-    # Create an interpreter instance.
-    interpreter = Interpreter()
-    
     try:
         # Tokenize the entire program.
         tokenizer = Tokenizer(program_source)
-        tokens = tokenizer.tokenize()
+        tokens = tokenizer.tokenize_compact()
         print(f"\nTokens: {tokens}\n")
         
         # Parse the tokens into an AST for the whole program.
         parser = Parser(tokens)
         ast = parser.parse_program()
+        if optimize_ast:
+            ast = optimize(ast)
         print(f"AST: {ast}\n")
         
         # Evaluate the AST.
@@ -35,14 +78,81 @@ def main(file_path):
     except Exception as e:
         print(f"Error: {e}")
 
+def profile_file(file_path, optimize_ast=True, budget=None):
+    """Runs a program on the tree engine under the profiler, and returns the Profiler with its timings."""
+    tokens = Tokenizer(read_file(file_path)).tokenize_compact()
+    positions = {}
+    program = Parser(tokens, positions).parse_program()
+    if optimize_ast:
+        program = optimize(program)
+    profiler = Profiler({node: tokens.position(index)[0] for node, index in positions.items()})
+    try:
+        Interpreter(budget, profiler).evaluate(program)
+    except Exception as e:
+        print(f"Error: {e}")
+    return profiler
+
 def clear_terminal():
     if platform.system() == "Windows":
         os.system("cls")
     else:
         os.system("clear")
 
+def parse_args(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Run a program written in the custom language.")
+    arg_parser.add_argument("file", nargs="?", default="expressions.txt",
+                            help="program to run (default: expressions.txt)")
+    arg_parser.add_argument("--engine", choices=ENGINES, default=DEFAULT_ENGINE,
+                            help="execution engine (default: %(default)s)")
+    arg_parser.add_argument("--no-optimize", dest="optimize", action="store_false",
+                            help="skip constant folding and dead-branch elimination")
+    arg_parser.add_argument("--stream", action="store_true",
+                            help="read, parse and run the program one top-level statement at a time")
+    arg_parser.add_argument("--dump", action="store_true",
+                            help="print the tokens and AST before running (always parses the source)")
+    arg_parser.add_argument("--no-cache", dest="cache", action="store_false",
+                            help="neither read nor write the parsed-program cache")
+    arg_parser.add_argument("--clear-cache", action="store_true",
+                            help="delete the cached parse of the program and exit")
+    arg_parser.add_argument("--profile", action="store_true",
+                            help="run on the tree engine and print the time spent in each function and statement")
+    arg_parser.add_argument("--profile-stacks", metavar="FILE",
+                            help="with --profile, also write the time per call stack to FILE in the collapsed format "
+                                 "read by flamegraph tools")
+    add_budget_arguments(arg_parser)
+    args = arg_parser.parse_args(argv)
+    if args.profile and args.engine != "tree":
+        arg_parser.error("--profile runs on the tree engine")
+    if args.profile_stacks and not args.profile:
+        arg_parser.error("--profile-stacks requires --profile")
+    return args
+
+def add_budget_arguments(arg_parser):
+    arg_parser.add_argument("--max-steps", type=int,
+                            help="stop the program after about this many evaluated nodes")
+    arg_parser.add_argument("--max-seconds", type=float,
+                            help="stop the program after this many seconds of wall-clock time")
+    arg_parser.add_argument("--max-allocation", type=int,
+                            help="stop the program once it has built this many list elements and string characters")
+
+def budget_from_args(args):
+    """Returns the Budget set by the --max-* flags, or None when none was given."""
+    if args.max_steps is None and args.max_seconds is None and args.max_allocation is None:
+        return None
+    return Budget(args.max_steps, args.max_seconds, args.max_allocation)
+
 if __name__ == "__main__":
     # Use command-line arguments if provided; otherwise, default to 'expressions.txt'
-    clear_terminal()
-    file_path = sys.argv[1] if len(sys.argv) > 1 else 'expressions.txt'
-    main(file_path)
+    args = parse_args()
+    if args.clear_cache:
+        print(f"Removed {clear_cache(args.file)} cache entries for {args.file}")
+    elif args.profile:
+        profiler = profile_file(args.file, args.optimize, budget_from_args(args))
+        print()
+        print(profiler.report())
+        if args.profile_stacks:
+            with open(args.profile_stacks, "w") as file:
+                file.write(profiler.collapsed_stacks())
+    else:
+        clear_terminal()
+        main(args.file, args.engine, args.optimize, args.stream, args.cache, args.dump, budget_from_args(args))
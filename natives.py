@@ -0,0 +1,298 @@
+# natives.py
+# The registry of functions and methods implemented in Python rather than in the language.
+# BUILTINS maps a name to a Native that programs call like any function, e.g. len(xs) or range(10); a global variable
+# of the same name hides it. METHODS maps a value's type to the Natives that can be called on it as members, e.g.
+# xs.push_back(1). Interpreters resolve both with dict lookups, and the Natives do their work in C where Python does.
+# Host code adds its own natives with the same decorators:
+#
+#   @builtin("clamp", arity=3)
+#   def clamp(value, low, high):
+#       return max(low, min(value, high))
+#
+# A Native may declare size: how many list elements or string characters a call allocates, either as a number or as a
+# function of the arguments. It is charged against the interpreter's allocation budget before the call runs. A size of
+# RESULT charges the length of what the call returns instead, after it has run, for natives whose allocation costs about
+# as much to predict as to do.
+
+import sys
+from runtime import map_error
+from ropes import Rope
+from vectors import Vector, vector
+
+BUILTINS = {}  # name -> Native
+METHODS = {}   # type -> {name -> Native}; the receiver is passed as the first argument
+TYPE_NAMES = {list: "list", Vector: "vector", str: "string", Rope: "string", dict: "map"}
+
+RESULT = "result"  # A size that charges the length of the call's result
+
+_COUNTS = {0: "no arguments", 1: "exactly one argument", 2: "exactly two arguments", 3: "exactly three arguments"}
+
+
+class Native:
+    """A function implemented in Python that programs can call."""
+    __slots__ = ('name', 'function', 'min_args', 'max_args', 'size')
+
+    def __init__(self, name, function, arity=None, size=None):
+        self.name = name
+        self.function = function
+        # arity is a number of arguments, a (minimum, maximum) pair with None for no maximum, or None for any number.
+        if arity is None:
+            arity = (0, None)
+        elif isinstance(arity, int):
+            arity = (arity, arity)
+        self.min_args = arity[0]
+        self.max_args = sys.maxsize if arity[1] is None else arity[1]
+        self.size = size
+
+    def __repr__(self):
+        return f"<native {self.name}>"
+
+    def invoke(self, interpreter, args):
+        """Calls the native as a builtin."""
+        if not self.min_args <= len(args) <= self.max_args:
+            raise Exception(f"{self.name} requires {self.describe_arity()}")
+        size = self.size
+        if size is not None:
+            if size is RESULT:
+                result = self.function(*args)
+                interpreter.allocate(len(result))
+                return result
+            interpreter.allocate(size if type(size) is int else size(*args))
+        return self.function(*args)
+
+    def invoke_method(self, interpreter, receiver, args):
+        """Calls the native as a member of receiver."""
+        if not self.min_args <= len(args) <= self.max_args:
+            raise Exception(f"{self.name} requires {self.describe_arity()}")
+        size = self.size
+        if size is not None:
+            if size is RESULT:
+                result = self.function(receiver, *args)
+                interpreter.allocate(len(result))
+                return result
+            interpreter.allocate(size if type(size) is int else size(receiver, *args))
+        return self.function(receiver, *args)
+
+    def describe_arity(self):
+        if self.min_args == self.max_args:
+            return _COUNTS.get(self.min_args, f"exactly {self.min_args} arguments")
+        if self.max_args == sys.maxsize:
+            return f"at least {self.min_args} argument{'s' if self.min_args != 1 else ''}"
+        return f"{self.min_args} to {self.max_args} arguments"
+
+
+def builtin(name, arity=None, size=None):
+    """Registers the decorated function as a builtin."""
+    def register(function):
+        BUILTINS[name] = Native(name, function, arity, size)
+        return function
+    return register
+
+def method(types, name, arity=None, size=None):
+    """Registers the decorated function as a member of the given types; it receives the object first."""
+    if not isinstance(types, tuple):
+        types = (types,)
+    def register(function):
+        for owner in types:
+            METHODS.setdefault(owner, {})[name] = Native(name, function, arity, size)
+            if owner is str:
+                # Long strings built by concatenation are Ropes, which string methods see joined.
+                METHODS.setdefault(Rope, {})[name] = Native(name, _joined(function), arity, _joined(size))
+        return function
+    return register
+
+def _joined(function):
+    if function is None or type(function) is int or function is RESULT:
+        return function
+    return lambda rope, *args: function(str(rope), *args)
+
+def type_name(value):
+    return TYPE_NAMES.get(type(value), type(value).__name__)
+
+
+# Builtins
+
+@builtin("len", 1)
+def native_len(value):
+    try:
+        return len(value)
+    except TypeError:
+        raise Exception(f"len requires a list, string, map or vector, not {type_name(value)}") from None
+
+def _sequence(name, values):
+    """Returns values, which the native called name requires to be a list or vector."""
+    if not isinstance(values, (list, Vector)):
+        raise Exception(f"{name} requires a list or vector, not {type_name(values)}")
+    return values
+
+def _whole(name, value):
+    """Returns a number argument of name as an int, as indexing does."""
+    if not isinstance(value, (int, float)):
+        raise Exception(f"{name} requires numbers, not {type_name(value)}")
+    try:
+        return int(value)
+    except (OverflowError, ValueError):
+        raise Exception(f"{name} requires finite numbers, not {value}") from None
+
+def _range(*args):
+    """Returns the range(*args) of a program, checking its arguments."""
+    args = [_whole("range", arg) for arg in args]
+    if args[2:] == [0]:
+        raise Exception("range requires a step other than 0")
+    bounds = range(*args)
+    try:
+        len(bounds)
+    except OverflowError:
+        raise Exception("range is too long") from None
+    return bounds
+
+@builtin("range", arity=(1, 3), size=lambda *args: len(_range(*args)))
+def native_range(*args):
+    return list(_range(*args))
+
+@builtin("sum", 1)
+def native_sum(values):
+    if isinstance(values, Vector):
+        return values.sum()
+    try:
+        return sum(_sequence("sum", values))
+    except TypeError:
+        raise Exception("sum requires a list of numbers") from None
+
+@builtin("join", (1, 2), size=RESULT)
+def join(values, separator=""):
+    """Joins the elements of a list, converted to strings, in one step."""
+    return str(separator).join(map(str, _sequence("join", values)))
+
+def _extreme(name, function):
+    """Returns min or max for programs: of one list or vector, or of several values."""
+    def extreme(*values):
+        if len(values) == 1:
+            values = values[0]
+            if not isinstance(values, (list, Vector)):
+                raise Exception(f"{name} of a single value requires a list or vector, not {type_name(values)}")
+            if not values:
+                raise Exception(f"{name} of an empty {type_name(values)}")
+        try:
+            return function(values)
+        except TypeError:
+            raise Exception(f"{name} requires values that can be compared with each other") from None
+    return extreme
+
+builtin("min", (1, None))(_extreme("min", min))
+builtin("max", (1, None))(_extreme("max", max))
+
+def _sort_error():
+    return Exception("sort requires values that can be compared with each other")
+
+@builtin("sort", 1, size=lambda values: len(_sequence("sort", values)))
+def native_sort(values):
+    """Returns a sorted copy of a list or vector."""
+    try:
+        result = sorted(values)
+    except TypeError:
+        raise _sort_error() from None
+    return vector(result) if isinstance(values, Vector) else result
+
+
+# Methods of lists and vectors
+
+@method((list, Vector), "push_back", 1, size=1)
+def push_back(values, value):
+    values.append(value)
+    return values
+
+@method((list, Vector), "remove", 1)
+def remove(values, index):
+    try:
+        return values.pop(int(index))
+    except Exception as e:
+        raise Exception(f"Error removing element at index {index}: {e}")
+
+def _slice_bounds(values, start, end):
+    """Returns the indexes values.slice(start, end) takes, as a range."""
+    for bound in (start, end):
+        if bound is not None and not isinstance(bound, (int, float)):
+            raise Exception(f"slice requires numbers as bounds, not {type_name(bound)}")
+    return range(len(values))[int(start):None if end is None else int(end)]
+
+@method((list, Vector), "slice", (1, 2), size=lambda values, start, end=None: len(_slice_bounds(values, start, end)))
+def slice_values(values, start, end=None):
+    bounds = _slice_bounds(values, start, end)
+    start, end = bounds.start, bounds.stop
+    if isinstance(values, Vector):
+        return Vector(values.data[start:end])
+    return values[start:end]
+
+@method((list, Vector), "sum", 0)
+def sum_values(values):
+    return native_sum(values)
+
+@method((list, Vector), "index", 1)
+def index_of(values, value):
+    try:
+        return values.index(value)
+    except ValueError:
+        raise Exception(f"Value not found in {type_name(values)}: {value}") from None
+
+@method(list, "extend", 1, size=lambda values, other: len(_sequence("extend", other)))
+def extend(values, other):
+    values.extend(other)
+    return values
+
+@method(list, "insert", 2, size=1)
+def insert(values, index, value):
+    values.insert(_whole("insert", index), value)
+    return values
+
+@method(list, "sort", 0)
+def sort_in_place(values):
+    try:
+        values.sort()
+    except TypeError:
+        raise _sort_error() from None
+    return values
+
+@method(list, "vector", 0, size=len)
+def to_vector(values):
+    return vector(values)
+
+@method(Vector, "list", 0, size=len)
+def to_list(values):
+    return values.tolist()
+
+# Element-wise comparisons, giving a vector of 1s and 0s; == and != compare whole vectors.
+for _name in ("eq", "ne", "lt", "le", "gt", "ge"):
+    method(Vector, _name, 1, size=lambda values, other: len(values))(getattr(Vector, _name))
+
+
+# Methods of maps
+
+@method(dict, "keys", 0, size=len)
+def keys(mapping):
+    return list(mapping)
+
+@method(dict, "values", 0, size=len)
+def values(mapping):
+    return list(mapping.values())
+
+@method(dict, "has", 1)
+def has(mapping, key):
+    try:
+        return key in mapping
+    except TypeError as e:
+        raise map_error(key, e)
+
+@method(dict, "get", 2)
+def get(mapping, key, default):
+    try:
+        return mapping.get(key, default)
+    except TypeError as e:
+        raise map_error(key, e)
+
+@method(dict, "delete", 1)
+def delete(mapping, key):
+    try:
+        return mapping.pop(key)
+    except (KeyError, TypeError) as e:
+        raise map_error(key, e)
@@ -0,0 +1,107 @@
+# optimizer.py
+# The optimizer rewrites the AST produced by the Parser before it is evaluated.
+# It folds Binary and Unary nodes whose operands are literals, replaces an If whose condition is constant with the branch
+# that would run, drops while loops whose condition is constantly false, and turns list literals made only of literals
+# into a ConstantList that is copied in one step instead of evaluating every element on every pass through a loop.
+# Folding uses the same operator functions as the engines, so an optimized program prints exactly the same output.
+
+from ast_nodes import *
+from runtime import BINARY_OPERATORS, UNARY_OPERATORS
+from ropes import Rope
+
+MAX_FOLDED_STRING = 4096  # Longer string results are left to be built at runtime.
+
+
+def optimize(program):
+    """Returns an optimized version of the AST, rewriting nodes in place where possible."""
+    return _optimize(program)
+
+def _optimize(node):
+    for field in node.__slots__:
+        value = getattr(node, field)
+        if isinstance(value, Expr):
+            setattr(node, field, _optimize(value))
+        elif isinstance(value, list):
+            setattr(node, field, [_optimize(item) if isinstance(item, Expr) else item for item in value])
+    rewrite = _REWRITES.get(type(node))
+    return rewrite(node) if rewrite is not None else node
+
+def _is_constant(node):
+    return isinstance(node, (Number, StringLiteral, BooleanLiteral))
+
+def _literal(value, original):
+    """Wraps a folded value in a literal node, or returns the original node if it cannot be represented."""
+    if isinstance(value, Rope):
+        value = str(value)
+    if isinstance(value, bool):
+        return BooleanLiteral(value)
+    if isinstance(value, (int, float)):
+        return Number(value)
+    if isinstance(value, str) and len(value) <= MAX_FOLDED_STRING:
+        return StringLiteral(value)
+    return original
+
+def _fold_binary(node):
+    op = BINARY_OPERATORS.get(node.operator)
+    if op is None or not (_is_constant(node.left) and _is_constant(node.right)):
+        return node
+    if _repeats_too_far(node.operator, node.left.value, node.right.value):
+        return node
+    try:
+        value = op(node.left.value, node.right.value)
+    except Exception:
+        return node  # Leave the error to be raised when the program runs.
+    return _literal(value, node)
+
+def _repeats_too_far(operator, left, right):
+    """Tells whether a repetition would build a string longer than MAX_FOLDED_STRING, checked before it is built."""
+    if operator != "*":
+        return False
+    if isinstance(right, str):
+        left, right = right, left
+    return isinstance(left, str) and isinstance(right, int) and len(left) * right > MAX_FOLDED_STRING
+
+def _fold_unary(node):
+    op = UNARY_OPERATORS.get(node.operator)
+    if op is None or not _is_constant(node.operand):
+        return node
+    try:
+        value = op(node.operand.value)
+    except Exception:
+        return node
+    return _literal(value, node)
+
+def _fold_if(node):
+    if not _is_constant(node.condition):
+        return node
+    if node.condition.value:
+        return node.then_branch
+    if node.else_branch is not None:
+        return node.else_branch
+    return Block([])
+
+def _fold_while(node):
+    if _is_constant(node.condition) and not node.condition.value:
+        return Block([])
+    return node
+
+def _fold_list(node):
+    if node.elements and all(_is_constant(element) for element in node.elements):
+        return ConstantList([element.value for element in node.elements])
+    return node
+
+def _fold_block(node):
+    # Statements folded away to empty blocks only matter when they provide the block's value.
+    statements = [statement for statement in node.statements[:-1]
+                  if not (isinstance(statement, Block) and not statement.statements)]
+    node.statements = statements + node.statements[-1:]
+    return node
+
+_REWRITES = {
+    Binary: _fold_binary,
+    Unary: _fold_unary,
+    If: _fold_if,
+    While: _fold_while,
+    ListLiteral: _fold_list,
+    Block: _fold_block,
+}
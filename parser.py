@@ -2,33 +2,95 @@
 # The parser.py file contains the Parser class, which is responsible for parsing the tokens produced by the Tokenizer into an Abstract Syntax Tree (AST). 
 # The AST represents the structure of the program in a hierarchical form that can be easily evaluated by the Interpreter.
 
-from lexer import TokenType  # TokenType now includes TRUE, FALSE, NOT, AND, OR, EQUALS, etc.
+from lexer import Token, TokenType, TokenStore, TOKEN_TYPES  # TokenType now includes TRUE, FALSE, NOT, AND, OR, EQUALS, etc.
 from ast_nodes import *  # Import all classes from ast_nodes.py
 
+END_OF_INPUT = Token(TokenType.EOF, None)
+
+# Binding power of each binary operator; higher binds tighter. Assignment binds loosest of all and unary operators
+# tightest, and both are parsed outside this table.
+BINARY_PRECEDENCE = {
+    TokenType.OR: 1,
+    TokenType.AND: 2,
+    TokenType.EQUALS: 3, TokenType.NOT_EQUALS: 3,
+    TokenType.LESS: 4, TokenType.GREATER: 4, TokenType.LESS_EQ: 4, TokenType.GREATER_EQ: 4,
+    TokenType.PLUS: 5, TokenType.MINUS: 5,
+    TokenType.STAR: 6, TokenType.SLASH: 6,
+}
+
+POSTFIX_TOKENS = frozenset((TokenType.LEFT_PAREN, TokenType.DOT, TokenType.LEFT_BRACKET))
+
 class Parser:
-    """Parses a list of tokens into an Abstract Syntax Tree (AST)."""
-    def __init__(self, tokens):
-        self.tokens = tokens
-        self.current = 0
+    """Parses a TokenStore, or a list or stream of tokens, into an Abstract Syntax Tree (AST)."""
+    def __init__(self, tokens, positions=None):
+        self.current = 0  # Index of the lookahead token.
+        # When a dict is given, the index of the first token of every statement in a block or at the top level is
+        # recorded in it, keyed by the statement's node, e.g. for the profiler to report line numbers.
+        self.positions = positions
+        if isinstance(tokens, TokenStore):
+            # Read type codes straight from the store; values are only decoded for the tokens that need them.
+            self.store = tokens
+            self.type = TOKEN_TYPES[tokens.types[0]]
+        else:
+            # Tokens are pulled one at a time, so the parser can consume a lazy token stream as it is produced.
+            self.store = None
+            self.tokens = iter(tokens)
+            self.token = next(self.tokens, END_OF_INPUT)  # One token of lookahead.
+            self.type = self.token.type
+        self.loop_depth = 0      # Number of enclosing while loops, for break and continue.
+        self.function_depth = 0  # Number of enclosing function bodies, for return.
 
     def peek(self):
-        return self.tokens[self.current]
+        if self.store is not None:
+            return self.store[self.current]
+        return self.token
 
     def consume(self, expected_type):
-        token = self.peek()
-        if token.type == expected_type:
-            self.current += 1
-            return token
-        raise SyntaxError(f"Expected token type {expected_type}, but got {token.type}")
+        """Consumes the lookahead token, which must be of the expected type, and returns its value."""
+        if self.type != expected_type:
+            raise self.error(f"Expected token type {expected_type}, but got {self.type}")
+        self.current += 1
+        store = self.store
+        if store is not None:
+            self.type = TOKEN_TYPES[store.types[self.current]]
+            return store.value(self.current - 1)
+        value = self.token.value
+        self.token = next(self.tokens, END_OF_INPUT)
+        self.type = self.token.type
+        return value
+
+    def error(self, message):
+        """Returns a SyntaxError for the lookahead token, with its source position when it is known."""
+        if self.store is not None:
+            line, column = self.store.position(self.current)
+            message = f"{message} at line {line}, column {column}"
+        return SyntaxError(message)
 
     def parse_statement(self):
-        token_type = self.peek().type
+        token_type = self.type
         if token_type == TokenType.RETURN:
+            if not self.function_depth:
+                raise self.error("'return' outside function")
             self.consume(TokenType.RETURN)
             value = self.assignment_expr()
             return Return(value)
+        elif token_type == TokenType.BREAK:
+            if not self.loop_depth:
+                raise self.error("'break' outside loop")
+            self.consume(TokenType.BREAK)
+            return Break()
+        elif token_type == TokenType.CONTINUE:
+            if not self.loop_depth:
+                raise self.error("'continue' outside loop")
+            self.consume(TokenType.CONTINUE)
+            return Continue()
         elif token_type == TokenType.FUN:
             return self.parse_function_declaration()
+        elif token_type == TokenType.MEMO:
+            self.consume(TokenType.MEMO)
+            function = self.parse_function_declaration()
+            function.memo = True
+            return function
         elif token_type == TokenType.LEFT_BRACE:
             return self.parse_block()
         elif token_type == TokenType.PRINT:
@@ -38,7 +100,11 @@ class Parser:
         elif token_type == TokenType.WHILE:
             self.consume(TokenType.WHILE)
             condition = self.assignment_expr()
-            body = self.parse_block() if self.peek().type == TokenType.LEFT_BRACE else self.parse_statement()
+            self.loop_depth += 1
+            try:
+                body = self.parse_block() if self.type == TokenType.LEFT_BRACE else self.parse_statement()
+            finally:
+                self.loop_depth -= 1
             return While(condition, body)
         elif token_type == TokenType.IF:
             self.consume(TokenType.IF)
@@ -46,7 +112,7 @@ class Parser:
             self.consume(TokenType.THEN)
             then_branch = self.parse_statement()
             else_branch = None
-            if self.peek().type == TokenType.ELSE:
+            if self.type == TokenType.ELSE:
                 self.consume(TokenType.ELSE)
                 else_branch = self.parse_statement()
             return If(condition, then_branch, else_branch)
@@ -55,116 +121,108 @@ class Parser:
 
     def parse_function_declaration(self):
         self.consume(TokenType.FUN)  # Consume 'fun'
-        name_token = self.consume(TokenType.IDENTIFIER)
-        name = name_token.value
+        name = self.consume(TokenType.IDENTIFIER)
         self.consume(TokenType.LEFT_PAREN)  # Consume '('
         parameters = []
-        if self.peek().type != TokenType.RIGHT_PAREN:
-            parameters.append(self.consume(TokenType.IDENTIFIER).value)
-            while self.peek().type == TokenType.COMMA:
+        if self.type != TokenType.RIGHT_PAREN:
+            parameters.append(self.consume(TokenType.IDENTIFIER))
+            while self.type == TokenType.COMMA:
                 self.consume(TokenType.COMMA)
-                parameters.append(self.consume(TokenType.IDENTIFIER).value)
+                parameters.append(self.consume(TokenType.IDENTIFIER))
         self.consume(TokenType.RIGHT_PAREN)  # Consume ')'
-        body = self.parse_block()            # Parse the function body as a block
+        # A function body starts outside of any loop.
+        outer_loop_depth, self.loop_depth = self.loop_depth, 0
+        self.function_depth += 1
+        try:
+            body = self.parse_block()        # Parse the function body as a block
+        finally:
+            self.function_depth -= 1
+            self.loop_depth = outer_loop_depth
         return Function(name, parameters, body)
 
     def parse_block(self):
         statements = []
         self.consume(TokenType.LEFT_BRACE)  # Expect opening '{'
-        while self.peek().type != TokenType.RIGHT_BRACE:
-            statements.append(self.parse_statement())
+        while self.type != TokenType.RIGHT_BRACE:
+            statements.append(self.parse_positioned_statement())
         self.consume(TokenType.RIGHT_BRACE)  # Expect closing '}'
         return Block(statements)
 
     def parse_program(self):
-        statements = []
-        while self.peek().type != TokenType.EOF:
-            statements.append(self.parse_statement())
-        return Block(statements)
+        return Block(list(self.iter_statements()))
+
+    def iter_statements(self):
+        """Yields the top-level statements of the program one at a time, as soon as each has been parsed."""
+        while self.type != TokenType.EOF:
+            yield self.parse_positioned_statement()
+
+    def parse_positioned_statement(self):
+        start = self.current
+        statement = self.parse_statement()
+        if self.positions is not None:
+            self.positions[statement] = start
+        return statement
 
     def parse(self):
         return self.parse_statement()
 
     def assignment_expr(self):
-        node = self.equality_expr()
-        while self.peek().type == TokenType.ASSIGN:
+        node = self.parse_expression()
+        while self.type == TokenType.ASSIGN:
             self.consume(TokenType.ASSIGN)
             value = self.assignment_expr()  # Right-hand side
             node = Assignment(node, value)
         return node
 
-    def or_expr(self):
-        node = self.and_expr()
-        while self.peek().type == TokenType.OR:
-            op = self.consume(TokenType.OR)
-            right = self.and_expr()
-            node = Binary(node, op.value, right)
-        return node
-
-    def and_expr(self):
-        node = self.equality_expr()
-        while self.peek().type == TokenType.AND:
-            op = self.consume(TokenType.AND)
-            right = self.equality_expr()
-            node = Binary(node, op.value, right)
-        return node
-
-    def equality_expr(self):
-        node = self.relational_expr()
-        while self.peek().type in (TokenType.EQUALS, TokenType.NOT_EQUALS):
-            op = self.consume(self.peek().type)
-            right = self.relational_expr()
-            node = Binary(node, op.value, right)
-        return node
-
-    def relational_expr(self):
-        node = self.add_expr()
-        while self.peek().type in (TokenType.LESS, TokenType.GREATER,
-                                   TokenType.LESS_EQ, TokenType.GREATER_EQ):
-            op = self.consume(self.peek().type)
-            right = self.add_expr()
-            node = Binary(node, op.value, right)
-        return node
-
-    def add_expr(self):
-        node = self.mult_expr()
-        while self.peek().type in (TokenType.PLUS, TokenType.MINUS):
-            op = self.consume(self.peek().type)
-            right = self.mult_expr()
-            node = Binary(node, op.value, right)
-        return node
-
-    def mult_expr(self):
+    def parse_expression(self, min_precedence=1):
+        """Parses binary operators by precedence climbing, recursing only for the operator levels actually present."""
         node = self.factor()
-        while self.peek().type in (TokenType.STAR, TokenType.SLASH):
-            op = self.consume(self.peek().type)
-            right = self.factor()
-            node = Binary(node, op.value, right)
+        precedence = BINARY_PRECEDENCE.get(self.type)
+        while precedence is not None and precedence >= min_precedence:
+            op = self.consume(self.type)
+            right = self.parse_expression(precedence + 1)  # All binary operators are left-associative.
+            node = Binary(node, op, right)
+            precedence = BINARY_PRECEDENCE.get(self.type)
         return node
 
     def parse_list_literal(self):
         elements = []
         self.consume(TokenType.LEFT_BRACKET)  # Consume '['
-        if self.peek().type == TokenType.RIGHT_BRACKET:
+        if self.type == TokenType.RIGHT_BRACKET:
             self.consume(TokenType.RIGHT_BRACKET)
             return ListLiteral(elements)
         while True:
             elem = self.assignment_expr()
             elements.append(elem)
-            if self.peek().type == TokenType.COMMA:
+            if self.type == TokenType.COMMA:
                 self.consume(TokenType.COMMA)
             else:
                 break
         self.consume(TokenType.RIGHT_BRACKET)  # Consume ']'
         return ListLiteral(elements)
 
+    def parse_map_literal(self):
+        """Parses {key: value, ...}. A '{' that starts a statement opens a block instead."""
+        keys, values = [], []
+        self.consume(TokenType.LEFT_BRACE)  # Consume '{'
+        while self.type != TokenType.RIGHT_BRACE:
+            keys.append(self.assignment_expr())
+            self.consume(TokenType.COLON)
+            values.append(self.assignment_expr())
+            if self.type == TokenType.COMMA:
+                self.consume(TokenType.COMMA)
+            else:
+                break
+        self.consume(TokenType.RIGHT_BRACE)  # Consume '}'
+        return MapLiteral(keys, values)
+
     def parse_arguments(self):
         """Helper to parse comma-separated arguments within parentheses."""
         args = []
         self.consume(TokenType.LEFT_PAREN)  # Consume '('
-        if self.peek().type != TokenType.RIGHT_PAREN:
+        if self.type != TokenType.RIGHT_PAREN:
             args.append(self.assignment_expr())
-            while self.peek().type == TokenType.COMMA:
+            while self.type == TokenType.COMMA:
                 self.consume(TokenType.COMMA)
                 args.append(self.assignment_expr())
         self.consume(TokenType.RIGHT_PAREN)  # Consume ')'
@@ -172,20 +230,19 @@ class Parser:
 
     def parse_postfix(self, node):
         """Helper to handle postfix operators: function calls, member access, and list indexing."""
-        while self.peek().type in (TokenType.LEFT_PAREN, TokenType.DOT, TokenType.LEFT_BRACKET):
-            if self.peek().type == TokenType.LEFT_PAREN:
+        while self.type in POSTFIX_TOKENS:
+            if self.type == TokenType.LEFT_PAREN:
                 args = self.parse_arguments()
                 node = Call(node, args)
-            elif self.peek().type == TokenType.DOT:
+            elif self.type == TokenType.DOT:
                 self.consume(TokenType.DOT)  # Consume '.'
-                member_token = self.consume(TokenType.IDENTIFIER)
-                member_name = member_token.value
-                if self.peek().type == TokenType.LEFT_PAREN:
+                member_name = self.consume(TokenType.IDENTIFIER)
+                if self.type == TokenType.LEFT_PAREN:
                     args = self.parse_arguments()
                     node = MemberCall(node, member_name, args)
                 else:
-                    raise SyntaxError("Expected '(' after member name for method call")
-            elif self.peek().type == TokenType.LEFT_BRACKET:
+                    raise self.error("Expected '(' after member name for method call")
+            elif self.type == TokenType.LEFT_BRACKET:
                 self.consume(TokenType.LEFT_BRACKET)
                 index_expr = self.assignment_expr()
                 self.consume(TokenType.RIGHT_BRACKET)
@@ -193,36 +250,37 @@ class Parser:
         return node
 
     def factor(self):
-        token = self.peek()
-        if token.type == TokenType.NUMBER:
-            self.consume(TokenType.NUMBER)
-            node = Number(token.value)
-        elif token.type == TokenType.STRING:
-            self.consume(TokenType.STRING)
-            node = StringLiteral(token.value)
-        elif token.type == TokenType.TRUE:
+        token_type = self.type
+        if token_type == TokenType.NUMBER:
+            node = Number(self.consume(TokenType.NUMBER))
+        elif token_type == TokenType.STRING:
+            node = StringLiteral(self.consume(TokenType.STRING))
+        elif token_type == TokenType.TRUE:
             self.consume(TokenType.TRUE)
             node = BooleanLiteral(True)
-        elif token.type == TokenType.FALSE:
+        elif token_type == TokenType.FALSE:
             self.consume(TokenType.FALSE)
             node = BooleanLiteral(False)
-        elif token.type == TokenType.IDENTIFIER:
-            self.consume(TokenType.IDENTIFIER)
-            node = Identifier(token.value)
-        elif token.type == TokenType.LEFT_PAREN:
+        elif token_type == TokenType.IDENTIFIER:
+            node = Identifier(self.consume(TokenType.IDENTIFIER))
+        elif token_type == TokenType.LEFT_PAREN:
             self.consume(TokenType.LEFT_PAREN)
-            node = self.or_expr()
+            node = self.parse_expression()
             self.consume(TokenType.RIGHT_PAREN)
-        elif token.type == TokenType.LEFT_BRACKET:
+        elif token_type == TokenType.LEFT_BRACKET:
             node = self.parse_list_literal()
-        elif token.type == TokenType.MINUS:
+        elif token_type == TokenType.LEFT_BRACE:
+            node = self.parse_map_literal()
+        elif token_type == TokenType.MINUS:
             op = self.consume(TokenType.MINUS)
             right = self.factor()
-            node = Unary(op.value, right)
-        elif token.type == TokenType.NOT:
+            node = Unary(op, right)
+        elif token_type == TokenType.NOT:
             op = self.consume(TokenType.NOT)
             right = self.factor()
-            node = Unary(op.value, right)
+            node = Unary(op, right)
         else:
-            raise SyntaxError(f"Unexpected token: {token}")
-        return self.parse_postfix(node)
+            raise self.error(f"Unexpected token: {self.peek()}")
+        if self.type in POSTFIX_TOKENS:
+            node = self.parse_postfix(node)
+        return node
@@ -0,0 +1,165 @@
+# profiler.py
+# A profiler for programs run by the tree-walking Interpreter: call counts and inclusive/exclusive time per function, and
+# run counts and timings per statement, reported as a table or as collapsed stacks for flamegraph tools.
+#
+#   profiler = Profiler()
+#   Interpreter(profiler=profiler).evaluate(program)
+#   print(profiler.report())
+#
+# Attaching a Profiler replaces evaluate on that one interpreter instance with a timing wrapper; the class keeps its
+# ordinary method, so interpreters that are not being profiled run exactly as fast as before.
+# A function call is recognised when the body of a function defined in the program is evaluated, and a statement is
+# any node in the statement list of a block. Inclusive times count recursive calls once, at the outermost call.
+
+import time
+from ast_nodes import Function, Block
+
+ROOT = "<program>"  # Name of the top of every stack, for the code outside any function
+
+
+class Profiler:
+    """Collects call counts and timings from the tree-walking interpreters it is attached to."""
+    def __init__(self, lines=None, clock=time.perf_counter):
+        self.lines = lines if lines is not None else {}  # Statement node -> source line, where known
+        self.clock = clock
+        self.total = 0.0      # Seconds spent in profiled evaluations
+        self.functions = {}   # Function -> [calls, inclusive, exclusive, active calls]
+        self.statements = {}  # Statement node -> [runs, inclusive, exclusive, active runs]
+        self.stacks = {}      # "<program>;f;g" -> seconds spent in g itself when called through f
+        self._bodies = {}     # Function body -> Function
+        self._blocks = set()
+        self._statement_nodes = set()
+        self._path = [ROOT]
+        # Time spent in nested function calls and statements, one entry for each that is running.
+        self._function_children = [0.0]
+        self._statement_children = [0.0]
+        self._running = False
+
+    def attach(self, interpreter):
+        """Profiles every evaluation run by interpreter from now on."""
+        from interpreter import Interpreter
+        if type(interpreter).evaluate is not Interpreter.evaluate:
+            raise ValueError("The profiler needs the tree engine, which evaluates one node at a time")
+        evaluate = Interpreter.evaluate.__get__(interpreter)  # The method without profiling
+        for value in list(interpreter.variables.values()):
+            if isinstance(value, Function):
+                self._bodies[value.body] = value
+        interpreter.evaluate = self._wrap(evaluate)
+
+    def detach(self, interpreter):
+        """Stops profiling interpreter."""
+        interpreter.__dict__.pop("evaluate", None)
+
+    def _wrap(self, evaluate):
+        bodies = self._bodies
+        blocks = self._blocks
+        statement_nodes = self._statement_nodes
+        timed_call = self._timed_call
+        timed_statement = self._timed_statement
+
+        def profiled_evaluate(expr):
+            if not self._running:
+                return self._timed_run(profiled_evaluate, expr)
+            kind = type(expr)
+            if kind is Function:
+                bodies[expr.body] = expr
+            elif kind is Block and expr not in blocks:
+                blocks.add(expr)
+                statement_nodes.update(expr.statements)
+            func = bodies.get(expr)
+            if func is not None:
+                return timed_call(evaluate, expr, func)
+            if expr in statement_nodes:
+                return timed_statement(evaluate, expr)
+            return evaluate(expr)
+        return profiled_evaluate
+
+    def _timed_run(self, evaluate, expr):
+        clock = self.clock
+        self._running = True
+        start = clock()
+        try:
+            return evaluate(expr)
+        finally:
+            elapsed = clock() - start
+            self._running = False
+            self.total += elapsed
+            self.stacks[ROOT] = self.stacks.get(ROOT, 0.0) + elapsed - self._function_children[0]
+            self._function_children[0] = 0.0
+            self._statement_children[0] = 0.0
+
+    def _timed_call(self, evaluate, body, func):
+        stats = self.functions.get(func)
+        if stats is None:
+            stats = self.functions[func] = [0, 0.0, 0.0, 0]
+        stats[0] += 1
+        stats[3] += 1
+        path = self._path
+        path.append(func.name)
+        children = self._function_children
+        children.append(0.0)
+        clock = self.clock
+        start = clock()
+        try:
+            return evaluate(body)
+        finally:
+            elapsed = clock() - start
+            exclusive = elapsed - children.pop()
+            children[-1] += elapsed
+            stats[2] += exclusive
+            stats[3] -= 1
+            if not stats[3]:
+                stats[1] += elapsed
+            key = ";".join(path)
+            self.stacks[key] = self.stacks.get(key, 0.0) + exclusive
+            path.pop()
+
+    def _timed_statement(self, evaluate, node):
+        stats = self.statements.get(node)
+        if stats is None:
+            stats = self.statements[node] = [0, 0.0, 0.0, 0]
+        stats[0] += 1
+        stats[3] += 1
+        children = self._statement_children
+        children.append(0.0)
+        clock = self.clock
+        start = clock()
+        try:
+            return evaluate(node)
+        finally:
+            elapsed = clock() - start
+            stats[2] += elapsed - children.pop()
+            children[-1] += elapsed
+            stats[3] -= 1
+            if not stats[3]:
+                stats[1] += elapsed
+
+    def report(self, limit=20):
+        """Returns the functions and statements that took the most time of their own, as a table."""
+        lines = [f"Total time: {self.total:.6f}s", "",
+                 f"{'calls':>9} {'inclusive':>11} {'exclusive':>11}  function"]
+        for func, (calls, inclusive, exclusive, _) in _by_exclusive_time(self.functions, limit):
+            lines.append(f"{calls:>9} {inclusive:>10.6f}s {exclusive:>10.6f}s  {func.name}")
+        lines += ["", f"{'runs':>9} {'inclusive':>11} {'exclusive':>11}  {'line':>5}  statement"]
+        for node, (runs, inclusive, exclusive, _) in _by_exclusive_time(self.statements, limit):
+            line = self.lines.get(node, "")
+            lines.append(f"{runs:>9} {inclusive:>10.6f}s {exclusive:>10.6f}s  {line:>5}  {_describe(node)}")
+        return "\n".join(lines)
+
+    def collapsed_stacks(self):
+        """Returns the time spent in each function by call stack, one "<program>;f;g microseconds" line per stack, the
+        collapsed format read by flamegraph.pl, speedscope and similar tools."""
+        lines = []
+        for path, seconds in sorted(self.stacks.items()):
+            microseconds = round(seconds * 1_000_000)
+            if microseconds > 0:
+                lines.append(f"{path} {microseconds}")
+        return "".join(line + "\n" for line in lines)
+
+
+def _by_exclusive_time(stats, limit):
+    return sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:limit]
+
+def _describe(node, width=60):
+    text = " ".join(repr(node).split())
+    return text if len(text) <= width else text[:width - 3] + "..."
@@ -0,0 +1,66 @@
+# program.py
+# The embedding API: compile a source string once into a Program, then run it as often as needed.
+#
+#   rule = Program('total = price * quantity if total > 100 then "review" else "accept"')
+#   for record in records:
+#       decision = rule.run({"price": record.price, "quantity": record.quantity})
+#
+# A Program holds the tokenized, parsed, optimized and engine-compiled form of its source. Its attributes never change
+# after it is built, and every run gets a fresh interpreter with its own variables, frames, budget and output, so one
+# Program can be run from many threads at once.
+# The one thing runs do write into the shared form is the inline caches at call sites (Call.site in the tree, the call
+# closures' site, Code.sites and Arena.sites), which remember the function a site called last. Each cache entry is
+# replaced by a single store of a tuple that is complete on its own, and a run only uses an entry whose function is the
+# one it is calling, so concurrent runs that overwrite each other's entries still compute the same results.
+
+from lexer import Tokenizer
+from parser import Parser
+from optimizer import optimize
+from engines import ENGINES, DEFAULT_ENGINE
+from ropes import Rope
+
+
+class Program:
+    """A compiled program that can be run any number of times with different inputs.
+    Its attributes are immutable; see the module comment for the call-site caches that runs update."""
+    __slots__ = ('source', 'engine', '_engine_class', '_prepared', '_weights')
+
+    def __init__(self, source, engine=DEFAULT_ENGINE, optimize_ast=True):
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine '{engine}', expected one of: {', '.join(ENGINES)}")
+        ast = Parser(Tokenizer(source).tokenize_compact()).parse_program()
+        if optimize_ast:
+            ast = optimize(ast)
+        compiler = ENGINES[engine]()
+        prepared = compiler.prepare(ast)
+        object.__setattr__(self, 'source', source)
+        object.__setattr__(self, 'engine', engine)
+        object.__setattr__(self, '_engine_class', ENGINES[engine])
+        object.__setattr__(self, '_prepared', prepared)
+        object.__setattr__(self, '_weights', compiler.weights)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Program objects are immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Program objects are immutable")
+
+    def __repr__(self):
+        return f"Program({self.source!r}, engine={self.engine!r})"
+
+    def run(self, variables=None, budget=None, stdout=None):
+        """Runs the program and returns the value of its last statement.
+        variables gives the initial global bindings; the mapping itself is copied, not changed by the run."""
+        return self.run_with_globals(variables, budget, stdout)[0]
+
+    def run_with_globals(self, variables=None, budget=None, stdout=None):
+        """Runs the program and returns the value of its last statement together with its final global variables."""
+        interpreter = self._engine_class(budget)
+        interpreter.weights = self._weights
+        interpreter.stdout = stdout
+        if variables:
+            interpreter.variables.update(variables)
+        result = interpreter.run_prepared(self._prepared)
+        if isinstance(result, Rope):
+            result = str(result)  # Hand the host a plain string.
+        return result, interpreter.variables
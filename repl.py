@@ -1,37 +1,66 @@
+import argparse
 import tkinter as tk
-from lexer import Tokenizer
-from parser import Parser
-from interpreter import Interpreter
+from engines import ENGINES, DEFAULT_ENGINE, create_interpreter
+from incremental import Session
+from background import BackgroundRunner
 
-def run_program():
+POLL_INTERVAL_MS = 50       # How often printed output is moved from the worker into the output history
+MAX_OUTPUT_LINES = 10_000   # Older lines are dropped, so a chatty program cannot slow the window down
+
+def run_program(rerun=False):
     # Get the full text from the editor.
     source = text_editor.get("1.0", tk.END).strip()
     if not source:
         return
-    try:
-        # Tokenize, parse, and evaluate your custom language.
-        tokenizer = Tokenizer(source)
-        tokens = tokenizer.tokenize()
-        parser = Parser(tokens)
-        ast = parser.parse_program()
-        result = interpreter.evaluate(ast)
-        # Append the source code and result to the output history.
-        output_text.insert(tk.END, f">>> {source}\n")
-        output_text.insert(tk.END, f"{result}\n")
+    # Only the statements affected by the edits since the last run are parsed and evaluated again, on a worker
+    # thread, so the window stays responsive while the program runs.
+    if not runner.start(source, rerun):
+        return
+    output_text.insert(tk.END, f">>> {source}\n")
+    output_text.see(tk.END)
+    run_button.config(state=tk.DISABLED)
+    run_all_button.config(state=tk.DISABLED)
+    stop_button.config(state=tk.NORMAL)
+    root.after(POLL_INTERVAL_MS, poll_output)
+
+def poll_output():
+    # Append everything printed since the last poll in one insert.
+    text, outcome = runner.drain()
+    if text:
+        output_text.insert(tk.END, text)
+    if outcome is not None:
+        kind, value = outcome
+        # Append the result to the output history.
+        output_text.insert(tk.END, f"Error: {value}\n" if kind == "error" else f"{value}\n")
         output_text.insert(tk.END, "-" * 50 + "\n")
+        run_button.config(state=tk.NORMAL)
+        run_all_button.config(state=tk.NORMAL)
+        stop_button.config(state=tk.DISABLED)
+    else:
+        root.after(POLL_INTERVAL_MS, poll_output)
+    if text or outcome is not None:
+        excess = int(output_text.index("end-1c").split(".")[0]) - MAX_OUTPUT_LINES
+        if excess > 0:
+            output_text.delete("1.0", f"{excess + 1}.0")
         # Scroll to the end to show the latest output.
         output_text.see(tk.END)
-    except Exception as e:
-        output_text.insert(tk.END, f"Error: {e}\n")
-        output_text.insert(tk.END, "-" * 50 + "\n")
-        output_text.see(tk.END)
+
+# Select the execution engine from the command line, e.g. python repl.py --engine vm
+arg_parser = argparse.ArgumentParser(description="Interactive editor for the custom language.")
+arg_parser.add_argument("--engine", choices=ENGINES, default=DEFAULT_ENGINE,
+                        help="execution engine (default: %(default)s)")
+arg_parser.add_argument("--no-optimize", dest="optimize", action="store_false",
+                        help="skip constant folding and dead-branch elimination")
+args = arg_parser.parse_args()
 
 # Set up the main window.
 root = tk.Tk()
-root.title("MyLang Editor with History")
+root.title(f"MyLang Editor with History ({args.engine} engine)")
 
-# Create a single interpreter instance.
-interpreter = Interpreter()
+# Create a single interpreter instance, and the session that keeps the editor buffer in sync with it.
+interpreter = create_interpreter(args.engine)
+session = Session(interpreter, args.optimize)
+runner = BackgroundRunner(session)
 
 # Text widget for entering your language code.
 text_editor = tk.Text(root, wrap="word", height=10, width=80)
@@ -41,6 +70,14 @@ text_editor.pack(pady=10)
 run_button = tk.Button(root, text="Run Code", command=run_program)
 run_button.pack(pady=5)
 
+# Button to run the whole buffer again, whether or not it changed.
+run_all_button = tk.Button(root, text="Run All", command=lambda: run_program(rerun=True))
+run_all_button.pack(pady=5)
+
+# Button to stop the running program.
+stop_button = tk.Button(root, text="Stop", command=lambda: runner.stop(), state=tk.DISABLED)
+stop_button.pack(pady=5)
+
 # Text widget for displaying the output history.
 output_text = tk.Text(root, wrap="word", height=15, width=80, bg="#f0f0f0")
 output_text.pack(pady=10)
@@ -0,0 +1,107 @@
+# resolver.py
+# The resolver pass decides statically where each variable used inside a function lives.
+# Parameters, assigned names and nested function names become locals with a fixed slot in a compact per-call frame.
+# A name a nested function reads but does not assign refers to the innermost enclosing function that declares it: the
+# identifier records that function's slot and how many functions out it is (its depth). Every other name refers to the
+# shared global table. Reading a local before it is assigned falls back to the global of the same name, so a function
+# can still start from a global value and then shadow it.
+#
+# After the locals, every frame holds two links: the function running in it and the frame of its caller. A nested
+# function that reads an enclosing function's variables is marked as capturing; defining it makes a closure, a copy
+# whose enclosing field is the frame it was defined in, and reads at depth d follow d enclosing links. A name found
+# nowhere else, not even among the builtins, is looked up last among the locals of the calling functions, which is
+# where the dynamically scoped interpreter of old found the variables of its callers.
+
+from copy import copy
+from ast_nodes import Assignment, Function, Identifier, iter_child_nodes
+from runtime import UNSET
+
+LINKS = 2  # Slots after the locals in every frame: the running function, then the caller's frame
+
+
+def resolve_function(func, scopes=()):
+    """Assigns a frame slot to every parameter and local of func and returns the slot names.
+    scopes holds the enclosing functions with their slots, innermost first; nested functions are resolved with func."""
+    if func.locals is not None:
+        return func.locals
+    # Parameters take the first slots; a repeated parameter name resolves to its last occurrence.
+    names = list(func.parameters)
+    slots = {name: index for index, name in enumerate(names)}
+    for name in _declared_names(func.body):
+        if name not in slots:
+            slots[name] = len(names)
+            names.append(name)
+    func.locals = tuple(names)
+    _annotate(func.body, ((func, slots),) + scopes)
+    return func.locals
+
+def resolve(program):
+    """Resolves every function definition in a program."""
+    for node in _walk(program):
+        if isinstance(node, Function):
+            resolve_function(node)
+    return program
+
+def frame_size(func):
+    """Returns the number of slots in a frame for func: its locals and the links."""
+    return len(func.locals if func.locals is not None else resolve_function(func)) + LINKS
+
+def closure(func, frame):
+    """Returns func as defined in frame: itself, or a copy reading its enclosing function's variables from frame."""
+    if not func.captures:
+        return func
+    bound = copy(func)
+    bound.enclosing = frame
+    return bound
+
+def enclosing_frame(frame, depth):
+    """Returns the frame depth functions out from frame, following the enclosing links."""
+    while depth:
+        frame = frame[-2].enclosing
+        depth -= 1
+    return frame
+
+def caller_local(name, frame):
+    """Returns the value of name in the nearest calling function that has it set, or UNSET."""
+    while frame is not None:
+        local_names = frame[-2].locals
+        if name in local_names:
+            value = frame[local_names.index(name)]
+            if value is not UNSET:
+                return value
+        frame = frame[-1]
+    return UNSET
+
+def _declared_names(node):
+    """Yields the names bound by assignments and function definitions, not looking into nested functions."""
+    if isinstance(node, Assignment) and isinstance(node.target, Identifier):
+        yield node.target.name
+    if isinstance(node, Function):
+        yield node.name
+        return
+    for child in iter_child_nodes(node):
+        yield from _declared_names(child)
+
+def _annotate(node, scopes):
+    if isinstance(node, Identifier):
+        for depth, (func, slots) in enumerate(scopes):
+            slot = slots.get(node.name)
+            if slot is not None:
+                node.slot, node.depth = slot, depth
+                # Every function between the reader and the declaring function needs its enclosing frame.
+                for inner, _ in scopes[:depth]:
+                    inner.captures = True
+                return
+        node.slot, node.depth = None, 0
+        return
+    if isinstance(node, Function):
+        node.slot = scopes[0][1].get(node.name)
+        resolve_function(node, scopes)
+        return
+    for child in iter_child_nodes(node):
+        _annotate(child, scopes)
+
+def _walk(node):
+    yield node
+    for child in iter_child_nodes(node):
+        yield from _walk(child)
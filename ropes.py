@@ -0,0 +1,96 @@
+# ropes.py
+# Ropes make building a long string by repeated appends, as in s = s + line, cost amortised O(1) per append.
+# Once a concatenation produces a string of ROPE_THRESHOLD characters or more, the result is a Rope: a list of pieces
+# that is only joined into one str when the text is needed, e.g. to print, compare, hash or index it. Appending to a
+# Rope adds a piece to the end of its list. A Rope is immutable: ropes made from the same one share its list of pieces
+# and only look at their own prefix of it, so appending to an older rope copies the pieces it sees first.
+# Prepending, as in s = line + s, joins the rope and is as slow as it is for plain strings.
+
+ROPE_THRESHOLD = 256  # Shorter results stay plain strings, which are faster to build and use.
+
+
+def concat(left, right):
+    """Concatenates two strings, returning a Rope once the result is long enough for appends to be worth deferring."""
+    if len(left) + len(right) < ROPE_THRESHOLD:
+        return left + right
+    return Rope([left, right], 2, len(left) + len(right))
+
+
+class Rope:
+    """A string stored as a list of pieces, joined the first time its text is needed."""
+    __slots__ = ('pieces', 'count', 'length')
+
+    def __init__(self, pieces, count, length):
+        self.pieces = pieces  # Possibly shared with ropes made by appending to this one
+        self.count = count    # Number of pieces of the list that belong to this rope
+        self.length = length
+
+    def __str__(self):
+        if self.count != 1:
+            pieces = self.pieces if len(self.pieces) == self.count else self.pieces[:self.count]
+            # Keep the joined text, in a list of this rope's own.
+            self.pieces = ["".join(pieces)]
+            self.count = 1
+        return self.pieces[0]
+
+    def __add__(self, other):
+        text = str(other)
+        pieces = self.pieces
+        if len(pieces) != self.count:
+            pieces = pieces[:self.count]  # A newer rope has already appended to the shared list.
+        pieces.append(text)
+        return Rope(pieces, len(pieces), self.length + len(text))
+
+    def __radd__(self, other):
+        return concat(str(other), str(self))
+
+    def __len__(self):
+        return self.length
+
+    def __bool__(self):
+        return self.length > 0
+
+    def __getitem__(self, index):
+        return str(self)[index]
+
+    def __iter__(self):
+        return iter(str(self))
+
+    def __contains__(self, text):
+        return str(text) in str(self)
+
+    def __mul__(self, count):
+        return str(self) * count
+
+    __rmul__ = __mul__
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def __eq__(self, other):
+        return str(self) == _text(other)
+
+    def __ne__(self, other):
+        return str(self) != _text(other)
+
+    def __lt__(self, other):
+        return str(self) < _text(other)
+
+    def __le__(self, other):
+        return str(self) <= _text(other)
+
+    def __gt__(self, other):
+        return str(self) > _text(other)
+
+    def __ge__(self, other):
+        return str(self) >= _text(other)
+
+    def __repr__(self):
+        return repr(str(self))
+
+    def __format__(self, spec):
+        return format(str(self), spec)
+
+
+def _text(value):
+    return str(value) if isinstance(value, Rope) else value
@@ -0,0 +1,217 @@
+# runtime.py
+# Shared runtime helpers used by the execution engines.
+# The operator tables map each operator string produced by the Parser to a plain Python function,
+# so an engine can look the operator up once ahead of time instead of comparing strings on every evaluation.
+
+import operator
+from collections import OrderedDict
+from ropes import Rope, concat
+from vectors import Vector
+
+
+def add(left, right):
+    """Addition, or concatenation when either operand is a string."""
+    if isinstance(left, str) or isinstance(right, str):
+        if type(left) is Rope:
+            return left + right  # Appends a piece instead of joining the rope.
+        return concat(str(left), str(right))
+    return left + right
+
+def divide(left, right):
+    """Division with rounding support."""
+    return round(left / right, 2)
+
+def logical_and(left, right):
+    return left and right
+
+def logical_or(left, right):
+    return left or right
+
+BINARY_OPERATORS = {
+    "+": add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": divide,
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    ">": operator.gt,
+    "<=": operator.le,
+    ">=": operator.ge,
+    "and": logical_and,
+    "or": logical_or,
+}
+
+UNARY_OPERATORS = {
+    "!": operator.not_,
+    "not": operator.not_,
+    "-": operator.neg,
+}
+
+def unknown_binary(left, right):
+    """Operators the interpreter does not know about evaluate to None."""
+    return None
+
+def map_error(key, error):
+    """Returns the error for a failed lookup or update of key in a map."""
+    if isinstance(error, KeyError):
+        return Exception(f"Key not found in map: {key!r}")
+    return Exception(f"Invalid map key {key!r}: {error}")
+
+class _Unset:
+    """Marker for a frame slot that has not been assigned yet."""
+    def __repr__(self):
+        return "UNSET"
+
+UNSET = _Unset()
+
+class ExecutionCancelled(Exception):
+    """Raised in a running program once its interpreter has been asked to stop."""
+    def __init__(self):
+        super().__init__("Execution cancelled")
+
+CHECK_INTERVAL = 10_000  # Steps between checkpoints, when no budget sets its own interval.
+
+class Budget:
+    """Limits on the steps, wall-clock seconds and allocated list/string elements of a program; None is no limit."""
+    def __init__(self, max_steps=None, max_seconds=None, max_allocation=None, check_interval=CHECK_INTERVAL):
+        self.max_steps = max_steps
+        self.max_seconds = max_seconds
+        self.max_allocation = max_allocation
+        self.check_interval = check_interval
+
+    def exceeded(self, usage):
+        """Returns the name of the first limit that usage is over, or None."""
+        if self.max_steps is not None and usage["steps"] > self.max_steps:
+            return "steps"
+        if self.max_allocation is not None and usage["allocation"] > self.max_allocation:
+            return "allocation"
+        if self.max_seconds is not None and usage["seconds"] > self.max_seconds:
+            return "seconds"
+        return None
+
+class BudgetExceeded(Exception):
+    """Raised in a running program that has gone over one of the limits of its Budget."""
+    def __init__(self, limit, usage):
+        self.limit = limit  # "steps", "seconds" or "allocation"
+        self.usage = usage  # The counters when the limit was found to be exceeded
+        super().__init__(f"Execution budget exceeded: {limit} (steps={usage['steps']}, "
+                         f"seconds={usage['seconds']:.3f}, allocation={usage['allocation']})")
+
+def sized_operators(allocate):
+    """Returns BINARY_OPERATORS with every operator reporting the size of the strings, lists and vectors it builds to
+    allocate."""
+    sequence = (str, list, Rope)
+    def add_sized(left, right):
+        result = add(left, right)
+        if type(result) is Rope and type(left) is Rope:
+            allocate(len(result) - len(left))  # Appending to a rope only builds the new piece.
+        elif isinstance(result, (str, list, Rope, Vector)):
+            allocate(len(result))
+        return result
+    def multiply_sized(left, right):
+        # Repetition is charged before it runs, so an oversized result is never built.
+        if isinstance(left, sequence) and isinstance(right, int):
+            allocate(len(left) * right)
+        elif isinstance(right, sequence) and isinstance(left, int):
+            allocate(len(right) * left)
+        result = left * right
+        if type(result) is Vector:
+            allocate(len(result))
+        return result
+    def sized(op):
+        def vector_sized(left, right):
+            result = op(left, right)
+            if type(result) is Vector:
+                allocate(len(result))
+            return result
+        return vector_sized
+    operators = {name: sized(op) for name, op in BINARY_OPERATORS.items() if name not in ("and", "or")}
+    return {**BINARY_OPERATORS, **operators, "+": add_sized, "*": multiply_sized}
+
+MEMO_SIZE = 10_000  # Results each memo function keeps by default before dropping the least recently used.
+
+class MemoCache:
+    """The results of one memo function, keyed by memo_key() of the arguments, least recently used first.
+    A list, map or vector result is stored and handed out as a copy, so a caller changing the value it got back does
+    not change what later calls return."""
+    __slots__ = ('results', 'max_size', 'hits', 'misses')
+
+    def __init__(self, max_size=MEMO_SIZE):
+        self.results = OrderedDict()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Returns the cached result for key, or UNSET if there is none."""
+        results = self.results
+        try:
+            result = results[key]
+        except KeyError:
+            self.misses += 1
+            return UNSET
+        results.move_to_end(key)
+        self.hits += 1
+        if type(result) in _CONTAINERS:
+            return memo_copy(result)
+        return result
+
+    def put(self, key, result):
+        results = self.results
+        results[key] = memo_copy(result) if type(result) in _CONTAINERS else result
+        if len(results) > self.max_size:
+            results.popitem(last=False)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.results)}
+
+def memo_key(args):
+    """Returns a hashable key for a list of argument values. Lists, maps and vectors are keyed by a snapshot of their
+    contents, so changing one after a call does not change the key that call was cached under."""
+    for value in args:
+        if type(value) is not int and type(value) is not str:
+            return tuple(map(_frozen, args))
+    return tuple(args)
+
+def _frozen(value):
+    kind = type(value)
+    if kind is int or kind is str:
+        return value
+    if kind is list:
+        return (list, tuple(map(_frozen, value)))
+    if kind is dict:
+        return (dict, frozenset((_frozen(key), _frozen(item)) for key, item in value.items()))
+    if kind is Vector:
+        return (Vector, value.data.typecode, value.data.tobytes())
+    if kind is Rope:
+        return str(value)
+    # Tagged with the type, so that true, 1 and 1.0 are different arguments.
+    return (kind, value)
+
+_CONTAINERS = (list, dict, Vector)
+
+def memo_copy(value):
+    """Returns a copy of a result that shares no list, map or vector with it."""
+    kind = type(value)
+    if kind is list:
+        return [memo_copy(item) if type(item) in _CONTAINERS else item for item in value]
+    if kind is dict:
+        return {key: memo_copy(item) if type(item) in _CONTAINERS else item for key, item in value.items()}
+    if kind is Vector:
+        return Vector(value.data[:])
+    return value
+
+# Derived from BaseException so that handlers for language errors never intercept it.
+class ControlFlow(BaseException):
+    """Unwinds evaluation for return, break and continue."""
+
+class ReturnSignal(ControlFlow):
+    def __init__(self, value):
+        self.value = value
+
+class BreakSignal(ControlFlow):
+    pass
+
+class ContinueSignal(ControlFlow):
+    pass
@@ -3,15 +3,27 @@
 # We’re testing everything—from basic arithmetic to control flow and advanced features.
 # Unit tests are critical to ensure our interpreter works perfectly, and these tests are fantastic.
 
+import os
 import pytest
-from lexer import Tokenizer
+from lexer import Tokenizer, TokenType
 from parser import Parser
 from interpreter import Interpreter
+from compiler import ClosureInterpreter
+from vm import VirtualMachine
+from engines import ENGINES, create_interpreter
+from optimizer import optimize
+from ast_nodes import *
+
+# Every test runs against each execution engine, which must all behave the same.
+# Tests that create their own interpreter or Program take the engine's registered name.
+@pytest.fixture(params=list(ENGINES))
+def engine_name(request):
+    return request.param
 
 # A pytest fixture to create a fresh interpreter for each test.
 @pytest.fixture
-def interpreter():
-    return Interpreter()
+def interpreter(engine_name):
+    return ENGINES[engine_name]()
 
 # A helper function to run a source string through the interpreter.
 def run_program(source, interpreter):
@@ -204,6 +216,1551 @@ def test_function_call(interpreter):
     run_program(source, interpreter)
     assert interpreter.variables.get("result") == 5
 
+def test_return_exits_loop_early(interpreter):
+    source = '''{
+    fun find(xs, target) {
+        i = 0
+        while i < 100 {
+            visited.push_back(i)
+            if xs[i] == target then return i
+            i = i + 1
+        }
+        return -1
+    }
+    visited = []
+    xs = [4, 8, 15, 16, 23, 42]
+    found = find(xs, 15)
+    }'''
+    run_program(source, interpreter)
+    assert interpreter.variables.get("found") == 2
+    assert interpreter.variables.get("visited") == [0, 1, 2]
+
+def test_return_skips_remaining_statements(interpreter):
+    source = '''{
+    fun f(n) {
+        if n < 2 then return n
+        return f(n - 1) + f(n - 2)
+    }
+    result = f(10)
+    }'''
+    run_program(source, interpreter)
+    assert interpreter.variables.get("result") == 55
+
+def test_break_and_continue(interpreter):
+    source = '''{
+    evens = []
+    i = 0
+    odd = false
+    while true {
+        i = i + 1
+        odd = !odd
+        if i > 10 then break
+        if odd then continue
+        evens.push_back(i)
+        last = i
+    }
+    }'''
+    run_program(source, interpreter)
+    assert interpreter.variables.get("evens") == [2, 4, 6, 8, 10]
+    assert interpreter.variables.get("last") == 10
+    assert interpreter.variables.get("i") == 11
+
+def test_break_only_leaves_innermost_loop(interpreter):
+    source = '''{
+    pairs = 0
+    i = 0
+    while i < 3 {
+        j = 0
+        while true {
+            if j == 2 then break
+            pairs = pairs + 1
+            j = j + 1
+        }
+        i = i + 1
+    }
+    }'''
+    run_program(source, interpreter)
+    assert interpreter.variables.get("pairs") == 6
+
+@pytest.mark.parametrize("source", [
+    '{ break }',
+    '{ while true { fun f() { continue } } }',
+    '{ return 1 }',
+])
+def test_control_flow_outside_its_construct(source):
+    with pytest.raises(SyntaxError):
+        Parser(Tokenizer(source).tokenize()).parse_program()
+
+# ---------------------------
+# Stage 7: Execution Engine Tests
+# ---------------------------
+
+def test_engines_agree_on_loop_program():
+    source = '''{
+    fun square(n) {
+        return n * n
+    }
+    total = 0
+    squares = []
+    i = 0
+    while i < 20 {
+        total = total + square(i) - i / 4
+        squares.push_back(square(i))
+        i = i + 1
+    }
+    label = "total: " + total
+    }'''
+    tree = Interpreter()
+    run_program(source, tree)
+    for engine in ENGINES.values():
+        other = engine()
+        run_program(source, other)
+        for name in ("total", "squares", "label", "i"):
+            assert other.variables.get(name) == tree.variables.get(name)
+
+def test_closure_compiler_reuses_function_bodies():
+    interpreter = ClosureInterpreter()
+    run_program('''{
+    fun inc(n) { return n + 1 }
+    x = inc(inc(1))
+    }''', interpreter)
+    assert interpreter.variables.get("x") == 3
+    assert len(interpreter.compiler.function_bodies) == 1
+
+def test_bytecode_resolves_jumps_at_compile_time():
+    from bytecode import BytecodeCompiler, JUMP, POP_JUMP_IF_FALSE
+    tokens = Tokenizer('{ i = 0 while i < 3 { if i == 1 then j = i else j = 0 i = i + 1 } }').tokenize()
+    code = BytecodeCompiler().compile_program(Parser(tokens).parse_program())
+    instructions = code.instructions
+    jumps = [instructions[pc + 1] for pc in range(0, len(instructions), 2)
+             if instructions[pc] in (JUMP, POP_JUMP_IF_FALSE)]
+    assert len(jumps) == 4
+    assert all(0 <= target <= len(instructions) - 2 and target % 2 == 0 for target in jumps)
+
+def test_vm_calls_functions_and_members():
+    interpreter = VirtualMachine()
+    run_program('''{
+    fun total(xs, n) {
+        i = 0
+        t = 0
+        while i < n {
+            t = t + xs[i]
+            i = i + 1
+        }
+        return t
+    }
+    xs = [1, 2]
+    xs.push_back(3)
+    xs[0] = 10
+    result = total(xs, 3)
+    }''', interpreter)
+    assert interpreter.variables.get("result") == 15
+    assert "t" not in interpreter.variables
+
+# ---------------------------
+# Stage 8: Scoping Tests
+# ---------------------------
+
+def test_function_locals_do_not_leak(interpreter):
+    source = '''{
+    x = 1
+    fun f(a) {
+        x = a * 10
+        y = x + 1
+        return y
+    }
+    result = f(4)
+    }'''
+    run_program(source, interpreter)
+    assert interpreter.variables.get("result") == 41
+    assert interpreter.variables.get("x") == 1
+    assert "y" not in interpreter.variables
+    assert "a" not in interpreter.variables
+
+def test_function_reads_globals_live(interpreter):
+    source = '''{
+    fun scaled(n) {
+        return n * factor
+    }
+    factor = 2
+    first = scaled(5)
+    factor = 3
+    second = scaled(5)
+    }'''
+    run_program(source, interpreter)
+    assert interpreter.variables.get("first") == 10
+    assert interpreter.variables.get("second") == 15
+
+def test_local_read_before_assignment_uses_global(interpreter):
+    source = '''{
+    count = 5
+    fun bump() {
+        count = count + 1
+        return count
+    }
+    result = bump()
+    }'''
+    run_program(source, interpreter)
+    assert interpreter.variables.get("result") == 6
+    assert interpreter.variables.get("count") == 5
+
+def test_recursive_function_with_local_helper(interpreter):
+    source = '''{
+    fun sum_to(n) {
+        fun half(v) { return v / 2 }
+        if n == 0 then total = 0 else total = n + sum_to(n - 1)
+        return total
+    }
+    result = sum_to(30)
+    }'''
+    run_program(source, interpreter)
+    assert interpreter.variables.get("result") == 465
+    assert "half" not in interpreter.variables
+
+def test_nested_function_reads_enclosing_parameter(interpreter):
+    source = '''{
+    x = 100
+    fun outer(x) {
+        fun inner() { return x }
+        return inner()
+    }
+    result = outer(5)
+    }'''
+    run_program(source, interpreter)
+    assert interpreter.variables.get("result") == 5
+
+def test_nested_function_reads_two_functions_out(interpreter):
+    source = '''{
+    fun outer(a) {
+        fun middle(b) {
+            fun inner() { return a * 10 + b }
+            return inner()
+        }
+        return middle(2)
+    }
+    result = outer(4)
+    }'''
+    run_program(source, interpreter)
+    assert interpreter.variables.get("result") == 42
+
+def test_nested_function_writes_stay_local(interpreter):
+    source = '''{
+    fun outer() {
+        x = 1
+        fun inner() {
+            seen = x
+            x = 2
+            return seen * 10 + x
+        }
+        first = inner()
+        x = 3
+        second = inner()
+        return [first, second, x]
+    }
+    result = outer()
+    }'''
+    run_program(source, interpreter)
+    assert interpreter.variables.get("result") == [12, 32, 3]
+    assert "x" not in interpreter.variables
+
+def test_closure_keeps_its_enclosing_frame(interpreter):
+    source = '''{
+    fun make_adder(n) {
+        fun add(v) { return v + n }
+        return add
+    }
+    add2 = make_adder(2)
+    add5 = make_adder(5)
+    result = [add2(1), add5(1), add2(10)]
+    }'''
+    run_program(source, interpreter)
+    assert interpreter.variables.get("result") == [3, 6, 12]
+
+def test_nested_function_calls_itself(interpreter):
+    source = '''{
+    fun total(n) {
+        fun down(i) { if i == 0 then return 0 else return i + down(i - 1) }
+        return down(n)
+    }
+    result = total(10)
+    }'''
+    run_program(source, interpreter)
+    assert interpreter.variables.get("result") == 55
+
+def test_undefined_name_falls_back_to_caller_locals(interpreter):
+    source = '''{
+    fun g() { return a }
+    fun f(a) { return g() }
+    result = f(3)
+    }'''
+    run_program(source, interpreter)
+    assert interpreter.variables.get("result") == 3
+    with pytest.raises(Exception, match="Undefined variable: a"):
+        run_program('{ g() }', interpreter)
+
+def test_resolver_assigns_frame_slots():
+    from resolver import resolve_function
+    tokens = Tokenizer('fun f(a, b) { c = a + b  fun g() { d = 1 }  return c + e }').tokenize()
+    func = Parser(tokens).parse_program().statements[0]
+    assert resolve_function(func) == ("a", "b", "c", "g")
+    assign_c, define_g, ret = func.body.statements
+    assert assign_c.target.slot == 2
+    assert define_g.slot == 3
+    assert ret.value.right.slot is None  # e is a global
+    assert define_g.locals == ("d",)     # nested functions are resolved along with the enclosing one
+    assert not define_g.captures
+
+# ---------------------------
+# Stage 9: Deep Recursion Tests
+# ---------------------------
+
+def test_vm_deep_recursion_uses_heap_frames():
+    interpreter = VirtualMachine()
+    source = '''{
+    fun depth(n) {
+        if n == 0 then return 0 else return 1 + depth(n - 1)
+    }
+    result = depth(20000)
+    }'''
+    run_program(source, interpreter)
+    assert interpreter.variables.get("result") == 20000
+
+def test_vm_tail_calls_reuse_frames():
+    interpreter = VirtualMachine()
+    interpreter.max_call_depth = 10
+    source = '''{
+    fun loop(n, acc) {
+        if n == 0 then return acc
+        else return loop(n - 1, acc + n)
+    }
+    result = loop(5000, 0)
+    }'''
+    run_program(source, interpreter)
+    assert interpreter.variables.get("result") == 12502500
+
+def test_vm_call_depth_limit():
+    interpreter = VirtualMachine()
+    interpreter.max_call_depth = 10
+    source = '''{
+    fun depth(n) {
+        if n == 0 then return 0 else return 1 + depth(n - 1)
+    }
+    result = depth(50)
+    }'''
+    with pytest.raises(Exception, match="Maximum call depth exceeded"):
+        run_program(source, interpreter)
+
+# ---------------------------
+# Stage 10: Optimizer Tests
+# ---------------------------
+
+def parse_optimized(source):
+    return optimize(Parser(Tokenizer(source).tokenize()).parse_program())
+
+def test_optimizer_folds_constants():
+    program = parse_optimized('{ x = 2 * 3 + 4  s = "n=" + 1 / 4  b = !(1 < 2)  y = x * (2 + 3) }')
+    x, s, b, y = program.statements[0].statements
+    assert isinstance(x.value, Number) and x.value.value == 10
+    assert isinstance(s.value, StringLiteral) and s.value.value == "n=0.25"
+    assert isinstance(b.value, BooleanLiteral) and b.value.value is False
+    assert isinstance(y.value, Binary) and isinstance(y.value.right, Number) and y.value.right.value == 5
+
+def test_optimizer_leaves_runtime_errors_in_place():
+    program = parse_optimized('{ x = 1 / 0 }')
+    assert isinstance(program.statements[0].statements[0].value, Binary)
+
+def test_optimizer_leaves_huge_repetitions_unbuilt():
+    import tracemalloc
+    tracemalloc.start()
+    try:
+        program = parse_optimized('{ s = "a" * 200000000  t = 200000000 * "ab" }')
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    s, t = program.statements[0].statements
+    assert isinstance(s.value, Binary) and isinstance(t.value, Binary)
+    assert peak < 1_000_000
+
+def test_optimizer_removes_dead_branches():
+    program = parse_optimized('''{
+    if 1 > 2 then print "never" else x = 1
+    while false { print "never" }
+    if true then y = 2
+    z = 3
+    }''')
+    statements = program.statements[0].statements
+    assert [type(statement) for statement in statements] == [Assignment, Assignment, Assignment]
+
+def test_optimizer_constant_lists_are_fresh_copies(interpreter):
+    source = '''{
+    fun make() { return [1, 2, 3] }
+    a = make()
+    a.push_back(4)
+    b = make()
+    }'''
+    interpreter.evaluate(parse_optimized(source))
+    assert interpreter.variables.get("a") == [1, 2, 3, 4]
+    assert interpreter.variables.get("b") == [1, 2, 3]
+
+def test_optimized_program_matches_unoptimized(interpreter):
+    source = '''{
+    debug = false
+    total = 0
+    items = []
+    i = 0
+    while i < 10 {
+        total = total + i * (60 * 60) - 2 / 4
+        if debug then print "debug" else items.push_back([i, "x" + 2 * 3, !false])
+        i = i + 1
+    }
+    }'''
+    run_program(source, interpreter)
+    expected = dict(interpreter.variables)
+    optimized = type(interpreter)()
+    optimized.evaluate(parse_optimized(source))
+    assert optimized.variables == expected
+
+# ---------------------------
+# Stage 11: Tokenizer Tests
+# ---------------------------
+
+def token_stream(tokenize, source):
+    try:
+        return [(token.type, token.value, type(token.value)) for token in tokenize(Tokenizer(source))]
+    except Exception as e:
+        return (type(e), str(e))
+
+@pytest.mark.parametrize("source", [
+    '{ x = .5 + 1.25 * y.push_back(3) }',
+    'fun f(a) { return a >= 1 and a != 2 or !TRUE } # comment "quoted"',
+    'name_1 = "a long string # not a comment"\n\tprint name_1',
+    'caf\u00e9 = 3 \u0663 x\u00b2 = 1',
+    '"unterminated',
+    'x = 1 @ 2',
+    '1.2.3',
+    '',
+])
+def test_regex_tokenizer_matches_reference(source):
+    assert token_stream(Tokenizer.tokenize, source) == token_stream(Tokenizer.tokenize_by_character, source)
+
+def test_regex_tokenizer_matches_reference_on_random_input():
+    import random
+    rng = random.Random(7)
+    alphabet = list('abXY_09 .\n\t"#=!<>{}[](),+-*/;') + ['while', 'TRUE', '\u00e9', '\u0663', '\u00b2', '\u00a0']
+    for _ in range(3000):
+        source = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 25)))
+        assert token_stream(Tokenizer.tokenize, source) == token_stream(Tokenizer.tokenize_by_character, source), source
+
+# ---------------------------
+# Stage 12: Streaming Tests
+# ---------------------------
+
+STREAM_SOURCE = '''x = 1
+label = "a string
+that spans # several
+lines"
+while x < 5 { x = x + 1 }   # trailing comment
+caf\u00e9 = [x, 2.5, "done"]
+'''
+
+def test_stream_tokens_from_text_file_match_tokenize():
+    import io
+    expected = token_stream(Tokenizer.tokenize, STREAM_SOURCE)
+    for chunk_size in (1, 7, 64, 1 << 16):
+        streamed = [(t.type, t.value, type(t.value)) for t in Tokenizer.stream(io.StringIO(STREAM_SOURCE), chunk_size)]
+        assert streamed == expected
+
+def test_stream_tokens_from_mmap_match_tokenize(tmp_path):
+    import mmap
+    path = tmp_path / "program.txt"
+    path.write_text(STREAM_SOURCE, encoding="utf-8")
+    expected = token_stream(Tokenizer.tokenize, STREAM_SOURCE)
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as source:
+        streamed = [(t.type, t.value, type(t.value)) for t in Tokenizer.stream(source, chunk_size=5)]
+    assert streamed == expected
+
+def test_stream_reports_unterminated_string():
+    import io
+    with pytest.raises(SyntaxError, match="Unterminated string literal"):
+        list(Tokenizer.stream(io.StringIO('x = "open\nstill open\n'), chunk_size=4))
+
+def test_parser_pulls_tokens_lazily():
+    def tokens():
+        yield from Tokenizer('x = 1 y = x + 1').tokenize()[:-1]
+        raise AssertionError("parser read past the statement it needed")
+    statements = Parser(tokens()).iter_statements()
+    first = next(statements)
+    assert isinstance(first, Assignment) and first.target.name == "x"
+
+def test_run_streaming_evaluates_statements(tmp_path):
+    from main import run_streaming
+    path = tmp_path / "program.txt"
+    path.write_text(STREAM_SOURCE, encoding="utf-8")
+    interpreter = Interpreter()
+    run_streaming(str(path), interpreter)
+    assert interpreter.variables.get("x") == 5
+    assert interpreter.variables.get("caf\u00e9") == [5, 2.5, "done"]
+
+# ---------------------------
+# Stage 13: Token Store Tests
+# ---------------------------
+
+def test_token_store_matches_tokenize():
+    store = Tokenizer(STREAM_SOURCE).tokenize_compact()
+    assert token_stream(lambda tokenizer: list(store), STREAM_SOURCE) == token_stream(Tokenizer.tokenize, STREAM_SOURCE)
+    assert store.types.itemsize == 1 and len(store.starts) == len(store.ends) == len(store)
+
+def test_token_store_offsets_and_positions():
+    source = 'x = 1\n  label = "two words"'
+    store = Tokenizer(source).tokenize_compact()
+    assert [source[start:end] for start, end in zip(store.starts, store.ends)] == \
+        ['x', '=', '1', 'label', '=', '"two words"', '']
+    assert store.value(5) == "two words"
+    assert store.position(3) == (2, 3)
+    assert store.position(len(store) - 1) == (2, 22)
+
+def test_token_store_positions_match_a_line_count():
+    source = "\n".join(f"{'  ' * (n % 3)}x{n} = {n}\n" for n in range(200)) + "\n\nlast"
+    store = Tokenizer(source).tokenize_compact()
+    for index in range(len(store)):
+        offset = store.starts[index]
+        line_start = source.rfind("\n", 0, offset) + 1
+        assert store.position(index) == (source.count("\n", 0, offset) + 1, offset - line_start + 1)
+
+def test_token_store_reports_tokenizer_errors():
+    with pytest.raises(SyntaxError, match="Unterminated string literal"):
+        Tokenizer('x = "open').tokenize_compact()
+    with pytest.raises(SyntaxError, match="Unexpected character"):
+        Tokenizer('x = 1 $ 2').tokenize_compact()
+
+def test_parser_reads_token_store_like_token_list():
+    source = STREAM_SOURCE + 'fun f(a, b) { return a.size() + b[0] * -2 }'
+    from_store = Parser(Tokenizer(source).tokenize_compact()).parse_program()
+    from_list = Parser(Tokenizer(source).tokenize()).parse_program()
+    assert repr(from_store) == repr(from_list)
+
+@pytest.mark.parametrize("source", [
+    STREAM_SOURCE + 'label + x',
+    'fun f(a, b) { if a > b then return a - b else return b - a } xs = [f(1, 5), f(7, 2)] xs.push_back(-3.5) xs',
+    'm = {"k": [1, 2]} i = 0 while true { i = i + 1 if i == 3 then break } m["k"][1] * i',
+])
+def test_programs_run_the_same_from_token_store(interpreter, source):
+    expected = run_program(source, type(interpreter)())
+    ast = Parser(Tokenizer(source).tokenize_compact()).parse_program()
+    assert interpreter.evaluate(ast) == expected
+
+def test_parse_errors_report_source_position():
+    with pytest.raises(SyntaxError, match="at line 2, column 10"):
+        Parser(Tokenizer('x = 1\ny = (2 + }').tokenize_compact()).parse_program()
+    with pytest.raises(SyntaxError, match="'break' outside loop at line 1, column 1"):
+        Parser(Tokenizer('break').tokenize_compact()).parse_program()
+
+# ---------------------------
+# Stage 14: Memory-Lean AST Tests
+# ---------------------------
+
+ARENA_SOURCE = STREAM_SOURCE + '''
+fun f(a, b) { c = a.size() fun g() { return 1 } if c then return -b[0] else { c = !c } while c < 3 { c = c + 1 break } }
+[1, 2][0] = 5
+'''
+
+def test_nodes_have_no_instance_dict():
+    program = Parser(Tokenizer(ARENA_SOURCE).tokenize_compact()).parse_program()
+    nodes = [program]
+    for node in nodes:
+        nodes.extend(iter_child_nodes(node))
+    assert len({type(node) for node in nodes}) > 10
+    for node in nodes:
+        assert not hasattr(node, "__dict__"), node
+
+def test_identifiers_and_operators_are_interned():
+    source = 'total = total + 1 total = total + 2'
+    program = Parser(Tokenizer(source).tokenize_compact()).parse_program()
+    first, second = program.statements
+    assert first.target.name is second.target.name is second.value.left.name
+    assert first.value.operator is second.value.operator
+
+def test_arena_round_trips_the_ast():
+    from arena import Arena
+    program = optimize(Parser(Tokenizer(ARENA_SOURCE).tokenize_compact()).parse_program())
+    arena = Arena.from_ast(program)
+    assert repr(arena.to_ast(arena.root)) == repr(program)
+    assert arena.kinds.itemsize == 1 and arena.nbytes() < 20 * len(arena)
+
+def test_arena_engine_runs_from_arena(capsys):
+    from arena import Arena, ArenaInterpreter
+    source = 'fun twice(x) { return x * 2 } print twice(21) print twice'
+    arena = Arena.from_ast(Parser(Tokenizer(source).tokenize_compact()).parse_program())
+    ArenaInterpreter().run(arena)
+    tree_output = capsys.readouterr().out
+    run_program(source, Interpreter())
+    assert tree_output == capsys.readouterr().out
+    assert ">> 42" in tree_output and "Function(twice, ['x'], Block([Return(" in tree_output
+
+# ---------------------------
+# Stage 15: Parse Cache Tests
+# ---------------------------
+
+def test_cached_program_runs_like_a_fresh_parse(tmp_path, interpreter):
+    import cache
+    from main import run_arena
+    path = tmp_path / "program.txt"
+    path.write_text(ARENA_SOURCE + 'y = caf\u00e9[0] + 1', encoding="utf-8")
+    cold = cache.load_program(str(path))
+    assert os.path.exists(cache.cache_path(str(path)))
+    warm = cache.load_program(str(path))
+    assert warm is not cold and repr(warm.to_ast(warm.root)) == repr(cold.to_ast(cold.root))
+    run_arena(interpreter, warm)
+    assert interpreter.variables["y"] == 6
+
+def test_cache_entry_is_rebuilt_when_the_source_changes(tmp_path):
+    import cache
+    path = tmp_path / "program.txt"
+    path.write_text('x = 1', encoding="utf-8")
+    cache.load_program(str(path))
+    path.write_text('x = 2', encoding="utf-8")
+    arena = cache.load_program(str(path))
+    assert repr(arena.to_ast(arena.root)) == "Block([Assignment(Identifier(x), Number(2))])"
+
+def test_cache_rejects_other_format_versions(tmp_path, monkeypatch):
+    import cache
+    arena = cache.parse_source('x = 1')
+    data = cache.dumps(arena, cache.source_hash('x = 1'))
+    assert cache.loads(data, cache.source_hash('x = 1')) is not None
+    assert cache.loads(data, cache.source_hash('x = 2')) is None
+    assert cache.loads(data[:-3], cache.source_hash('x = 1')) is None
+    monkeypatch.setattr(cache, "FORMAT_VERSION", cache.FORMAT_VERSION + 1)
+    assert cache.loads(data, cache.source_hash('x = 1')) is None
+
+def test_no_cache_and_clear_cache(tmp_path):
+    import cache
+    path = tmp_path / "program.txt"
+    path.write_text('x = 1', encoding="utf-8")
+    cache.load_program(str(path), use_cache=False)
+    assert not os.path.exists(cache.cache_path(str(path)))
+    cache.load_program(str(path))
+    cache.load_program(str(path), optimize_ast=False)
+    assert cache.clear_cache(str(path)) == 2
+    assert not os.path.exists(cache.cache_path(str(path)))
+
+# ---------------------------
+# Stage 16: Precedence Parser Tests
+# ---------------------------
+
+def parse_expression_source(source):
+    return repr(Parser(Tokenizer(source).tokenize_compact()).parse())
+
+def test_binary_operator_precedence_and_associativity():
+    assert parse_expression_source('1 - 2 - 3') == 'Binary(Binary(Number(1), -, Number(2)), -, Number(3))'
+    assert parse_expression_source('a + b * c == d') == \
+        'Binary(Binary(Identifier(a), +, Binary(Identifier(b), *, Identifier(c))), ==, Identifier(d))'
+    assert parse_expression_source('-a[0] * 2') == \
+        'Binary(UnaryOp(-, ListAccess(Identifier(a), Number(0))), *, Number(2))'
+    assert parse_expression_source('x = y = 1 + 2') == \
+        'Assignment(Identifier(x), Assignment(Identifier(y), Binary(Number(1), +, Number(2))))'
+
+def test_and_or_parse_outside_parentheses():
+    assert parse_expression_source('a or b and c == d') == \
+        'Binary(Identifier(a), or, Binary(Identifier(b), and, Binary(Identifier(c), ==, Identifier(d))))'
+
+def test_and_or_evaluate_outside_parentheses(interpreter):
+    run_program('{ x = 1 < 2 and 3 > 4 y = false or 2 == 2 z = 1 == 1 and 2 }', interpreter)
+    assert interpreter.variables["x"] is False
+    assert interpreter.variables["y"] is True
+    assert interpreter.variables["z"] == 2
+
+# ---------------------------
+# Stage 17: Incremental Session Tests
+# ---------------------------
+
+SESSION_SOURCE = '''x = 1
+y = x + 1
+fun scale(v) { return v * factor }
+factor = 10
+z = scale(y)
+label = "total"
+'''
+
+def run_session(session, source):
+    session.update(source)
+    return [statement.text for statement in session.last_run]
+
+def test_session_reruns_only_dependent_statements(interpreter):
+    from incremental import Session
+    session = Session(interpreter)
+    assert len(run_session(session, SESSION_SOURCE)) == 6
+    assert run_session(session, SESSION_SOURCE.replace("x = 1", "x = 2")) == ["x = 2", "y = x + 1", "z = scale(y)"]
+    assert interpreter.variables["z"] == 30
+    assert run_session(session, SESSION_SOURCE.replace("x = 1", "x = 2").replace("factor = 10", "factor = 3")) == \
+        ["factor = 3", "z = scale(y)"]
+    assert interpreter.variables["z"] == 9
+
+def test_session_skips_unchanged_text_and_comments(interpreter):
+    from incremental import Session
+    session = Session(interpreter)
+    run_session(session, SESSION_SOURCE)
+    assert run_session(session, SESSION_SOURCE.replace("factor = 10", "factor = 10  # ten\n")) == []
+    assert run_session(session, "# header\n" + SESSION_SOURCE) == []
+
+def test_session_sees_values_in_program_order(interpreter):
+    from incremental import Session
+    session = Session(interpreter)
+    source = 'a = 1 b = a + 1 a = 5'
+    run_session(session, source)
+    assert run_session(session, source.replace("b = a + 1", "b = a + 2")) == ["b = a + 2"]
+    assert interpreter.variables["b"] == 3 and interpreter.variables["a"] == 5
+
+def test_session_removed_statements_unbind_names(interpreter):
+    from incremental import Session
+    session = Session(interpreter)
+    run_session(session, 'p = 1 q = 2')
+    run_session(session, 'q = 2')
+    assert "p" not in interpreter.variables
+    with pytest.raises(Exception, match="Undefined variable: p"):
+        session.update('q = p')
+
+def test_session_rebuilds_mutated_lists(interpreter):
+    from incremental import Session
+    session = Session(interpreter)
+    source = 'items = [1]\nalias = items\nalias.push_back(2)\ncount = 0\n'
+    run_session(session, source)
+    run_session(session, source + 'items.push_back(3)\n')
+    assert interpreter.variables["items"] == [1, 2, 3]
+    assert interpreter.variables["alias"] is interpreter.variables["items"]
+    assert "count = 0" not in [statement.text for statement in session.last_run]
+
+def test_session_extends_statement_before_the_edit(interpreter):
+    from incremental import Session
+    session = Session(interpreter)
+    run_session(session, 'n = 1\nm = 2')
+    assert run_session(session, 'n = 1 + 4\nm = 2') == ["n = 1 + 4"]
+    assert interpreter.variables["n"] == 5
+
+def test_session_reports_syntax_errors_and_keeps_state(interpreter):
+    from incremental import Session
+    session = Session(interpreter)
+    run_session(session, 'x = 1\ny = 2')
+    with pytest.raises(SyntaxError, match="at line 2, column 9"):
+        session.update('x = 1\ny = (2 +')
+    assert run_session(session, 'x = 1\ny = 3') == ["y = 3"]
+
+def test_session_matches_full_runs_under_random_edits():
+    import io, random, contextlib
+    from incremental import Session
+    pool = ['x = 1', 'x = x + 1', 'y = x * 2', 'z = y + x', 'l = [1, 2]', 'l.push_back(x)', 'm = l', 'l[0] = y',
+            'fun f(a) { return a + x }', 'fun f(a) { return a * y }', 'w = f(3)', 'n = [l, 5]', 'n[0].push_back(9)',
+            'i = 0 while i < 3 { i = i + 1 x = x + i }', 'if x > 3 then t = 1 else t = 2', 't = t + 1', 'v = m[1]']
+    rng = random.Random(5)
+    for _ in range(60):
+        session = Session(Interpreter())
+        lines = [rng.choice(pool) for _ in range(rng.randint(1, 6))]
+        for _ in range(6):
+            position = rng.randint(0, len(lines))
+            if rng.random() < 0.5 and lines:
+                del lines[min(position, len(lines) - 1)]
+            lines.insert(position, rng.choice(pool))
+            source = "\n".join(lines)
+            fresh = Interpreter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                try:
+                    fresh.evaluate(Parser(Tokenizer(source).tokenize()).parse_program())
+                    expected_error = None
+                except Exception as e:
+                    expected_error = str(e)
+                try:
+                    session.update(source)
+                    error = None
+                except Exception as e:
+                    error = str(e)
+            assert error == expected_error, source
+            if error is None:
+                assert repr(dict(session.variables)) == repr(fresh.variables), source
+
+# ---------------------------
+# Stage 18: Background Execution Tests
+# ---------------------------
+
+def test_cancel_stops_a_running_loop(interpreter):
+    import threading
+    from runtime import ExecutionCancelled
+    started = threading.Timer(0.05, interpreter.cancel)
+    started.start()
+    with pytest.raises(ExecutionCancelled):
+        run_program('{ x = 0 while true { x = x + 1 } }', interpreter)
+    assert interpreter.variables["x"] > 0
+
+def test_cancel_stops_tail_recursion(interpreter):
+    from runtime import ExecutionCancelled
+    interpreter.cancel()
+    with pytest.raises(ExecutionCancelled):
+        run_program('fun spin(n) { return spin(n + 1) } spin(0)', interpreter)
+
+def test_print_writes_to_interpreter_stdout(interpreter, capsys):
+    import io
+    interpreter.stdout = io.StringIO()
+    run_program('print 1 + 1 print "done"', interpreter)
+    assert interpreter.stdout.getvalue() == ">> 2\n>> done\n"
+    assert capsys.readouterr().out == ""
+
+def test_background_runner_streams_output_and_stops():
+    import time
+    from background import BackgroundRunner
+    from incremental import Session
+    runner = BackgroundRunner(Session(Interpreter()))
+    assert runner.start('i = 0 while true { i = i + 1 if i < 4 then print i }')
+    assert not runner.start('x = 1')  # Only one run at a time.
+    deadline = time.monotonic() + 5
+    output = ""
+    while output.count("\n") < 3 and time.monotonic() < deadline:
+        output += runner.drain()[0]
+    runner.stop()
+    runner.join(5)
+    text, outcome = runner.drain()
+    assert output + text == ">> 1\n>> 2\n>> 3\n"
+    assert outcome == ("error", "Execution cancelled")
+    assert runner.start('print "again"')
+    runner.join(5)
+    assert runner.drain() == (">> again\n", ("result", "again"))
+
+# ---------------------------
+# Stage 19: Execution Budget Tests
+# ---------------------------
+
+def test_step_budget_stops_infinite_loop(engine_name):
+    from runtime import Budget, BudgetExceeded
+    interpreter = create_interpreter(engine_name, Budget(max_steps=5_000, check_interval=1_000))
+    with pytest.raises(BudgetExceeded) as info:
+        run_program('i = 0 while true { i = i + 1 }', interpreter)
+    assert info.value.limit == "steps"
+    assert 5_000 < info.value.usage["steps"] < 5_100
+    assert "steps" in str(info.value)
+
+def test_step_budget_stops_runaway_recursion(engine_name):
+    from runtime import Budget, BudgetExceeded
+    interpreter = create_interpreter(engine_name, Budget(max_steps=200, check_interval=50))
+    with pytest.raises(BudgetExceeded):
+        run_program('fun spin(n) { return spin(n + 1) } spin(0)', interpreter)
+
+def test_deadline_stops_long_loop(engine_name):
+    import time
+    from runtime import Budget, BudgetExceeded
+    interpreter = create_interpreter(engine_name, Budget(max_seconds=0.05))
+    started = time.monotonic()
+    with pytest.raises(BudgetExceeded) as info:
+        run_program('i = 0 while true { i = i + 1 }', interpreter)
+    assert info.value.limit == "seconds"
+    assert info.value.usage["seconds"] > 0.05
+    assert time.monotonic() - started < 5
+
+@pytest.mark.parametrize("source", [
+    'x = [] while true { x.push_back(1) }',
+    's = "ab" while true { s = s + s }',
+    'x = [1, 2, 3] * 1000000',
+])
+def test_allocation_budget(engine_name, source):
+    from runtime import Budget, BudgetExceeded
+    interpreter = create_interpreter(engine_name, Budget(max_allocation=10_000, check_interval=100))
+    with pytest.raises(BudgetExceeded) as info:
+        run_program(source, interpreter)
+    assert info.value.limit == "allocation"
+    assert info.value.usage["allocation"] > 10_000
+
+def test_programs_within_budget_run_normally(engine_name):
+    from runtime import Budget
+    interpreter = create_interpreter(engine_name, Budget(max_steps=100_000, max_seconds=60, max_allocation=1_000))
+    source = 'fun f(n) { if n < 2 then return n return f(n - 1) + f(n - 2) } x = [f(10), "a" + "b"] x[0]'
+    assert run_program(source, interpreter) == 55
+    usage = interpreter.usage()
+    assert usage["steps"] > 0 and usage["allocation"] == 4  # Two list elements and two string characters.
+
+def test_usage_is_counted_without_a_budget(interpreter):
+    run_program('i = 0 x = [] while i < 100 { x.push_back(i) i = i + 1 }', interpreter)
+    assert interpreter.usage()["allocation"] == 100
+    assert interpreter.usage()["steps"] >= 100
+    interpreter.reset_usage()
+    assert interpreter.usage()["steps"] == interpreter.usage()["allocation"] == 0
+
+def test_session_budget_applies_per_update():
+    from incremental import Session
+    from runtime import Budget, BudgetExceeded
+    session = Session(Interpreter(Budget(max_steps=2_000, check_interval=100)))
+    source = 'i = 0 while i < 100 { i = i + 1 }'
+    for _ in range(3):
+        assert session.update(source, rerun=True) is None
+    with pytest.raises(BudgetExceeded):
+        session.update('i = 0 while true { i = i + 1 }')
+
+# ---------------------------
+# Stage 20: Batch Runner Tests
+# ---------------------------
+
+def write_scripts(directory):
+    (directory / "a.txt").write_text('print "a" x = 1 + 2 print x')
+    (directory / "b.txt").write_text('print "b" y = undefined_name')
+    (directory / "c.txt").write_text('i = 0 while i < 3 { print i i = i + 1 }')
+    return sorted(str(path) for path in directory.glob("*.txt"))
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_batch_runs_files_in_order_and_captures_output(tmp_path, workers):
+    from batch import run_batch
+    files = write_scripts(tmp_path)
+    results = list(run_batch(files, workers=workers, use_cache=False))
+    assert [result["file"] for result in results] == files
+    assert [result["ok"] for result in results] == [True, False, True]
+    assert results[0]["output"] == ">> a\n>> 3\n"
+    assert results[1]["output"] == ">> b\n"
+    assert "Undefined variable: undefined_name" in results[1]["error"]
+    assert results[2]["output"] == ">> 0\n>> 1\n>> 2\n"
+    assert all(result["seconds"] >= 0 for result in results)
+
+def test_batch_writes_json_lines_with_a_summary(tmp_path):
+    import io
+    import json
+    from batch import expand_paths, run_batch, write_results
+    write_scripts(tmp_path)
+    files = expand_paths([str(tmp_path / "*.txt"), str(tmp_path / "a.txt"), str(tmp_path / "missing.txt")])
+    assert len(files) == 4  # Duplicates are dropped; a missing file is kept and reported.
+    out = io.StringIO()
+    summary = write_results(run_batch(files, workers=2, use_cache=False), out)
+    lines = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert len(lines) == 5 and lines[-1] == {"summary": summary}
+    assert summary["files"] == 4 and summary["failed"] == 2
+    assert "No such file" in lines[3]["error"]
+
+def test_batch_applies_budget_to_each_file(tmp_path):
+    from batch import run_batch
+    from runtime import Budget
+    (tmp_path / "spin.txt").write_text('while true { }')
+    (tmp_path / "quick.txt").write_text('print 1')
+    files = [str(tmp_path / "spin.txt"), str(tmp_path / "quick.txt")]
+    results = list(run_batch(files, workers=1, use_cache=False, budget=Budget(max_steps=1_000)))
+    assert results[0]["error"].startswith("BudgetExceeded")
+    assert results[1]["ok"]
+
+# ---------------------------
+# Stage 21: Program API Tests
+# ---------------------------
+
+RULE_SOURCE = '''
+fun score(values) {
+    total = 0
+    i = 0
+    while i < n {
+        total = total + values[i] * weight
+        i = i + 1
+    }
+    return total
+}
+result = score(values)
+if result > limit then "reject" else "accept"
+'''
+
+def test_program_runs_many_times_with_different_inputs(engine_name):
+    from program import Program
+    program = Program(RULE_SOURCE, engine_name)
+    assert program.run({"values": [1, 2, 3], "n": 3, "weight": 2, "limit": 20}) == "accept"
+    assert program.run({"values": [10, 20], "n": 2, "weight": 1, "limit": 20}) == "reject"
+    value, variables = program.run_with_globals({"values": [5], "n": 1, "weight": 3, "limit": 20})
+    assert value == "accept" and variables["result"] == 15
+
+def test_program_runs_are_isolated(engine_name):
+    import io
+    from program import Program
+    program = Program('print seen x = [1] x.push_back(seen) x', engine_name)
+    inputs = {"seen": 1}
+    first, second = io.StringIO(), io.StringIO()
+    assert program.run(inputs, stdout=first) == [1, 1]
+    assert program.run({"seen": 2}, stdout=second) == [1, 2]  # The constant list is copied per run.
+    assert inputs == {"seen": 1}
+    assert first.getvalue() == ">> 1\n" and second.getvalue() == ">> 2\n"
+    with pytest.raises(Exception, match="Undefined variable: seen"):
+        program.run()
+
+def test_program_is_immutable():
+    from program import Program
+    program = Program('1 + 2')
+    with pytest.raises(AttributeError):
+        program.engine = "vm"
+    with pytest.raises(ValueError):
+        Program('1', engine="nope")
+    with pytest.raises(SyntaxError):
+        Program('x = (1')
+
+def test_program_runs_concurrently_from_threads(engine_name):
+    from concurrent.futures import ThreadPoolExecutor
+    from program import Program
+    program = Program(RULE_SOURCE, engine_name)
+    def check(k):
+        return program.run({"values": list(range(k)), "n": k, "weight": 1, "limit": 10 ** 9}), \
+               program.run_with_globals({"values": list(range(k)), "n": k, "weight": 1, "limit": 0})[1]["result"]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(check, range(200)))
+    assert results == [("accept", k * (k - 1) // 2) for k in range(200)]
+
+def test_program_honours_budgets(engine_name):
+    from program import Program
+    from runtime import Budget, BudgetExceeded
+    program = Program('s = "ab" while true { s = s + s }', engine_name)
+    for _ in range(2):
+        with pytest.raises(BudgetExceeded):
+            program.run(budget=Budget(max_allocation=1_000, check_interval=100))
+
+# ---------------------------
+# Stage 22: Numeric Vector Tests
+# ---------------------------
+
+@pytest.fixture(params=["numpy", "array"])
+def vector_backend(request, monkeypatch):
+    import vectors
+    if request.param == "numpy":
+        if vectors.numpy is None:
+            pytest.skip("NumPy is not installed")
+    else:
+        monkeypatch.setattr(vectors, "numpy", None)
+    return request.param
+
+@pytest.mark.parametrize("source, expected", [
+    ('[1, 2, 3].vector() + [10, 20, 30].vector()', [11, 22, 33]),
+    ('[1, 2, 3].vector() * 2', [2, 4, 6]),
+    ('10 - [1, 2, 3].vector()', [9, 8, 7]),
+    ('[1, 2, 3].vector() / 3', [0.33, 0.67, 1.0]),
+    ('1 / [4, 8].vector()', [0.25, 0.12]),
+    ('[1, 2.5].vector() + 1', [2.0, 3.5]),
+    ('-[1, 2].vector()', [-1, -2]),
+    ('[1, 5, 3].vector().gt(2)', [0, 1, 1]),
+    ('[1, 5, 3].vector().eq([1, 4, 3].vector())', [1, 0, 1]),
+    ('[1, 2, 3].vector().ge(2)', [0, 1, 1]),
+    ('[1.5, 2].vector().ne(2)', [1, 0]),
+    ('[1, 2, 3].vector().lt([2, 2, 2].vector())', [1, 0, 0]),
+    ('[1, 2, 3].vector().le(2.5)', [1, 1, 0]),
+    ('v = [1, 2].vector() v.push_back(3) v[0] = 7 v', [7, 2, 3]),
+    ('v = [1, 2].vector() v[1] = 0.5 v', [1.0, 0.5]),
+    ('v = [1, 2, 3].vector() v.remove(0) v', [2, 3]),
+    ('[].vector() * 2', []),
+    ('[9223372036854775807].vector() + 1', [9.223372036854776e18]),
+    ('[99999999999999999999].vector()', [1e20]),
+    ('-[-9223372036854775808].vector()', [9.223372036854776e18]),
+    ('[3037000500, 2].vector() * [3037000500, 2].vector()', [9.22337203700025e18, 4.0]),
+    ('[1, 2].vector() * 4611686018427387904', [4.611686018427388e18, 9.223372036854776e18]),
+    ('[1, 2].vector() - 9223372036854775809', [-9223372036854775808, -9223372036854775807]),
+    ('[0, 1].vector() - 9223372036854775809', [-9.223372036854776e18, -9.223372036854776e18]),
+    ('v = [1].vector() v.push_back(2.5) v', [1.0, 2.5]),
+    ('v = [1].vector() v.push_back(9223372036854775808) v', [1.0, 9.223372036854776e18]),
+    ('[1, 2].vector().lt(99999999999999999999)', [1, 1]),
+    ('[1.5].vector() + 99999999999999999999', [1e20]),
+])
+def test_vector_operations(interpreter, vector_backend, source, expected):
+    from vectors import Vector
+    result = run_program(source, interpreter)
+    assert isinstance(result, Vector)
+    assert result.tolist() == expected
+    assert all(type(x) is type(y) for x, y in zip(result.tolist(), expected))
+
+@pytest.mark.parametrize("source, expected", [
+    ('v = [1, 2, 3].vector() v[1]', 2),
+    ('([1, 2, 3].vector() * [4, 5, 6].vector()).sum()', 32),
+    ('[1.5, 2].vector().list()', [1.5, 2.0]),
+    ('[1, 2].sum()', 3),
+    ('"v = " + [1, 2].vector()', "v = [1, 2]"),
+    ('[1, 2].vector() == [1, 2].vector()', True),
+    ('[1, 2].vector() == [1.0, 2.0].vector()', True),
+    ('[1, 2].vector() != [3, 4].vector()', True),
+    ('if [1, 2].vector() == [3, 4].vector() then 1 else 2', 2),
+    ('[1, 2].vector() == [1, 2]', False),
+    ('[9223372036854775807, 9223372036854775807].vector().sum()', 18446744073709551614),
+    ('[[1, 2].vector(), [3, 4].vector()].index([3, 4].vector())', 1),
+])
+def test_vector_members_and_access(interpreter, vector_backend, source, expected):
+    assert run_program(source, interpreter) == expected
+
+@pytest.mark.parametrize("source, message", [
+    ('[1, "a"].vector()', "Vectors can only hold numbers"),
+    ('v = [1].vector() v.push_back("a")', "Vectors can only hold numbers"),
+    ('[1, 2].vector() + [1].vector()', "Vector length mismatch: 2 and 1"),
+    ('[1, 2].vector() / 0', "division by zero"),
+    ('[1, 2].vector() / [1, 0].vector()', "division by zero"),
+    ('[1].vector().size()', "Unknown member function 'size' on vector"),
+    ('[1].vector()[3]', "Error accessing list at index 3"),
+    ('[1].vector().lt("a")', "Cannot compare a vector with 'a'"),
+    ('[1' + '0' * 400 + '].vector()', "Number too large for a vector"),
+    ('v = [1].vector() v.push_back(1' + '0' * 400 + ')', "Number too large for a vector"),
+    ('[1].vector() * 1' + '0' * 400, "Number too large for a vector"),
+    ('[1, 2].vector().eq([1].vector())', "Vector length mismatch: 2 and 1"),
+    ('[1, 2].vector() < [2, 1].vector()', r"use \.lt\(\), \.le\(\), \.gt\(\) or \.ge\(\)"),
+    ('[1, 2].vector() >= 2', r"Vectors cannot be compared with <, <=, > or >="),
+    ('2 < [1, 2].vector()', r"Vectors cannot be compared with <, <=, > or >="),
+    ('sort([[2].vector(), [1].vector()])', r"Vectors cannot be compared with <, <=, > or >="),
+])
+def test_vector_errors(interpreter, vector_backend, source, message):
+    with pytest.raises(Exception, match=message):
+        run_program(source, interpreter)
+
+def test_vector_allocation_is_counted(engine_name, vector_backend):
+    from runtime import Budget, BudgetExceeded
+    interpreter = create_interpreter(engine_name, Budget(max_allocation=1_000, check_interval=100))
+    with pytest.raises(BudgetExceeded):
+        run_program('v = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10].vector() while true { v = v - 1 }', interpreter)
+
+# ---------------------------
+# Stage 23: Native Builtin Tests
+# ---------------------------
+
+@pytest.mark.parametrize("source, expected", [
+    ('len([1, 2, 3])', 3),
+    ('len("hello")', 5),
+    ('range(4)', [0, 1, 2, 3]),
+    ('range(2, 10, 3)', [2, 5, 8]),
+    ('sum(range(101))', 5050),
+    ('min([3, 1, 2])', 1),
+    ('max(3, 7, 5)', 7),
+    ('xs = [3, 1, 2] ys = sort(xs) xs[0] * 10 + ys[0]', 31),
+    ('xs = [3, 1, 2] xs.sort() xs', [1, 2, 3]),
+    ('[1, 2, 3, 4, 5].slice(1, 3)', [2, 3]),
+    ('[1, 2, 3, 4, 5].slice(2)', [3, 4, 5]),
+    ('[1, 2, 3, 4, 5].slice(-2)', [4, 5]),
+    ('[1, 2, 3, 4, 5].slice(4 / 2, 9)', [3, 4, 5]),
+    ('min([3, 1, 2].vector())', 1),
+    ('xs = [1, 2] xs.extend([3, 4]) xs', [1, 2, 3, 4]),
+    ('xs = [1, 3] xs.insert(1, 2) xs', [1, 2, 3]),
+    ('xs = [1, 3] xs.insert(2 / 2, 2) xs', [1, 2, 3]),
+    ('range(4 / 2)', [0, 1]),
+    ('["a", "b", "c"].index("c")', 2),
+    ('[1, 2, 3].sum()', 6),
+    ('fun total(xs) { return sum(xs) } total([1, 2])', 3),
+    ('fun count(xs) { n = len(xs) return n } count([1, 2])', 2),
+    ('len = 5 len', 5),
+    ('sum(range(5).vector() * 2)', 20),
+    ('range(5).vector().slice(1, 3).list()', [1, 2]),
+])
+def test_builtins_and_methods(interpreter, source, expected):
+    assert run_program(source, interpreter) == expected
+
+@pytest.mark.parametrize("source, message", [
+    ('len()', "len requires exactly one argument"),
+    ('range(1, 2, 3, 4)', "range requires 1 to 3 arguments"),
+    ('min()', "min requires at least 1 argument"),
+    ('len(5)', "len requires a list, string, map or vector, not int"),
+    ('min(5)', "min of a single value requires a list or vector, not int"),
+    ('max([])', "max of an empty list"),
+    ('min(1, "a")', "min requires values that can be compared with each other"),
+    ('max([1, [2]])', "max requires values that can be compared with each other"),
+    ('[1, 2].slice("a")', "slice requires numbers as bounds, not string"),
+    ('[1, 2].vector().slice(0, [1])', "slice requires numbers as bounds, not list"),
+    ('range("a")', "range requires numbers, not string"),
+    ('range(1, 5, 0)', "range requires a step other than 0"),
+    ('range(1' + '0' * 30 + ')', "range is too long"),
+    ('sum(5)', "sum requires a list or vector, not int"),
+    ('sum([1, "a"])', "sum requires a list of numbers"),
+    ('join(5, ",")', "join requires a list or vector, not int"),
+    ('sort({})', "sort requires a list or vector, not map"),
+    ('sort([1, "a"])', "sort requires values that can be compared with each other"),
+    ('[2, "a"].sort()', "sort requires values that can be compared with each other"),
+    ('[1].extend(5)', "extend requires a list or vector, not int"),
+    ('[1].insert("a", 2)', "insert requires numbers, not string"),
+    ('[1].push_back()', "push_back requires exactly one argument"),
+    ('[1].sort(1)', "sort requires no arguments"),
+    ('[1].index(5)', "Value not found in list: 5"),
+    ('[1].remove(3)', "Error removing element at index 3"),
+    ('[1].size()', "Unknown member function 'size' on list"),
+    ('x = 5 x.push_back(1)', "Member call on unsupported object type: 5"),
+    ('nope(1)', "Undefined variable: nope"),
+    ('x = 5 x(1)', "Attempted to call a non-function"),
+])
+def test_native_errors(interpreter, source, message):
+    with pytest.raises(Exception, match=message):
+        run_program(source, interpreter)
+
+def test_host_code_can_register_natives(interpreter, monkeypatch):
+    import natives
+    monkeypatch.setattr(natives, "BUILTINS", dict(natives.BUILTINS))
+    monkeypatch.setattr(natives, "METHODS", {owner: dict(methods) for owner, methods in natives.METHODS.items()})
+    @natives.builtin("clamp", arity=3)
+    def clamp(value, low, high):
+        return max(low, min(value, high))
+    @natives.method(str, "upper", 0)
+    def upper(text):
+        return text.upper()
+    interpreter.builtins, interpreter.methods = natives.BUILTINS, natives.METHODS
+    assert run_program('[clamp(15, 0, 10), "shout".upper()]', interpreter) == [10, "SHOUT"]
+
+def test_native_allocation_is_charged_before_the_call(engine_name):
+    from runtime import Budget, BudgetExceeded
+    interpreter = create_interpreter(engine_name, Budget(max_allocation=1_000))
+    with pytest.raises(BudgetExceeded):
+        run_program('range(1000000000)', interpreter)
+    assert interpreter.usage()["allocation"] > 1_000
+
+# ---------------------------
+# Stage 24: Map Tests
+# ---------------------------
+
+def test_tokenize_colon():
+    tokens = Tokenizer('{"a": 1}').tokenize()
+    assert [token.type for token in tokens] == [TokenType.LEFT_BRACE, TokenType.STRING, TokenType.COLON,
+                                                TokenType.NUMBER, TokenType.RIGHT_BRACE, TokenType.EOF]
+    compact = Tokenizer('{"a": 1}').tokenize_compact()
+    assert [(token.type, token.value) for token in compact] == [(token.type, token.value) for token in tokens]
+    assert Tokenizer('a:b').tokenize_by_character()[1].type == TokenType.COLON
+
+def test_parse_map_literal():
+    ast = Parser(Tokenizer('m = {"a": 1, 2: x + 1,}').tokenize()).parse_program()
+    literal = ast.statements[0].value
+    assert isinstance(literal, MapLiteral)
+    assert [key.value for key in literal.keys] == ["a", 2]
+    assert isinstance(literal.values[1], Binary)
+    # A '{' that starts a statement is still a block; a map literal there needs parentheses.
+    assert isinstance(Parser(Tokenizer('{ x = 1 }').tokenize()).parse_program().statements[0], Block)
+    assert isinstance(Parser(Tokenizer('({})').tokenize()).parse_program().statements[0], MapLiteral)
+
+@pytest.mark.parametrize("source, expected", [
+    ('m = {} m', {}),
+    ('({"a": 1, "b": 2 + 3})', {"a": 1, "b": 5}),
+    ('m = {"a": 1} m["a"]', 1),
+    ('m = {} m["x"] = 5 m["x"] = m["x"] + 1 m', {"x": 6}),
+    ('m = {1: "one", 2.5: "x"} m[1] + m[2.5]', "onex"),
+    ('m = {"a": [1, 2]} m["a"].push_back(3) m["a"]', [1, 2, 3]),
+    ('({"a": 1, "b": 2}).keys()', ["a", "b"]),
+    ('m = {"a": 1, "b": 2} m.values()', [1, 2]),
+    ('m = {"a": 1} print m.has("a") m.has("b")', False),
+    ('m = {"a": 1, "b": 2} m.delete("a") m', {"b": 2}),
+    ('x = {"a": 1}.get("z", 0)', 0),
+    ('len({"a": 1, "b": 2})', 2),
+    ('fun lookup(m, k) { return m[k] } lookup({"k": 9}, "k")', 9),
+])
+def test_map_operations(interpreter, source, expected):
+    assert run_program(source, interpreter) == expected
+
+@pytest.mark.parametrize("source, message", [
+    ('m = {"a": 1} m["b"]', "Key not found in map: 'b'"),
+    ('m = {} m[[1]] = 2', "Invalid map key \\[1\\]"),
+    ('m = {[1]: 2}', "Invalid map key \\[1\\]"),
+    ('m = {} m.delete("a")', "Key not found in map: 'a'"),
+    ('m = {"a" 1}', "Expected token type TokenType.COLON"),
+])
+def test_map_errors(interpreter, source, message):
+    with pytest.raises(Exception, match=message):
+        run_program(source, interpreter)
+
+def test_dedupe_with_a_map(interpreter):
+    source = '''
+    seen = {}
+    unique = []
+    i = 0
+    while i < len(items) {
+        if not seen.has(items[i]) then { seen[items[i]] = true unique.push_back(items[i]) }
+        i = i + 1
+    }
+    unique
+    '''
+    interpreter.variables["items"] = [3, 1, 3, 2, 1, 4]
+    assert run_program(source, interpreter) == [3, 1, 2, 4]
+
+def test_map_survives_the_parse_cache(tmp_path):
+    from arena import ArenaInterpreter
+    from cache import load_program
+    script = tmp_path / "maps.txt"
+    script.write_text('m = {"k": [1, 2], "n": 3} m["n"]')
+    for _ in range(2):
+        interpreter = ArenaInterpreter()
+        assert interpreter.run(load_program(str(script))) == 3
+        assert interpreter.variables["m"] == {"k": [1, 2], "n": 3}
+
+# ---------------------------
+# Stage 25: Rope String Tests
+# ---------------------------
+
+BUILD_STRING = 's = "" i = 0 while i < 1000 { s = s + "ab" i = i + 1 } '
+
+@pytest.mark.parametrize("source, expected", [
+    (BUILD_STRING + 'len(s)', 2000),
+    (BUILD_STRING + 's == "ab" * 1000', True),
+    (BUILD_STRING + 's[1999] + s[0]', "ba"),
+    (BUILD_STRING + 'm = {} m[s] = 1 m["ab" * 1000]', 1),
+    (BUILD_STRING + 't = "<" + s len(t)', 2001),
+    ('join([1, 2, 3], ", ")', "1, 2, 3"),
+    ('join(["a", "b"])', "ab"),
+])
+def test_rope_strings(interpreter, source, expected):
+    assert run_program(source, interpreter) == expected
+
+def test_join_charges_the_joined_length(interpreter):
+    from runtime import Budget, BudgetExceeded
+    assert run_program('join(["ab", "c"], "-")', interpreter) == "ab-c"
+    assert interpreter.usage()["allocation"] == 2 + 4
+    limited = type(interpreter)(Budget(max_allocation=100))
+    with pytest.raises(BudgetExceeded):
+        run_program('join(range(50), ",")', limited)
+
+def test_rope_prints_as_text(interpreter, capsys):
+    run_program('s = "x" * 300 s = s + "y" print s', interpreter)
+    assert capsys.readouterr().out == ">> " + "x" * 300 + "y\n"
+
+def test_rope_appends_do_not_leak_between_strings():
+    from ropes import Rope, concat
+    base = concat("a" * 200, "b" * 100)
+    assert type(base) is Rope
+    first = base + "1"
+    second = base + "2"
+    third = first + "3"
+    assert str(base) == "a" * 200 + "b" * 100
+    assert str(first)[-1] == "1" and str(second)[-1] == "2" and str(third)[-2:] == "13"
+    assert concat("a", "b") == "ab" and type(concat("a", "b")) is str
+
+def test_optimizer_folds_long_strings_to_literals():
+    ast = optimize(Parser(Tokenizer('"' + "a" * 300 + '" + "b"').tokenize_compact()).parse_program())
+    literal = ast.statements[0]
+    assert isinstance(literal, StringLiteral)
+    assert type(literal.value) is str and literal.value == "a" * 300 + "b"
+
+def test_program_returns_plain_strings(engine_name):
+    from program import Program
+    result = Program(BUILD_STRING + 's', engine_name).run()
+    assert type(result) is str and result == "ab" * 1000
+
+def test_rope_appends_charge_only_the_new_piece(engine_name):
+    from runtime import Budget
+    # Copying the whole string on every append would allocate about a million characters.
+    interpreter = create_interpreter(engine_name, Budget(max_allocation=50_000))
+    assert run_program(BUILD_STRING + 'len(s)', interpreter) == 2000
+    assert interpreter.usage()["allocation"] < 50_000
+
+# ---------------------------
+# Stage 26: Memo Function Tests
+# ---------------------------
+
+MEMO_FIB = 'memo fun fib(n) { if n < 2 then return n return fib(n - 1) + fib(n - 2) } '
+
+@pytest.mark.parametrize("source, expected", [
+    (MEMO_FIB + 'fib(80)', 23416728348467685),
+    ('memo fun paths(r, c) { if r == 0 or c == 0 then return 1 return paths(r - 1, c) + paths(r, c - 1) } '
+     'paths(16, 16)', 601080390),
+    ('memo fun edit(a, b, i, j) { '
+     'if i == len(a) then return len(b) - j '
+     'if j == len(b) then return len(a) - i '
+     'if a[i] == b[j] then return edit(a, b, i + 1, j + 1) '
+     'return 1 + min(edit(a, b, i + 1, j), edit(a, b, i, j + 1), edit(a, b, i + 1, j + 1)) } '
+     'edit("kitten sitting on the mat", "sitting kitten at the mall", 0, 0)', 10),
+    ('memo fun total(xs) { return sum(xs) } xs = [1, 2] a = total(xs) xs.push_back(3) a * 10 + total(xs)', 36),
+    ('memo fun show(x) { return "" + x } [show(1), show(true), show(1.5), show([1]), show({"a": [1]})]',
+     ["1", "True", "1.5", "[1]", "{'a': [1]}"]),
+])
+def test_memo_functions(interpreter, source, expected):
+    assert run_program(source, interpreter) == expected
+
+def test_memo_statistics(interpreter):
+    run_program(MEMO_FIB + 'fib(30)', interpreter)
+    assert interpreter.memo_stats() == {"fib": {"hits": 28, "misses": 31, "size": 31}}
+
+def test_memo_cache_evicts_least_recently_used(interpreter):
+    interpreter.memo_size = 2
+    run_program('memo fun double(x) { return x * 2 } double(1) double(2) double(1) double(3) double(1) double(2)',
+                interpreter)
+    assert interpreter.memo_stats()["double"] == {"hits": 2, "misses": 4, "size": 2}
+
+def test_memo_keys_snapshot_containers():
+    from runtime import memo_key
+    xs = [1, [2, 3]]
+    key = memo_key([xs, {"a": xs}])
+    xs[1].append(4)
+    assert key != memo_key([xs, {"a": xs}])
+    assert memo_key([1]) != memo_key([True]) and memo_key([1]) != memo_key([1.0])
+    assert memo_key([[1, 2]]) == memo_key([[1, 2]])
+    hash(key)
+
+@pytest.mark.parametrize("source, expected", [
+    ('memo fun make(n) { return [n] } a = make(1) a.push_back(2) b = make(1) b', [1]),
+    ('memo fun make(n) { return [n] } a = make(1) b = make(1) b.push_back(2) make(1)', [1]),
+    ('memo fun make(n) { return {"v": [n]} } a = make(1) a["v"].push_back(2) make(1)', {"v": [1]}),
+    ('memo fun make(n) { return [n].vector() } a = make(1) a[0] = 5 make(1).list()', [1]),
+])
+def test_memo_results_are_copied(interpreter, source, expected):
+    assert run_program(source, interpreter) == expected
+
+def test_vm_runs_deep_memo_recursion_on_its_own_stack():
+    interpreter = VirtualMachine()
+    source = (MEMO_FIB + 'memo fun count(n) { if n == 0 then return 0 return count(n - 1) } '
+              'memo fun depth(n) { if n == 0 then return 0 return 1 + depth(n - 1) } '
+              '[fib(200), count(3000), depth(5000)]')
+    a, b = 0, 1
+    for _ in range(200):
+        a, b = b, a + b
+    assert run_program(source, interpreter) == [a, 0, 5000]
+    assert interpreter.memo_stats()["depth"] == {"hits": 0, "misses": 5001, "size": 5001}
+    assert run_program('[count(3000), depth(4000)]', interpreter) == [0, 4000]
+
+def test_plain_functions_are_not_memoised(interpreter):
+    run_program('fun f(x) { return x } f(1) f(1)', interpreter)
+    assert interpreter.memo_stats() == {}
+
+def test_memo_is_a_statement_keyword():
+    tokens = Tokenizer('memo fun f() { return 1 }').tokenize()
+    assert tokens[0].type == TokenType.MEMO
+    function = Parser(tokens).parse_program().statements[0]
+    assert function.memo and function.name == "f"
+    with pytest.raises(SyntaxError):
+        Parser(Tokenizer('memo x').tokenize_compact()).parse_program()
+
+def test_memo_flag_survives_the_parse_cache(tmp_path):
+    from arena import ArenaInterpreter
+    from cache import load_program
+    script = tmp_path / "memo.txt"
+    script.write_text(MEMO_FIB + 'fib(40)')
+    for _ in range(2):
+        interpreter = ArenaInterpreter()
+        assert interpreter.run(load_program(str(script))) == 102334155
+        assert interpreter.memo_stats()["fib"]["misses"] == 41
+
+def test_program_runs_keep_separate_memo_caches(engine_name):
+    from program import Program
+    program = Program(MEMO_FIB + 'fib(n)', engine_name)
+    assert [program.run({"n": n}) for n in (10, 20, 30)] == [55, 6765, 832040]
+
+# ---------------------------
+# Stage 27: Inline Cache Tests
+# ---------------------------
+
+@pytest.mark.parametrize("source, expected", [
+    # Rebinding the name a call site calls through switches to the new function.
+    ('fun f() { return 1 } fun g() { return 2 } h = f r = [] i = 0 '
+     'while i < 4 { r.push_back(h()) if i == 1 then h = g i = i + 1 } r', [1, 1, 2, 2]),
+    # One call site alternating between a native and a function.
+    ('fun size(xs) { return 0 } fs = [len, size, len, size] r = [] i = 0 '
+     'while i < 4 { r.push_back(fs[i]([1, 2])) i = i + 1 } r', [2, 0, 2, 0]),
+    # Functions redefined in a loop are called afresh.
+    ('r = [] i = 0 while i < 3 { fun f(x) { return x * i } r.push_back(f(10)) i = i + 1 } r', [0, 10, 20]),
+    # A global of the same name hides a builtin, before and after the builtin has been used.
+    ('a = len([1]) len = 5 a + len', 6),
+    ('a = len([1]) fun len(x) { return 42 } a + len([1])', 43),
+    ('memo fun m(x) { return x } fun p(x) { return x } h = p h(1) h = m h(1) h(1)', 1),
+])
+def test_call_sites_follow_their_callee(interpreter, source, expected):
+    assert run_program(source, interpreter) == expected
+
+def test_cached_call_site_still_checks_argument_count(interpreter):
+    with pytest.raises(Exception, match="argument count mismatch"):
+        run_program('fun one(a) { return a } fun two(a, b) { return a } h = one h(1) h = two h(1)', interpreter)
+
+def test_tree_call_site_remembers_its_function():
+    program = Parser(Tokenizer('fun f(a) { return a } f(1)').tokenize_compact()).parse_program()
+    Interpreter().evaluate(program)
+    call = program.statements[1]
+    assert call.site[0] is program.statements[0]
+
+def test_bytecode_loads_builtin_names_separately():
+    from bytecode import BytecodeCompiler
+    program = Parser(Tokenizer('xs = [1] len(xs)').tokenize_compact()).parse_program()
+    listing = BytecodeCompiler().compile_program(program).disassemble()
+    assert "LOAD_BUILTIN" in listing and "(len)" in listing
+    assert "LOAD_NAME" in listing and "(xs)" in listing
+
+# ---------------------------
+# Stage 28: Profiler Tests
+# ---------------------------
+
+PROFILED_SOURCE = '''fun fib(n) {
+    if n < 2 then return n
+    return fib(n - 1) + fib(n - 2)
+}
+fun twice(n) { return fib(n) + fib(n) }
+x = twice(10)
+'''
+
+def profile_source(source):
+    from profiler import Profiler
+    profiler = Profiler()
+    interpreter = Interpreter(profiler=profiler)
+    run_program(source, interpreter)
+    return profiler, interpreter
+
+def test_profiler_counts_calls_and_times():
+    profiler, interpreter = profile_source(PROFILED_SOURCE)
+    assert interpreter.variables["x"] == 110
+    calls = {func.name: stats[0] for func, stats in profiler.functions.items()}
+    assert calls == {"fib": 354, "twice": 1}
+    for calls, inclusive, exclusive, active in profiler.functions.values():
+        assert 0 <= exclusive <= inclusive <= profiler.total and active == 0
+    fib_inclusive = next(stats[1] for func, stats in profiler.functions.items() if func.name == "fib")
+    twice_inclusive = next(stats[1] for func, stats in profiler.functions.items() if func.name == "twice")
+    assert fib_inclusive <= twice_inclusive  # Recursive calls are counted once.
+
+def test_profiler_collapsed_stacks():
+    import re
+    profiler, _ = profile_source(PROFILED_SOURCE)
+    lines = profiler.collapsed_stacks().splitlines()
+    assert all(re.fullmatch(r"<program>(;\w+)* \d+", line) for line in lines)
+    paths = {line.rsplit(" ", 1)[0] for line in lines}
+    assert "<program>;twice;fib;fib" in paths
+    assert sum(seconds for seconds in profiler.stacks.values()) == pytest.approx(profiler.total)
+
+def test_profiler_reports_statement_lines(tmp_path):
+    from main import profile_file
+    script = tmp_path / "profiled.txt"
+    script.write_text(PROFILED_SOURCE)
+    profiler = profile_file(str(script))
+    lines = {profiler.lines[node]: stats[0] for node, stats in profiler.statements.items()}
+    assert lines[2] == 354 and lines[3] == 176 and lines[6] == 1
+    report = profiler.report()
+    assert "fib" in report and "twice" in report and "Total time" in report
+
+def test_profiler_needs_the_tree_engine():
+    from profiler import Profiler
+    with pytest.raises(ValueError):
+        Profiler().attach(ClosureInterpreter())
+
+def test_profiler_detaches():
+    from profiler import Profiler
+    profiler, interpreter = profile_source('fun f() { return 1 } f()')
+    profiler.detach(interpreter)
+    assert "evaluate" not in vars(interpreter)
+    run_program('f()', interpreter)
+    assert next(iter(profiler.functions.values()))[0] == 1
+
+def test_profile_flags():
+    from main import parse_args
+    args = parse_args(["script.txt", "--profile", "--profile-stacks", "out.txt"])
+    assert args.profile and args.profile_stacks == "out.txt"
+    with pytest.raises(SystemExit):
+        parse_args(["script.txt", "--profile", "--engine", "vm"])
+
+# ---------------------------
+# Stage 29: Benchmark Suite Tests
+# ---------------------------
+
+def test_mann_whitney_exact_distribution():
+    from itertools import combinations
+    from bench import _u_counts, mann_whitney_p
+    for m, n in [(3, 4), (5, 5), (2, 6)]:
+        counts = [0] * (m * n + 1)
+        for positions in combinations(range(m + n), m):
+            chosen = set(positions)
+            counts[sum(sum(1 for q in range(p) if q not in chosen) for p in positions)] += 1
+        assert _u_counts(m, n) == counts
+    assert mann_whitney_p([1, 2, 3, 4, 5], [6, 7, 8, 9, 10]) == pytest.approx(1 / 252)
+    assert mann_whitney_p([6, 7, 8, 9, 10], [1, 2, 3, 4, 5]) == 1.0
+
+def test_compare_flags_only_significant_changes():
+    from bench import compare
+    def results(**timings):
+        return {"repeat": 5, "results": {key: {"timings": values, "median": sorted(values)[2]}
+                                         for key, values in timings.items()}}
+    baseline = results(slow=[1.0, 1.01, 1.02, 1.03, 1.04], fast=[1.0, 1.01, 1.02, 1.03, 1.04],
+                       noisy=[1.0, 1.5, 1.02, 1.6, 1.04], same=[1.0, 1.01, 1.02, 1.03, 1.04])
+    current = results(slow=[1.5, 1.51, 1.52, 1.53, 1.54], fast=[0.5, 0.51, 0.52, 0.53, 0.54],
+                      noisy=[1.1, 1.05, 1.55, 1.01, 1.7], same=[1.005, 1.015, 1.025, 1.035, 1.045])
+    verdicts = {row[0]: row[-1] for row in compare(baseline, current)}
+    assert verdicts == {"slow": "REGRESSION", "fast": "faster", "noisy": "", "same": ""}
+
+def test_benchmark_suite_writes_results(tmp_path):
+    import json
+    from bench import main
+    output = tmp_path / "results.json"
+    assert main(["run", "--only", "calls", "--warmup", "0", "--repeat", "2", "--engine", "vm",
+                 "--output", str(output)]) == 0
+    results = json.loads(output.read_text())
+    assert set(results["results"]) == {"calls/tokenize", "calls/parse", "calls/evaluate/vm"}
+    assert len(results["results"]["calls/evaluate/vm"]["timings"]) == 2
+    assert main(["compare", str(output), str(output)]) == 0
+
 # Run the tests with: pytest test_interpreter.py
 if __name__ == '__main__':
     pytest.main()
@@ -0,0 +1,245 @@
+# vectors.py
+# Numeric vectors: lists of numbers stored unboxed in an array('q') of 64-bit integers or an array('d') of floats.
+# A program makes one from a list with [1, 2, 3].vector(). Arithmetic (+ - * /) between two vectors of the same length,
+# or between a vector and a number, works element by element and produces a new vector, so a loop over the elements
+# becomes a single operation. The comparisons v.eq(w), v.ne(w), v.lt(w), v.le(w), v.gt(w) and v.ge(w) work the same way
+# and produce a vector of 1s and 0s, while == and != compare whole vectors and produce true or false, as they do for
+# lists. The operators < <= > and >= raise an error that points to those methods. Element access, assignment, push_back
+# and remove work as they do on lists, and v.sum() and v.list() add up the elements and turn the vector back into a list.
+# Integers that do not fit in 64 bits, whether stored or produced by arithmetic, turn the vector into one of floats, just
+# as storing a float does, and both backends agree on the result.
+# When NumPy is installed the element-wise loops run in NumPy over the array's buffer without copying it; otherwise
+# they run through map() over operator functions, which still keeps the per-element work out of the interpreter.
+
+import operator
+from array import array
+from itertools import repeat
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+INT, FLOAT = 'q', 'd'  # Array typecodes of integer and float vectors
+_DTYPES = {INT: "int64", FLOAT: "float64"}
+_INT_MIN, _INT_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+def vector(values):
+    """Returns a Vector of the numbers in values: of integers if all of them are, else of floats."""
+    values = list(values)
+    for value in values:
+        if not _is_number(value):
+            raise Exception(f"Vectors can only hold numbers, not {value!r}")
+    if all(isinstance(value, int) for value in values):
+        return _int_vector(values)
+    return Vector(_floats(values))
+
+def _is_number(value):
+    return isinstance(value, (int, float))
+
+def _int_vector(values):
+    """Returns a Vector of the integers in values, or of floats if one of them does not fit in 64 bits.
+    values is iterated again in that case, so it must not be an iterator."""
+    try:
+        return Vector(array(INT, values))
+    except OverflowError:
+        return Vector(_floats(values))
+
+def _floats(values):
+    try:
+        return array(FLOAT, values)
+    except OverflowError:
+        raise Exception("Number too large for a vector") from None
+
+def _magnitude(data):
+    """Returns the largest absolute value in an int64 NumPy array, or of a number, as a Python int."""
+    if not isinstance(data, numpy.ndarray):
+        return abs(data)
+    if not len(data):
+        return 0
+    return max(-data.min().item(), data.max().item())
+
+def _as_numpy(data):
+    if not data:
+        return numpy.empty(0, _DTYPES[data.typecode])
+    return numpy.frombuffer(data, _DTYPES[data.typecode])
+
+
+class Vector:
+    """A list of numbers with element-wise arithmetic and comparisons."""
+    __slots__ = ('data',)
+    __hash__ = None  # Mutable, like a list
+
+    def __init__(self, data):
+        self.data = data  # array('q') or array('d')
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __bool__(self):
+        return len(self.data) > 0
+
+    def __getitem__(self, index):
+        return self.data[index]
+
+    def __setitem__(self, index, value):
+        self.data[index] = self._fit(value)
+
+    def __repr__(self):
+        return repr(self.data.tolist())
+
+    def tolist(self):
+        return self.data.tolist()
+
+    def _fit(self, value):
+        """Checks that value can be stored, turning an integer vector into a float one for a float."""
+        if not _is_number(value):
+            raise Exception(f"Vectors can only hold numbers, not {value!r}")
+        if self.data.typecode == INT and (isinstance(value, float) or not _INT_MIN <= value <= _INT_MAX):
+            self.data = array(FLOAT, self.data)
+        if self.data.typecode == FLOAT and isinstance(value, int):
+            return _floats((value,))[0]
+        return value
+
+    def append(self, value):
+        value = self._fit(value)  # Before self.data is looked up, as _fit may replace it.
+        self.data.append(value)
+
+    def pop(self, index):
+        return self.data.pop(index)
+
+    def index(self, value):
+        return self.data.index(value)
+
+    def sum(self):
+        if numpy is not None:
+            values = _as_numpy(self.data)
+            # NumPy adds integers modulo 2**64, so only when no partial sum can overflow.
+            if self.data.typecode == FLOAT or _magnitude(values) * len(values) <= _INT_MAX:
+                return values.sum().item()
+        return sum(self.data)
+
+    def elementwise(self, other, op, typecode=None, reflected=False):
+        """Applies op between each element and the matching element of other, or other itself if it is a number.
+        The result holds typecode, or integers when both operands do and floats otherwise."""
+        if isinstance(other, Vector):
+            if len(other.data) != len(self.data):
+                raise Exception(f"Vector length mismatch: {len(self.data)} and {len(other.data)}")
+            other_data = other.data
+            other_typecode = other_data.typecode
+        elif _is_number(other):
+            other_data = other
+            other_typecode = INT if isinstance(other, int) else FLOAT
+            if other_typecode == INT and not _INT_MIN <= other <= _INT_MAX and (self.data.typecode == FLOAT
+                                                                               or typecode is not None):
+                # Only integer arithmetic keeps an integer this large exact; everything else works in floats.
+                other_data, other_typecode = _floats((other,))[0], FLOAT
+        else:
+            return NotImplemented
+        # Integer arithmetic can overflow 64 bits, and then gives floats; comparisons and division cannot.
+        checked = typecode is None and self.data.typecode == INT and other_typecode == INT
+        if typecode is None:
+            typecode = INT if checked else FLOAT
+        left, right = (other_data, self.data) if reflected else (self.data, other_data)
+        if numpy is not None:
+            numpy_left = _as_numpy(left) if isinstance(left, array) else left
+            numpy_right = _as_numpy(right) if isinstance(right, array) else right
+            if checked:
+                # Bound every result by the largest operands, as NumPy would silently wrap around.
+                bound_left, bound_right = _magnitude(numpy_left), _magnitude(numpy_right)
+                bound = bound_left * bound_right if op is operator.mul else bound_left + bound_right
+            if not checked or bound <= _INT_MAX:
+                return Vector(array(typecode, op(numpy_left, numpy_right).astype(_DTYPES[typecode]).tobytes()))
+        if not isinstance(left, array):
+            left = repeat(left)
+        if not isinstance(right, array):
+            right = repeat(right)
+        if checked:
+            try:
+                return Vector(array(INT, map(op, left, right)))
+            except OverflowError:
+                return Vector(_floats(list(map(op, left, right))))
+        return Vector(array(typecode, map(op, left, right)))
+
+    def __add__(self, other):
+        return self.elementwise(other, operator.add)
+
+    def __radd__(self, other):
+        return self.elementwise(other, operator.add, reflected=True)
+
+    def __sub__(self, other):
+        return self.elementwise(other, operator.sub)
+
+    def __rsub__(self, other):
+        return self.elementwise(other, operator.sub, reflected=True)
+
+    def __mul__(self, other):
+        return self.elementwise(other, operator.mul)
+
+    def __rmul__(self, other):
+        return self.elementwise(other, operator.mul, reflected=True)
+
+    def __truediv__(self, other):
+        return self.elementwise(other, _divide, FLOAT)
+
+    def __rtruediv__(self, other):
+        return self.elementwise(other, _divide, FLOAT, reflected=True)
+
+    def __round__(self, digits=None):
+        if numpy is not None:
+            return Vector(array(FLOAT, numpy.round(_as_numpy(self.data), digits or 0).tobytes()))
+        return Vector(array(FLOAT, map(round, self.data, repeat(digits or 0))))
+
+    def __neg__(self):
+        return self.elementwise(-1, operator.mul)
+
+    def __eq__(self, other):
+        """Whole-vector equality, a plain bool, so that vectors can be tested in conditions and found in lists."""
+        if not isinstance(other, Vector):
+            return NotImplemented
+        return self.data == other.data
+
+    def _order(self, other):
+        raise Exception("Vectors cannot be compared with <, <=, > or >=; "
+                        "use .lt(), .le(), .gt() or .ge() for element-wise comparisons")
+
+    __lt__ = __le__ = __gt__ = __ge__ = _order
+
+    def compare(self, other, op):
+        """Compares each element with the matching element of other, or other itself, giving a vector of 1s and 0s."""
+        result = self.elementwise(other, op, INT)
+        if result is NotImplemented:
+            raise Exception(f"Cannot compare a vector with {other!r}")
+        return result
+
+    def eq(self, other):
+        return self.compare(other, operator.eq)
+
+    def ne(self, other):
+        return self.compare(other, operator.ne)
+
+    def lt(self, other):
+        return self.compare(other, operator.lt)
+
+    def le(self, other):
+        return self.compare(other, operator.le)
+
+    def gt(self, other):
+        return self.compare(other, operator.gt)
+
+    def ge(self, other):
+        return self.compare(other, operator.ge)
+
+
+def _divide(left, right):
+    """Element-wise division, which fails on a zero divisor with either backend."""
+    if numpy is not None and isinstance(right, numpy.ndarray):
+        if not right.all():
+            raise ZeroDivisionError("division by zero")
+    elif numpy is not None and right == 0:
+        raise ZeroDivisionError("division by zero")
+    return left / right
@@ -0,0 +1,264 @@
+# vm.py
+# The VirtualMachine is a stack-based execution engine for the Code objects produced by bytecode.py.
+# It runs a single flat dispatch loop instead of recursing through Interpreter.evaluate for every sub-expression,
+# and behaves exactly like the tree-walking Interpreter.
+# The language call stack is kept in a Python list of suspended frames rather than on the Python stack, so deep recursion
+# runs in constant Python stack space, and tail calls reuse the current frame's place on it so tail-recursive loops run in
+# constant memory. A memo function gets a frame on the same stack, and its result is cached when that frame returns, so
+# memoised recursion is as deep as any other.
+
+from interpreter import Interpreter
+from bytecode import *
+from runtime import BINARY_OPERATORS, UNSET, unknown_binary, map_error, memo_key
+from resolver import closure, enclosing_frame
+
+
+RETURN_ONLY = Code("<return>", [RETURN_VALUE, 0], (), ())  # Resumed to return a result straight to the caller
+
+
+class VirtualMachine(Interpreter):
+    """Evaluates an AST by compiling it to bytecode and running it on a value stack."""
+    max_call_depth = 1_000_000  # Guards against runaway recursion exhausting memory.
+
+    def __init__(self, budget=None):
+        super().__init__(budget)
+        self.compiler = BytecodeCompiler()
+        # Indexed like bytecode.OPERATORS, from this interpreter's operator table.
+        self.operators = tuple(self.binary_operators[name] for name in BINARY_OPERATORS) + (unknown_binary,)
+
+    def evaluate(self, expr):
+        return self.run(self.compiler.compile_program(expr), self.frame)
+
+    def prepare(self, program):
+        program = super().prepare(program)
+        for node in walk(program):
+            if isinstance(node, Function):
+                self.compiler.function_code(node)
+        return self.compiler, self.compiler.compile_program(program)
+
+    def run_prepared(self, prepared):
+        self.compiler, code = prepared
+        return self.run(code, self.frame)
+
+    def call_function(self, func, args):
+        code, frame = self.enter_function(func, args)
+        return self.run(code, frame)
+
+    def enter_function(self, func, args):
+        """Returns the code to run for a call and a fresh frame holding its arguments."""
+        # Check parameter count
+        if len(args) != len(func.parameters):
+            raise Exception("Function argument count mismatch")
+        code = self.compiler.function_code(func)
+        frame = [UNSET] * len(code.local_names)
+        frame[:len(args)] = args
+        frame[-2] = func
+        frame[-1] = self.frame
+        return code, frame
+
+    def run(self, code, frame):
+        variables = self.variables
+        # Suspended callers as (code, pc, stack, frame, memo), innermost last. memo is the (MemoCache, key) to store the
+        # result of the call under when it returns, for a call to a memo function, else None.
+        callers = []
+        instructions = code.instructions
+        consts = code.consts
+        names = code.names
+        operators = self.operators
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        pc = 0
+        while True:
+            op = instructions[pc]
+            arg = instructions[pc + 1]
+            pc += 2
+            # Opcodes are tested roughly in order of how often they are executed.
+            if op == LOAD_NAME:
+                try:
+                    push(variables[names[arg]])
+                except KeyError:
+                    push(self.lookup_builtin(names[arg], frame))
+            elif op == LOAD_FAST:
+                value = frame[arg]
+                if value is UNSET:
+                    name = code.local_names[arg]
+                    try:
+                        value = variables[name]
+                    except KeyError:
+                        value = self.lookup_builtin(name, frame)
+                push(value)
+            elif op == LOAD_CONST:
+                push(consts[arg])
+            elif op == BINARY_OP:
+                right = pop()
+                stack[-1] = operators[arg](stack[-1], right)
+            elif op == STORE_FAST:
+                frame[arg] = stack[-1]
+            elif op == STORE_NAME:
+                variables[names[arg]] = stack[-1]
+            elif op == POP_TOP:
+                pop()
+            elif op == POP_JUMP_IF_FALSE:
+                if not pop():
+                    pc = arg
+            elif op == JUMP:
+                if arg < pc:
+                    # A jump back to a loop condition: charge the instructions of one iteration.
+                    self.fuel -= (pc - arg) >> 1
+                    if self.fuel < 0:
+                        self.checkpoint()
+                pc = arg
+            elif op == LOAD_BUILTIN:
+                # Not a KeyError handler as in LOAD_NAME, since the name is usually missing from the globals.
+                value = variables.get(names[arg], UNSET)
+                push(self.lookup_builtin(names[arg], frame) if value is UNSET else value)
+            elif op == CALL or op == TAIL_CALL:
+                args = stack[len(stack) - arg:]
+                del stack[len(stack) - arg:]
+                callee = pop()
+                memo = None
+                is_function = isinstance(callee, Function)
+                if not is_function or callee.memo:
+                    if is_function:
+                        # A memo function returns its cached result here. Otherwise it runs in a frame of its own, even
+                        # in tail position, and RETURN_VALUE caches the result.
+                        memo = (self.memo_cache(callee), memo_key(args))
+                        result = memo[0].get(memo[1])
+                    else:
+                        # Natives run to completion here, with no frame on the VM's call stack.
+                        result = self.call_native(callee, args)
+                    if result is UNSET:
+                        if op == TAIL_CALL:
+                            # The frame it replaces may have a result of its own to cache, so it returns through
+                            # RETURN_ONLY instead, which passes the result on once RETURN_VALUE has cached it.
+                            if len(callers) >= self.max_call_depth:
+                                raise Exception("Maximum call depth exceeded")
+                            callers.append((RETURN_ONLY, 0, [], frame, memo))
+                            memo = None
+                    elif op == CALL:
+                        push(result)
+                        continue
+                    else:
+                        # In tail position, the result is returned as RETURN_VALUE would.
+                        if not callers:
+                            return result
+                        code, pc, stack, frame, memo = callers.pop()
+                        if memo is not None:
+                            memo[0].put(memo[1], result)
+                        instructions = code.instructions
+                        consts = code.consts
+                        names = code.names
+                        push = stack.append
+                        pop = stack.pop
+                        push(result)
+                        continue
+                if op == CALL:
+                    if len(callers) >= self.max_call_depth:
+                        raise Exception("Maximum call depth exceeded")
+                    callers.append((code, pc, stack, frame, memo))
+                    stack = []
+                    push = stack.append
+                    pop = stack.pop
+                # A tail call simply replaces the code and frame of the current call.
+                site = code.sites.get(pc)
+                if site is None or site[0] is not callee:
+                    # Remember the function's code, so that calling it again from here skips looking it up.
+                    if len(args) != len(callee.parameters):
+                        raise Exception("Function argument count mismatch")
+                    site = code.sites[pc] = (callee, self.compiler.function_code(callee))
+                code = site[1]
+                # The caller link of a tail call keeps the replaced frame for name lookups, unless the function is
+                # calling itself, so that a tail-recursive loop does not build a chain of frames.
+                caller = frame if op == CALL or frame[-2] is not callee else frame[-1]
+                frame = [UNSET] * len(code.local_names)
+                frame[:len(args)] = args
+                frame[-2] = callee
+                frame[-1] = caller
+                instructions = code.instructions
+                self.fuel -= len(instructions) >> 1
+                if self.fuel < 0:
+                    self.checkpoint()
+                consts = code.consts
+                names = code.names
+                pc = 0
+            elif op == LOAD_INDEX:
+                index_val = pop()
+                list_val = pop()
+                try:
+                    if type(list_val) is dict:
+                        push(list_val[index_val])
+                    else:
+                        push(list_val[int(index_val)])
+                except Exception as e:
+                    if type(list_val) is dict:
+                        raise map_error(index_val, e)
+                    raise Exception(f"Error accessing list at index {index_val}: {e}")
+            elif op == UNARY_OP:
+                stack[-1] = UNARY[arg](stack[-1])
+            elif op == CALL_MEMBER:
+                member_name, argc = consts[arg]
+                args = stack[len(stack) - argc:]
+                del stack[len(stack) - argc:]
+                object_val = pop()
+                push(self.call_member(object_val, member_name, args))
+            elif op == STORE_INDEX:
+                index_val = pop()
+                list_val = pop()
+                try:
+                    if type(list_val) is dict:
+                        list_val[index_val] = stack[-1]
+                    else:
+                        list_val[int(index_val)] = stack[-1]
+                except Exception as e:
+                    if type(list_val) is dict:
+                        raise map_error(index_val, e)
+                    raise Exception(f"Error assigning list element at index {index_val}: {e}")
+            elif op == BUILD_LIST:
+                elements = stack[len(stack) - arg:]
+                del stack[len(stack) - arg:]
+                self.allocated += arg
+                push(elements)
+            elif op == BUILD_MAP:
+                entries = stack[len(stack) - 2 * arg:]
+                del stack[len(stack) - 2 * arg:]
+                self.allocated += arg
+                result = {}
+                for position in range(0, len(entries), 2):
+                    try:
+                        result[entries[position]] = entries[position + 1]
+                    except TypeError as e:
+                        raise map_error(entries[position], e)
+                push(result)
+            elif op == BUILD_CONST_LIST:
+                self.allocated += len(consts[arg])
+                push(list(consts[arg]))
+            elif op == PRINT:
+                print(">>", stack[-1], file=self.stdout)
+            elif op == RETURN_VALUE:
+                result = pop()
+                if not callers:
+                    return result
+                code, pc, stack, frame, memo = callers.pop()
+                if memo is not None:
+                    memo[0].put(memo[1], result)
+                instructions = code.instructions
+                consts = code.consts
+                names = code.names
+                push = stack.append
+                pop = stack.pop
+                push(result)
+            elif op == LOAD_DEREF:
+                depth, slot, name = consts[arg]
+                value = enclosing_frame(frame, depth)[slot]
+                if value is UNSET:
+                    value = variables.get(name, UNSET)
+                    if value is UNSET:
+                        value = self.lookup_builtin(name, frame)
+                push(value)
+            elif op == MAKE_CLOSURE:
+                push(closure(consts[arg], frame))
+            elif op == RAISE:
+                raise Exception(consts[arg])
+            else:
+                raise Exception(f"Unknown opcode: {op}")